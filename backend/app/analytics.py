@@ -0,0 +1,285 @@
+# app/analytics.py
+"""
+Motor analítico columnar: carga las filas de combustible/mantenimiento de una
+empresa en arrays NumPy (índice de vehículo, día como entero, montos, costos)
+y calcula sumas agrupadas, medias, percentiles y ventanas móviles vectorizados.
+Lo usan los endpoints con ventana de fechas (/fuel/analysis/consumption,
+/fuel/analysis/trends, /maintenance/analysis/costs, métricas por vehículo).
+
+NumPy es opcional: sin él (o con pocas filas) se usa el camino en Python puro
+de fuel_stats, con los mismos resultados.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from .fuel_stats import FuelAggregate, aggregate_fuel, group_fuel_by_period, group_fuel_by_vehicle
+
+try:
+    import numpy as np
+except ImportError:  # analítica vectorizada opcional
+    np = None
+
+# Por debajo de este tamaño construir los arrays cuesta más que el loop
+VECTORIZE_MIN_ROWS = 2000
+
+EPOCH = date(1970, 1, 1)
+
+def vectorized(rows: Sequence) -> bool:
+    return np is not None and len(rows) >= VECTORIZE_MIN_ROWS
+
+def _column(records: Sequence[dict], field: str):
+    return np.fromiter((record.get(field) or 0 for record in records), dtype=np.float64, count=len(records))
+
+def _days(records: Sequence[dict], field: str = "date"):
+    """Fechas ISO -> días desde 1970-01-01; NaT para fechas ausentes o inválidas"""
+    values = [(record.get(field) or "")[:10] or "NaT" for record in records]
+    try:
+        return np.array(values, dtype="datetime64[D]")
+    except ValueError:
+        parsed = []
+        for value in values:
+            try:
+                parsed.append(np.datetime64(value, "D"))
+            except ValueError:
+                parsed.append(np.datetime64("NaT"))
+        return np.array(parsed, dtype="datetime64[D]")
+
+def _period_index(days, granularity: str):
+    """Día -> inicio de su periodo, como datetime64[D]"""
+    if granularity == "month":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    if granularity == "week":
+        # 1970-01-01 fue jueves: desplazar 3 días alinea las semanas al lunes
+        offset = days.astype(np.int64) + 3
+        return (offset - offset % 7 - 3).astype("datetime64[D]")
+    return days
+
+class FuelColumns:
+    """Registros de combustible de una empresa en formato columnar"""
+    __slots__ = ("vehicle_ids", "vehicle", "day", "fuel", "miles", "cost", "consumption")
+
+    def __init__(self, records: Sequence[dict]):
+        vehicle_ids, vehicle = np.unique(
+            np.array([record["vehicle_id"] for record in records], dtype=object).astype(str),
+            return_inverse=True
+        )
+        self.vehicle_ids: List[str] = vehicle_ids.tolist()
+        self.vehicle = vehicle.ravel()
+        self.day = _days(records)
+        self.fuel = _column(records, "fuel_amount")
+        self.miles = _column(records, "miles_driven")
+        self.cost = _column(records, "total_cost")
+        self.consumption = _column(records, "consumption")
+
+    def __len__(self) -> int:
+        return len(self.vehicle)
+
+    @staticmethod
+    def _aggregates(groups, size: int, fuel, miles, cost, consumption) -> List[FuelAggregate]:
+        """Un FuelAggregate por grupo 0..size-1 (bincount + min/max con ufunc.at)"""
+        count = np.bincount(groups, minlength=size)
+        sums = [np.bincount(groups, weights=column, minlength=size) for column in (fuel, miles, cost, consumption)]
+        low = np.full(size, np.inf)
+        high = np.full(size, -np.inf)
+        np.minimum.at(low, groups, consumption)
+        np.maximum.at(high, groups, consumption)
+
+        aggregates = []
+        for n, f, m, c, s, lo, hi in zip(count.tolist(), *(column.tolist() for column in sums), low.tolist(), high.tolist()):
+            aggregate = FuelAggregate()
+            if n:
+                aggregate.count = n
+                aggregate.fuel, aggregate.miles, aggregate.cost, aggregate.consumption_sum = f, m, c, s
+                aggregate.min_consumption, aggregate.max_consumption = lo, hi
+            aggregates.append(aggregate)
+        return aggregates
+
+    def totals(self) -> FuelAggregate:
+        groups = np.zeros(len(self), dtype=np.int64)
+        return self._aggregates(groups, 1, self.fuel, self.miles, self.cost, self.consumption)[0]
+
+    def by_vehicle(self) -> Dict[str, FuelAggregate]:
+        aggregates = self._aggregates(self.vehicle, len(self.vehicle_ids), self.fuel, self.miles, self.cost, self.consumption)
+        return {vehicle_id: aggregate for vehicle_id, aggregate in zip(self.vehicle_ids, aggregates) if aggregate.count}
+
+    def by_period(self, granularity: str) -> Dict[Tuple[Optional[str], str], FuelAggregate]:
+        """Mismo resultado que fuel_stats.group_fuel_by_period"""
+        valid = ~np.isnat(self.day)
+        periods = _period_index(self.day[valid], granularity).astype(np.int64)
+        vehicle = self.vehicle[valid]
+        columns = [column[valid] for column in (self.fuel, self.miles, self.cost, self.consumption)]
+
+        # Clave combinada periodo x (empresa=0 | vehículo+1); cada fila cuenta en ambos
+        slots = len(self.vehicle_ids) + 1
+        keys = np.concatenate([periods * slots, periods * slots + vehicle + 1])
+        unique_keys, groups = np.unique(keys, return_inverse=True)
+        aggregates = self._aggregates(groups.ravel(), len(unique_keys), *(np.concatenate([column, column]) for column in columns))
+
+        result = {}
+        for key, aggregate in zip(unique_keys.tolist(), aggregates):
+            period, slot = divmod(key, slots)
+            vehicle_id = self.vehicle_ids[slot - 1] if slot else None
+            result[(vehicle_id, (EPOCH + timedelta(days=period)).isoformat())] = aggregate
+        return result
+
+    def percentiles(self, q: Sequence[float], by_vehicle: bool = False):
+        """Percentiles de consumo (0-100) de la empresa o de cada vehículo"""
+        if not by_vehicle:
+            return dict(zip(q, np.percentile(self.consumption, q).tolist())) if len(self) else {}
+        order = np.lexsort((self.consumption, self.vehicle))
+        bounds = np.searchsorted(self.vehicle[order], np.arange(len(self.vehicle_ids) + 1))
+        values = self.consumption[order]
+        return {
+            vehicle_id: dict(zip(q, np.percentile(values[start:end], q).tolist()))
+            for vehicle_id, start, end in zip(self.vehicle_ids, bounds[:-1], bounds[1:])
+            if end > start
+        }
+
+    def rolling(self, window_days: int, field: str = "cost") -> List[Tuple[str, float]]:
+        """Suma móvil diaria de `field` en una ventana de `window_days` días"""
+        valid = ~np.isnat(self.day)
+        if not valid.any():
+            return []
+        days = self.day[valid].astype(np.int64)
+        first = int(days.min())
+        daily = np.bincount(days - first, weights=getattr(self, field)[valid])
+        cumulative = np.concatenate([[0.0], np.cumsum(daily)])
+        index = np.arange(len(daily))
+        window = cumulative[index + 1] - cumulative[np.maximum(index + 1 - window_days, 0)]
+        return [
+            ((EPOCH + timedelta(days=first + i)).isoformat(), value)
+            for i, value in enumerate(window.tolist())
+        ]
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Percentil con interpolación lineal (mismo criterio que numpy.percentile)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+ROLLING_FIELDS = {"cost": "total_cost", "fuel": "fuel_amount", "miles": "miles_driven", "consumption": "consumption"}
+
+class FuelAnalytics:
+    """
+    Punto de entrada para rollups y endpoints: arma los arrays una sola vez
+    si NumPy está disponible y hay filas suficientes; si no, Python puro
+    """
+    def __init__(self, records: Sequence[dict]):
+        self.records = records
+        self.columns = FuelColumns(records) if vectorized(records) else None
+
+    def totals(self) -> FuelAggregate:
+        return self.columns.totals() if self.columns else aggregate_fuel(self.records)
+
+    def by_vehicle(self) -> Dict[str, FuelAggregate]:
+        return self.columns.by_vehicle() if self.columns else group_fuel_by_vehicle(self.records)
+
+    def by_period(self, granularity: str) -> Dict[Tuple[Optional[str], str], FuelAggregate]:
+        if self.columns:
+            return self.columns.by_period(granularity)
+        return group_fuel_by_period(self.records, granularity)
+
+    def percentiles(self, q: Sequence[float], by_vehicle: bool = False):
+        if self.columns:
+            return self.columns.percentiles(q, by_vehicle)
+        if not by_vehicle:
+            values = [record.get("consumption") or 0 for record in self.records]
+            return {p: percentile(values, p) for p in q} if values else {}
+        grouped = defaultdict(list)
+        for record in self.records:
+            grouped[record["vehicle_id"]].append(record.get("consumption") or 0)
+        return {vehicle_id: {p: percentile(values, p) for p in q} for vehicle_id, values in grouped.items()}
+
+    def rolling(self, window_days: int, field: str = "cost") -> List[Tuple[str, float]]:
+        if self.columns:
+            return self.columns.rolling(window_days, field)
+
+        daily: Dict[date, float] = defaultdict(float)
+        for record in self.records:
+            try:
+                daily[date.fromisoformat(record["date"][:10])] += record.get(ROLLING_FIELDS[field]) or 0
+            except (KeyError, TypeError, ValueError):
+                continue
+        if not daily:
+            return []
+
+        first, last = min(daily), max(daily)
+        series = [daily.get(first + timedelta(days=i), 0.0) for i in range((last - first).days + 1)]
+        result, running = [], 0.0
+        for i, value in enumerate(series):
+            running += value
+            if i >= window_days:
+                running -= series[i - window_days]
+            result.append(((first + timedelta(days=i)).isoformat(), running))
+        return result
+
+TREND_PERCENTILES = (10, 50, 90)
+
+def consumption_trends(records: Sequence[dict], granularity: str, window_days: int, field: str = "cost") -> dict:
+    """
+    Percentiles de consumo (flota y por vehículo), serie de la flota por
+    periodo y suma móvil diaria de `field`, armando los arrays una sola vez
+    """
+    analytics = FuelAnalytics(records)
+
+    def labeled(values: Dict[float, float]) -> Dict[str, float]:
+        return {f"p{q}": round(value, 2) for q, value in values.items()}
+
+    periods = sorted(
+        (start, aggregate) for (vehicle_id, start), aggregate in analytics.by_period(granularity).items()
+        if vehicle_id is None
+    )
+    return {
+        "percentiles": {
+            "fleet": labeled(analytics.percentiles(TREND_PERCENTILES)),
+            "vehicles": {
+                vehicle_id: labeled(values)
+                for vehicle_id, values in analytics.percentiles(TREND_PERCENTILES, by_vehicle=True).items()
+            }
+        },
+        "periods": [
+            {
+                "period": start,
+                "records": aggregate.count,
+                "fuel": round(aggregate.fuel, 2),
+                "miles": round(aggregate.miles, 2),
+                "cost": round(aggregate.cost, 2),
+                "average_consumption": round(aggregate.average_consumption, 2)
+            }
+            for start, aggregate in periods
+        ],
+        "rolling": {
+            "field": field,
+            "window_days": window_days,
+            "series": [
+                {"date": day, "value": round(value, 2)}
+                for day, value in analytics.rolling(window_days, field)
+            ]
+        }
+    }
+
+def maintenance_costs_by_vehicle(records: Sequence[dict]) -> Dict[str, dict]:
+    """vehicle_id -> {"count", "cost"} del historial de mantenimiento"""
+    if not vectorized(records):
+        totals: Dict[str, dict] = {}
+        for record in records:
+            entry = totals.setdefault(record["vehicle_id"], {"count": 0, "cost": 0.0})
+            entry["count"] += 1
+            entry["cost"] += record.get("cost") or 0
+        return totals
+
+    vehicle_ids, vehicle = np.unique(
+        np.array([record["vehicle_id"] for record in records], dtype=object).astype(str),
+        return_inverse=True
+    )
+    vehicle = vehicle.ravel()
+    count = np.bincount(vehicle, minlength=len(vehicle_ids))
+    cost = np.bincount(vehicle, weights=_column(records, "cost"), minlength=len(vehicle_ids))
+    return {
+        vehicle_id: {"count": n, "cost": c}
+        for vehicle_id, n, c in zip(vehicle_ids.tolist(), count.tolist(), cost.tolist())
+    }
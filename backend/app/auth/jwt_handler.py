@@ -2,7 +2,7 @@
 from datetime import datetime, timedelta
 from typing import Optional
 import jwt
-from fastapi import HTTPException, status, Request
+from fastapi import HTTPException, status, Request, WebSocket
 import os
 from dotenv import load_dotenv
 
@@ -82,6 +82,20 @@ def verify_token_simple(token: str) -> Optional[dict]:
     except Exception:
         return None
 
+def verify_websocket_token(websocket: WebSocket) -> Optional[dict]:
+    """
+    Verifica el JWT del handshake WebSocket. Los navegadores no pueden enviar
+    headers en el handshake, así que se acepta `?token=` además de Authorization
+    """
+    token = websocket.query_params.get("token")
+    if not token:
+        auth_header = websocket.headers.get("Authorization", "")
+        if auth_header.startswith("Bearer "):
+            token = auth_header.replace("Bearer ", "")
+    if not token:
+        return None
+    return verify_token_simple(token)
+
 # =============================================================================
 # FUNCIONES DE AUTORIZACIÓN POR ROLES - OPTIMIZADAS
 # =============================================================================
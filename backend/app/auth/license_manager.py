@@ -1,26 +1,167 @@
 # backend/app/auth/company_manager.py (OPCIONAL - si quieres mantener verificación de empresa)
 from fastapi import HTTPException, Depends
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+from ..batching import BATCH_EVENT_TYPE
+from ..manager import manager
 from ..models.database import get_db
 from .jwt_handler import get_current_user
 
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo que un estado de empresa se considera válido sin volver a la BD
+COMPANY_STATUS_TTL_SECONDS = float(os.getenv("COMPANY_STATUS_TTL_SECONDS", "60"))
+
+# Estados con acceso permitido a la API (trial sigue operando normalmente)
+ALLOWED_COMPANY_STATUSES = {"active", "trial"}
+
+# Eventos que admin publica al cambiar o eliminar una empresa
+COMPANY_EVENT_PREFIX = "COMPANY_"
+
+_MISSING = object()
+
+class CompanyStatusCache:
+    """
+    Cache en memoria del estado de cada empresa (TTL + invalidación explícita)
+    Evita un round trip a `companies` en cada request autenticado.
+
+    Antes de leer una empresa de la BD el worker se suscribe a su canal
+    (manager.watch_company), así los eventos COMPANY_* que publica admin desde
+    cualquier worker invalidan también esta copia. Si la suscripción falla,
+    el TTL es la cota de cuánto puede sobrevivir un estado viejo.
+    """
+    def __init__(self, ttl_seconds: float = COMPANY_STATUS_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[Optional[str], float]] = {}
+        # Invalidaciones por empresa: un miss no cachea lo leído si cambió mientras tanto
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.manager = None
+
+    def attach(self, manager):
+        self.manager = manager
+        manager.add_listener(self.on_event)
+
+    def get(self, company_id: str):
+        """Devuelve el estado cacheado (None = empresa inexistente) o _MISSING si expiró"""
+        entry = self._entries.get(company_id)
+        if entry is None:
+            return _MISSING
+        status, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._entries.pop(company_id, None)
+            return _MISSING
+        return status
+
+    def watch(self, company_id: str) -> int:
+        """Suscribe el worker a la empresa (bloqueante) y devuelve la generación actual"""
+        if self.manager is not None:
+            self.manager.watch_company(company_id)
+        with self._lock:
+            return self._generations.get(company_id, 0)
+
+    def set(self, company_id: str, status: Optional[str], generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(company_id, 0):
+                return
+            self._entries[company_id] = (status, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, company_id: Optional[str] = None):
+        """Invalida una empresa concreta o todo el cache"""
+        with self._lock:
+            if company_id is None:
+                self._entries.clear()
+                for key in self._generations:
+                    self._generations[key] += 1
+            else:
+                self._entries.pop(company_id, None)
+                self._generations[company_id] = self._generations.get(company_id, 0) + 1
+
+    def on_event(self, company_id: str, message: dict, local: bool):
+        events = message.get("events", []) if message.get("type") == BATCH_EVENT_TYPE else [message]
+        if any((event.get("type") or "").startswith(COMPANY_EVENT_PREFIX) for event in events):
+            self.invalidate(company_id)
+
+company_status_cache = CompanyStatusCache()
+company_status_cache.attach(manager)
+
 class CompanyManager:
-    async def verify_company_active(self, company_id: str):
-        """Verificar que la empresa esté activa"""
+    def __init__(self, cache: CompanyStatusCache = company_status_cache):
+        self.cache = cache
+
+    def get_company_status(self, company_id: str) -> Optional[str]:
+        """
+        Estado de la empresa desde cache; solo consulta la BD en un miss.
+        Un miss bloquea (BD y suscripción): desde async usar get_company_status_async
+        """
+        status = self.cache.get(company_id)
+        if status is not _MISSING:
+            return status
+
+        generation = self.cache.watch(company_id)
         db = get_db()
         company = db.table("companies").select("status").eq("id", company_id).execute()
-        
-        if not company.data:
+
+        if company.error:
+            # No cachear errores: el siguiente request vuelve a intentarlo
+            logger.error(f"❌ Error verificando estado de empresa {company_id}: {company.error}")
+            raise HTTPException(status_code=503, detail="Unable to verify company status")
+
+        status = company.data[0].get("status") if company.data else None
+        self.cache.set(company_id, status, generation)
+        return status
+
+    async def get_company_status_async(self, company_id: str) -> Optional[str]:
+        """Igual que get_company_status; el miss corre en un thread y no frena el event loop"""
+        status = self.cache.get(company_id)
+        if status is not _MISSING:
+            return status
+        return await asyncio.to_thread(self.get_company_status, company_id)
+
+    def ensure_company_active(self, company_id: str):
+        """Verificar que la empresa esté activa (síncrono: bloquea en un miss del cache)"""
+        return self._check_status(self.get_company_status(company_id))
+
+    async def ensure_company_active_async(self, company_id: str):
+        return self._check_status(await self.get_company_status_async(company_id))
+
+    @staticmethod
+    def _check_status(status: Optional[str]):
+        if status is None:
             raise HTTPException(status_code=404, detail="Company not found")
-        
-        if company.data[0].get("status") != "active":
+
+        if status not in ALLOWED_COMPANY_STATUSES:
             raise HTTPException(status_code=403, detail="Company account is not active")
-        
+
         return True
 
+    async def verify_company_active(self, company_id: str):
+        """Verificar que la empresa esté activa"""
+        return await self.ensure_company_active_async(company_id)
+
+    def check_user_company(self, user: dict):
+        """
+        Check barato para aplicar globalmente: super_admin queda exento para poder
+        reactivar empresas, y usuarios sin empresa no se validan
+        """
+        if user.get("role") == "super_admin" or not user.get("company_id"):
+            return True
+        return self.ensure_company_active(user["company_id"])
+
+    async def check_user_company_async(self, user: dict):
+        """check_user_company para el middleware y el handshake WebSocket"""
+        if user.get("role") == "super_admin" or not user.get("company_id"):
+            return True
+        return await self.ensure_company_active_async(user["company_id"])
+
 company_manager = CompanyManager()
 
 # Dependency para verificar empresa activa
 async def require_active_company(user: dict = Depends(get_current_user)):
     """Verificar que la empresa del usuario esté activa"""
-    await company_manager.verify_company_active(user["company_id"])
-    return user
\ No newline at end of file
+    await company_manager.check_user_company_async(user)
+    return user
@@ -0,0 +1,114 @@
+# app/batching.py
+"""
+Micro-batching de broadcasts: las ráfagas de eventos de una empresa dentro de
+una ventana corta se publican como un único frame BATCH, y varios cambios de
+la misma entidad se colapsan en su último estado.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ventana de agrupación por empresa; 0 desactiva el batching
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "100"))
+
+BATCH_EVENT_TYPE = "BATCH"
+
+def entity_key(message: dict) -> Optional[Tuple[str, str]]:
+    """("INVENTORY", <id>) para INVENTORY_UPDATED; None si el evento no es de una entidad"""
+    event_type = message.get("type") or ""
+    data = message.get("data")
+    if "_" not in event_type or not isinstance(data, dict) or not data.get("id"):
+        return None
+    return event_type.rsplit("_", 1)[0], data["id"]
+
+def event_action(message: dict) -> str:
+    return (message.get("type") or "").rsplit("_", 1)[-1]
+
+def merge_events(previous: Optional[dict], message: dict) -> Optional[dict]:
+    """
+    Colapsa dos eventos de la misma entidad. None = ambos se cancelan
+    (creada y eliminada dentro de la misma ventana: el cliente nunca la vio)
+    """
+    if previous is None:
+        return message
+    if event_action(message) == "DELETED":
+        return None if event_action(previous) == "CREATED" else message
+    if event_action(previous) == "CREATED":
+        # Para el cliente sigue siendo una creación, con el estado más reciente
+        return {**message, "type": previous["type"]}
+    return message
+
+class EventBatcher:
+    def __init__(
+        self,
+        publish: Callable[[str, dict], Awaitable[None]],
+        window_ms: float = WS_BATCH_WINDOW_MS
+    ):
+        self._publish = publish
+        self.window_seconds = window_ms / 1000
+        self._pending: Dict[str, Dict[object, dict]] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.events_in = 0
+        self.frames_out = 0
+
+    async def add(self, company_id: str, message: dict):
+        self.events_in += 1
+        if self.window_seconds <= 0:
+            self.frames_out += 1
+            await self._publish(company_id, message)
+            return
+
+        pending = self._pending.get(company_id)
+        if pending is None:
+            pending = self._pending[company_id] = {}
+            task = asyncio.create_task(self._flush_later(company_id))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+        # Eventos sin entidad reciben una clave única y nunca se colapsan
+        key = entity_key(message) or object()
+        merged = merge_events(pending.get(key), message)
+        if merged is None:
+            pending.pop(key, None)
+        else:
+            # Reasignar una clave existente conserva su posición original
+            pending[key] = merged
+
+    async def _flush_later(self, company_id: str):
+        await asyncio.sleep(self.window_seconds)
+        await self.flush(company_id)
+
+    async def flush(self, company_id: str):
+        events = list(self._pending.pop(company_id, {}).values())
+        if not events:
+            return
+        if len(events) == 1:
+            message = events[0]
+        else:
+            message = {
+                "type": BATCH_EVENT_TYPE,
+                "events": events,
+                "timestamp": datetime.now().isoformat()
+            }
+        self.frames_out += 1
+        try:
+            await self._publish(company_id, message)
+        except Exception as e:
+            logger.error(f"❌ Error publishing batch for company {company_id}: {e}")
+
+    async def flush_all(self):
+        for task in list(self._flush_tasks):
+            task.cancel()
+        for company_id in list(self._pending):
+            await self.flush(company_id)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window_seconds * 1000,
+            "events_in": self.events_in,
+            "frames_out": self.frames_out
+        }
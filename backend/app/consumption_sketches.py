@@ -0,0 +1,317 @@
+# app/consumption_sketches.py
+"""
+Sketches de cuantiles del consumo (t-digest) por vehículo, por modelo y de toda
+la flota, persistidos en consumption_sketches (ver database/consumption_sketches.sql).
+
+Un alta suma el valor a los tres sketches; una edición o baja reconstruye en
+segundo plano el del vehículo desde sus registros y los de modelo/flota como
+merge de los sketches de vehículo, sin releer el historial de la empresa.
+Cada escritura exige la versión leída de la fila (control optimista), así dos
+altas concurrentes sobre el mismo sketch no se pisan.
+Una empresa sin sketch de flota se reconstruye (backfill) en la primera lectura.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from .models.database import fetch_all, get_db
+from .sketches import TDigest
+
+logger = logging.getLogger(__name__)
+
+SKETCH_TABLE = "consumption_sketches"
+
+# Cargas necesarias en un vehículo antes de juzgar si una nueva es atípica
+SKETCH_MIN_SAMPLES = int(os.getenv("SKETCH_MIN_SAMPLES", "20"))
+
+# Una carga es atípica si cae fuera de [p1, p99] de su propio vehículo
+OUTLIER_LOW_QUANTILE = 0.01
+OUTLIER_HIGH_QUANTILE = 0.99
+
+# Reintentos de una escritura que perdió la carrera contra otro request
+SKETCH_MAX_RETRIES = int(os.getenv("SKETCH_MAX_RETRIES", "5"))
+
+FLEET_KEY = "*"
+
+def sketch_id(company_id: str, scope: str, key: str) -> str:
+    return f"{company_id}:{scope}:{key}"
+
+class CompanySketches:
+    """Sketches cargados de una empresa"""
+    def __init__(self):
+        self.fleet = TDigest()
+        self.models: Dict[str, TDigest] = {}
+        self.vehicles: Dict[str, TDigest] = {}
+        self.vehicle_models: Dict[str, Optional[str]] = {}
+
+class ConsumptionSketches:
+    def __init__(self):
+        # (empresa, vehículo) con una reparación encolada que todavía no arrancó
+        self._pending: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def apply(
+        self,
+        company_id: str,
+        vehicle_id: str,
+        added: Optional[dict] = None,
+        removed: Optional[dict] = None
+    ) -> Optional[dict]:
+        """
+        Aplica el alta de un registro. Devuelve el diagnóstico de la carga
+        nueva si es atípica respecto de la historia previa de su vehículo.
+        Una edición o baja solo diagnostica: los sketches no admiten bajas y
+        la reconstrucción queda para repair(), fuera del request.
+        Nunca propaga errores: los sketches son aproximados y se reparan con rebuild.
+        """
+        try:
+            db = get_db()
+            model = self._vehicle_model(vehicle_id)
+            # (scope, key, modelo) de los tres sketches que toca la carga; el
+            # de vehículo primero: los merges de modelo/flota se leen de ahí
+            scopes = [("vehicle", vehicle_id, model)]
+            if model:
+                scopes.append(("model", model, model))
+            scopes.append(("fleet", FLEET_KEY, None))
+            ids = {scope: sketch_id(company_id, scope, key) for scope, key, _ in scopes}
+
+            result = db.table(SKETCH_TABLE).select("*").eq("company_id", company_id).in_("id", list(ids.values())).execute()
+            if result.error:
+                raise Exception(result.error)
+            rows = {row["id"]: row for row in result.data or []}
+            if ids["fleet"] not in rows:
+                # Sin backfill todavía: la primera lectura incluirá este registro
+                return None
+
+            vehicle_sketch = TDigest.from_dict(rows.get(ids["vehicle"], {}).get("sketch"))
+            outlier = self._diagnose(vehicle_sketch, added) if added else None
+            if removed is not None:
+                return outlier
+
+            consumption = added.get("consumption") or 0
+            def add(sketch: TDigest) -> TDigest:
+                sketch.add(consumption)
+                return sketch
+
+            for scope, key, row_model in scopes:
+                self._update(company_id, scope, key, add, model=row_model, row=rows.get(ids[scope], {}))
+            return outlier
+        except Exception as e:
+            logger.error(f"❌ Error updating consumption sketches for company {company_id}: {e}")
+            return None
+
+    def schedule_repair(self, company_id: str, vehicle_id: str) -> bool:
+        """
+        Marca el vehículo para repair(). False si ya hay una reparación
+        encolada sin arrancar: esa leerá también el último cambio
+        """
+        with self._lock:
+            if (company_id, vehicle_id) in self._pending:
+                return False
+            self._pending.add((company_id, vehicle_id))
+            return True
+
+    def repair(self, company_id: str, vehicle_id: str):
+        """
+        Reconstruye tras una edición o baja el sketch del vehículo desde sus
+        registros y los de su modelo y la flota como merge de los de vehículo.
+        Pensado para correr en segundo plano (BackgroundTasks); nunca propaga errores
+        """
+        with self._lock:
+            self._pending.discard((company_id, vehicle_id))
+        try:
+            if not self._read(sketch_id(company_id, "fleet", FLEET_KEY)):
+                return
+            model = self._vehicle_model(vehicle_id)
+            self._update(company_id, "vehicle", vehicle_id, lambda _: self._from_records(company_id, vehicle_id), model=model)
+            if model:
+                self._update(company_id, "model", model, lambda _: self._merge_vehicles(company_id, model), model=model)
+            self._update(company_id, "fleet", FLEET_KEY, lambda _: self._merge_vehicles(company_id))
+        except Exception as e:
+            logger.error(f"❌ Error repairing consumption sketches for vehicle {vehicle_id}: {e}")
+
+    def reassign_model(self, company_id: str, vehicle_id: str, old_model: Optional[str], new_model: Optional[str]):
+        """
+        Cambio de modelo de un vehículo: mueve su sketch al modelo nuevo y
+        reconstruye los sketches de ambos modelos. Nunca propaga errores
+        """
+        try:
+            row = self._read(sketch_id(company_id, "vehicle", vehicle_id))
+            if not row:
+                # Sin cargas (o sin backfill): no aporta a ningún modelo
+                return
+            self._update(company_id, "vehicle", vehicle_id, lambda sketch: sketch, model=new_model, row=row)
+            for model in (old_model, new_model):
+                if model:
+                    self._update(company_id, "model", model, lambda _, model=model: self._merge_vehicles(company_id, model), model=model)
+            logger.info(f"🔄 Consumption sketches moved from model {old_model} to {new_model} for vehicle {vehicle_id}")
+        except Exception as e:
+            logger.error(f"❌ Error moving consumption sketches for vehicle {vehicle_id}: {e}")
+
+    def _diagnose(self, sketch: TDigest, record: dict) -> Optional[dict]:
+        if sketch.count < SKETCH_MIN_SAMPLES:
+            return None
+        consumption = record.get("consumption") or 0
+        rank = sketch.cdf(consumption)
+        if OUTLIER_LOW_QUANTILE < rank < OUTLIER_HIGH_QUANTILE:
+            return None
+        return {
+            "record_id": record.get("id"),
+            "vehicle_id": record.get("vehicle_id"),
+            "consumption": consumption,
+            "percentile": round(rank * 100, 1),
+            "direction": "low" if rank <= OUTLIER_LOW_QUANTILE else "high",
+            "expected_range": [
+                round(sketch.quantile(OUTLIER_LOW_QUANTILE), 2),
+                round(sketch.quantile(OUTLIER_HIGH_QUANTILE), 2)
+            ]
+        }
+
+    def load(self, company_id: str) -> CompanySketches:
+        """Todos los sketches de la empresa: O(vehículos + modelos) filas"""
+        db = get_db()
+        rows = list(fetch_all(lambda: db.table(SKETCH_TABLE).select("*").eq("company_id", company_id).order("id")))
+        if not any(row["scope"] == "fleet" for row in rows):
+            return self.rebuild(company_id)
+
+        sketches = CompanySketches()
+        for row in rows:
+            sketch = TDigest.from_dict(row.get("sketch"))
+            if row["scope"] == "fleet":
+                sketches.fleet = sketch
+            elif row["scope"] == "model":
+                sketches.models[row["key"]] = sketch
+            else:
+                sketches.vehicles[row["key"]] = sketch
+                sketches.vehicle_models[row["key"]] = row.get("model")
+        return sketches
+
+    def fleet(self, company_id: str) -> TDigest:
+        """Solo el sketch de flota (una fila)"""
+        result = get_db().table(SKETCH_TABLE).select("sketch").eq("id", sketch_id(company_id, "fleet", FLEET_KEY)).execute()
+        if result.error:
+            raise Exception(result.error)
+        if not result.data:
+            return self.rebuild(company_id).fleet
+        return TDigest.from_dict(result.data[0].get("sketch"))
+
+    def rebuild(self, company_id: str) -> CompanySketches:
+        """Backfill completo de una empresa desde fuel_records (lecturas paginadas)"""
+        db = get_db()
+        vehicles = fetch_all(lambda: db.table("vehicles").select("id,model").eq("company_id", company_id).order("id"))
+        records = fetch_all(lambda: db.table("fuel_records").select("vehicle_id,consumption").eq("company_id", company_id).order("id"))
+
+        sketches = CompanySketches()
+        sketches.vehicle_models = {vehicle["id"]: vehicle.get("model") for vehicle in vehicles}
+        for record in records:
+            sketch = sketches.vehicles.get(record["vehicle_id"])
+            if sketch is None:
+                sketch = sketches.vehicles[record["vehicle_id"]] = TDigest()
+            sketch.add(record.get("consumption") or 0)
+
+        rows = []
+        for vehicle_id, sketch in sketches.vehicles.items():
+            model = sketches.vehicle_models.get(vehicle_id)
+            if model:
+                sketches.models.setdefault(model, TDigest()).merge(sketch)
+            sketches.fleet.merge(sketch)
+            rows.append(self._row(company_id, "vehicle", vehicle_id, sketch, model=model))
+        for model, sketch in sketches.models.items():
+            rows.append(self._row(company_id, "model", model, sketch, model=model))
+
+        result = db.table(SKETCH_TABLE).delete().eq("company_id", company_id).execute()
+        if result.error:
+            raise Exception(result.error)
+        # La fila de flota va al final: marca el backfill como completo
+        self._store(rows)
+        self._store([self._row(company_id, "fleet", FLEET_KEY, sketches.fleet)])
+        logger.info(f"🔄 Consumption sketches rebuilt for company {company_id} ({len(sketches.vehicles)} vehicles)")
+        return sketches
+
+    def _from_records(self, company_id: str, vehicle_id: str) -> TDigest:
+        db = get_db()
+        records = fetch_all(
+            lambda: db.table("fuel_records").select("consumption").eq("company_id", company_id).eq("vehicle_id", vehicle_id).order("id")
+        )
+
+        sketch = TDigest()
+        for record in records:
+            sketch.add(record.get("consumption") or 0)
+        return sketch
+
+    def _merge_vehicles(self, company_id: str, model: Optional[str] = None) -> TDigest:
+        """Sketch de modelo o flota como merge de los sketches de vehículo"""
+        db = get_db()
+
+        def query():
+            query = db.table(SKETCH_TABLE).select("sketch").eq("company_id", company_id).eq("scope", "vehicle")
+            return (query.eq("model", model) if model else query).order("id")
+
+        merged = TDigest()
+        for row in fetch_all(query):
+            merged.merge(TDigest.from_dict(row.get("sketch")))
+        return merged
+
+    def _update(
+        self,
+        company_id: str,
+        scope: str,
+        key: str,
+        change: Callable[[TDigest], TDigest],
+        model: Optional[str] = None,
+        row: Optional[dict] = None
+    ) -> TDigest:
+        """
+        Read-modify-write de una fila con control optimista: la escritura exige
+        la versión leída, y si otro request o worker escribió antes se relee la
+        fila y se vuelve a aplicar `change`. `row` es la fila ya leída ({} si no existe)
+        """
+        db = get_db()
+        row_id = sketch_id(company_id, scope, key)
+        for _ in range(SKETCH_MAX_RETRIES):
+            if row is None:
+                row = self._read(row_id)
+            sketch = change(TDigest.from_dict(row.get("sketch")))
+            values = self._row(company_id, scope, key, sketch, model=model)
+            version = row.get("version")
+            if version is None:
+                # Fila nueva: si otro la insertó antes, el insert falla por la clave
+                result = db.table(SKETCH_TABLE).insert({**values, "version": 1}).execute()
+            else:
+                result = db.table(SKETCH_TABLE).update({**values, "version": version + 1}).eq("id", row_id).eq("version", version).execute()
+            if not result.error and result.data:
+                return sketch
+            row = None
+        raise Exception(f"Sketch {row_id} changed concurrently {SKETCH_MAX_RETRIES} times")
+
+    def _read(self, row_id: str) -> dict:
+        result = get_db().table(SKETCH_TABLE).select("*").eq("id", row_id).execute()
+        if result.error:
+            raise Exception(result.error)
+        return result.data[0] if result.data else {}
+
+    def _row(self, company_id: str, scope: str, key: str, sketch: TDigest, model: Optional[str] = None) -> dict:
+        return {
+            "id": sketch_id(company_id, scope, key),
+            "company_id": company_id,
+            "scope": scope,
+            "key": key,
+            "model": model,
+            "sample_count": int(sketch.count),
+            "sketch": sketch.to_dict(),
+            "updated_at": datetime.now().isoformat()
+        }
+
+    def _store(self, rows: List[dict]):
+        if not rows:
+            return
+        result = get_db().table(SKETCH_TABLE).upsert(rows).execute()
+        if result.error:
+            raise Exception(result.error)
+
+    def _vehicle_model(self, vehicle_id: str) -> Optional[str]:
+        result = get_db().table("vehicles").select("model").eq("id", vehicle_id).execute()
+        return result.data[0].get("model") if result.data else None
+
+consumption_sketches = ConsumptionSketches()
@@ -0,0 +1,57 @@
+# app/date_range.py
+"""
+Ventana de fechas para endpoints analíticos (?from=&to= o ?last_n_days=).
+Se aplica como filtros gte/lt sobre `date` en la consulta a Supabase, para que
+la BD devuelva solo las filas del periodo. Ver database/indexes.sql: el índice
+compuesto (company_id, date) convierte ese filtro en un range scan.
+"""
+from datetime import date, timedelta
+from typing import Optional
+from fastapi import HTTPException, Query
+
+class DateRange:
+    """Rango inclusivo [start, end] en fechas ISO; None = sin límite"""
+    def __init__(self, start: Optional[str] = None, end: Optional[str] = None):
+        self.start = start
+        self.end = end
+
+    @property
+    def active(self) -> bool:
+        return bool(self.start or self.end)
+
+    def apply(self, query, column: str = "date"):
+        if self.start:
+            query = query.gte(column, self.start)
+        if self.end:
+            # `lt` del día siguiente incluye todo el último día aunque la columna tenga hora
+            next_day = date.fromisoformat(self.end) + timedelta(days=1)
+            query = query.lt(column, next_day.isoformat())
+        return query
+
+    def to_dict(self) -> dict:
+        return {"from": self.start, "to": self.end}
+
+def _parse(value: Optional[str], name: str) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be an ISO date (YYYY-MM-DD)")
+
+def date_range_params(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    last_n_days: Optional[int] = Query(None, ge=1)
+) -> DateRange:
+    """Dependency: from/to explícitos o los últimos N días (incluyendo hoy)"""
+    if last_n_days:
+        if date_from or date_to:
+            raise HTTPException(status_code=400, detail="Use either from/to or last_n_days, not both")
+        today = date.today()
+        return DateRange((today - timedelta(days=last_n_days - 1)).isoformat(), today.isoformat())
+
+    window = DateRange(_parse(date_from, "from"), _parse(date_to, "to"))
+    if window.start and window.end and window.start > window.end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    return window
@@ -0,0 +1,226 @@
+# app/fuel_anomalies.py
+"""
+Escáner de anomalías en cargas de combustible (fraude con tarjetas, errores de carga):
+
+- over_capacity:       litros cargados por encima de la capacidad del tanque
+- odometer_mismatch:   la carga con la que las millas declaradas del vehículo
+                       (acumuladas carga a carga) superan su odómetro
+- duplicate_fill:      dos cargas del mismo vehículo el mismo día con minutos
+                       de diferencia (o con los mismos litros si `date` no trae hora)
+- price_deviation:     precio muy lejos de la mediana del día en la empresa
+
+Con NumPy los chequeos corren vectorizados sobre columnas (millones de filas
+por minuto); sin NumPy se usa el mismo algoritmo en Python puro.
+"""
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from .analytics import _column, _days, np, vectorized
+from .date_range import DateRange
+from .models.database import fetch_all, get_db
+
+# Margen sobre la capacidad del tanque antes de marcar la carga
+TANK_CAPACITY_TOLERANCE = 0.05
+
+# Capacidad a usar para vehículos sin tank_capacity (vacío = omitir el chequeo)
+DEFAULT_TANK_CAPACITY = float(os.getenv("FUEL_DEFAULT_TANK_CAPACITY", "0")) or None
+
+# Dos cargas del mismo vehículo más cercanas que esto se consideran duplicadas
+DUPLICATE_WINDOW_MINUTES = float(os.getenv("FUEL_DUPLICATE_WINDOW_MINUTES", "15"))
+
+# Desvío relativo máximo respecto de la mediana de precio del día
+PRICE_DEVIATION = float(os.getenv("FUEL_PRICE_DEVIATION", "0.25"))
+PRICE_MIN_SAMPLES = 3
+
+# Margen sobre vehicles.total_miles antes de marcar las millas declaradas
+ODOMETER_TOLERANCE = 0.05
+
+SCAN_COLUMNS = "id,vehicle_id,date,created_at,fuel_amount,fuel_price,miles_driven"
+
+def fetch_fuel_records(company_id: str, window: Optional[DateRange] = None, columns: str = SCAN_COLUMNS) -> List[dict]:
+    """Registros de la empresa (solo las columnas pedidas), paginados"""
+    db = get_db()
+
+    def query():
+        query = db.table("fuel_records").select(columns).eq("company_id", company_id)
+        return (window.apply(query) if window else query).order("id")
+
+    return list(fetch_all(query))
+
+def fill_time(record: dict) -> Optional[str]:
+    """Fecha con hora de la carga; None si `date` es solo día (created_at no es la hora de carga)"""
+    value = record.get("date") or ""
+    return value[:19] if len(value) > 10 else None
+
+def finding(check: str, record: dict, severity: str, **detail) -> dict:
+    return {
+        "check": check,
+        "severity": severity,
+        "record_id": record.get("id"),
+        "vehicle_id": record.get("vehicle_id"),
+        "date": record.get("date"),
+        "detail": detail
+    }
+
+def scan_fuel_records(records: List[dict], vehicles: List[dict], check_odometer: bool = True) -> Iterator[dict]:
+    """
+    Hallazgos de todos los chequeos. El de odómetro compara el historial
+    completo del vehículo: desactivarlo cuando `records` es solo una ventana
+    """
+    if not records:
+        return iter(())
+    scanner = _scan_vectorized if vectorized(records) else _scan_python
+    return scanner(records, {vehicle["id"]: vehicle for vehicle in vehicles}, check_odometer)
+
+def _capacity(vehicle: Optional[dict]) -> Optional[float]:
+    return (vehicle or {}).get("tank_capacity") or DEFAULT_TANK_CAPACITY
+
+def _odometer_finding(record: dict, declared: float, odometer: float) -> dict:
+    return finding("odometer_mismatch", record, "high",
+                   declared_miles=round(declared, 1), odometer_miles=odometer)
+
+def _odometer_limit(vehicle: Optional[dict]) -> Optional[float]:
+    odometer = (vehicle or {}).get("total_miles")
+    return odometer * (1 + ODOMETER_TOLERANCE) if odometer else None
+
+def _timestamps(values: List[str], unit: str):
+    """Strings ISO -> datetime64; NaT para valores ausentes o inválidos"""
+    try:
+        return np.array(values, dtype=f"datetime64[{unit}]")
+    except ValueError:
+        parsed = []
+        for value in values:
+            try:
+                parsed.append(np.datetime64(value, unit))
+            except ValueError:
+                parsed.append(np.datetime64("NaT"))
+        return np.array(parsed, dtype=f"datetime64[{unit}]")
+
+def _scan_vectorized(records: List[dict], vehicles: Dict[str, dict], check_odometer: bool) -> Iterator[dict]:
+    vehicle_ids, vehicle = np.unique(
+        np.array([record["vehicle_id"] for record in records], dtype=object).astype(str),
+        return_inverse=True
+    )
+    vehicle = vehicle.ravel()
+    fuel = _column(records, "fuel_amount")
+    price = _column(records, "fuel_price")
+
+    # Tanque: capacidad por vehículo (NaN = desconocida) indexada por fila
+    capacity = np.array([_capacity(vehicles.get(vehicle_id)) or np.nan for vehicle_id in vehicle_ids.tolist()])[vehicle]
+    with np.errstate(invalid="ignore"):
+        over = np.flatnonzero(fuel > capacity * (1 + TANK_CAPACITY_TOLERANCE))
+    for i in over.tolist():
+        yield finding("over_capacity", records[i], "high",
+                      fuel_amount=float(fuel[i]), tank_capacity=float(capacity[i]))
+
+    # Duplicados: ordenar por (vehículo, día, hora, alta) y comparar vecinos del mismo día
+    day = _days(records)
+    time = _timestamps([fill_time(record) or "NaT" for record in records], "s")
+    created = _timestamps([(record.get("created_at") or "")[:19] or "NaT" for record in records], "s")
+    fill_order = np.lexsort((created, time, day, vehicle))
+    sorted_vehicle, sorted_day, sorted_time = vehicle[fill_order], day[fill_order], time[fill_order]
+    same_day = (sorted_vehicle[1:] == sorted_vehicle[:-1]) & (sorted_day[1:] == sorted_day[:-1])
+    timed = ~(np.isnat(sorted_time[1:]) | np.isnat(sorted_time[:-1]))
+    gaps = np.diff(sorted_time).astype("timedelta64[s]").astype(np.float64) / 60
+    same_fuel = fuel[fill_order][1:] == fuel[fill_order][:-1]
+    with np.errstate(invalid="ignore"):
+        duplicates = np.flatnonzero(same_day & np.where(timed, gaps < DUPLICATE_WINDOW_MINUTES, same_fuel))
+    for j in duplicates.tolist():
+        previous, current = records[fill_order[j]], records[fill_order[j + 1]]
+        yield finding("duplicate_fill", current, "medium", previous_record_id=previous.get("id"),
+                      minutes_apart=round(float(gaps[j]), 1) if timed[j] else None)
+
+    # Precio: mediana por día vía orden (día, precio) y límites de grupo
+    has_price = (price > 0) & ~np.isnat(day)
+    rows = np.flatnonzero(has_price)
+    if rows.size:
+        order = rows[np.lexsort((price[rows], day[rows]))]
+        sorted_days = day[order]
+        starts = np.flatnonzero(np.concatenate([[True], sorted_days[1:] != sorted_days[:-1]]))
+        ends = np.concatenate([starts[1:], [order.size]])
+        sizes = ends - starts
+        sorted_price = price[order]
+        medians = (sorted_price[starts + (sizes - 1) // 2] + sorted_price[starts + sizes // 2]) / 2
+        median = np.repeat(medians, sizes)
+        deviation = np.abs(sorted_price - median) / median
+        flagged = np.flatnonzero((np.repeat(sizes, sizes) >= PRICE_MIN_SAMPLES) & (deviation > PRICE_DEVIATION))
+        for k in flagged.tolist():
+            yield finding("price_deviation", records[order[k]], "medium",
+                          fuel_price=float(sorted_price[k]), day_median=round(float(median[k]), 3),
+                          deviation=round(float(deviation[k]), 3))
+
+    if check_odometer:
+        # Millas acumuladas carga a carga dentro de cada vehículo, en orden de carga
+        running = np.cumsum(_column(records, "miles_driven")[fill_order])
+        starts = np.flatnonzero(np.concatenate([[True], sorted_vehicle[1:] != sorted_vehicle[:-1]]))
+        offset = np.concatenate([[0.0], running[starts[1:] - 1]])
+        declared = running - np.repeat(offset, np.diff(np.concatenate([starts, [fill_order.size]])))
+        limit = np.array([_odometer_limit(vehicles.get(vehicle_id)) or np.nan for vehicle_id in vehicle_ids.tolist()])[sorted_vehicle]
+        with np.errstate(invalid="ignore"):
+            crossed = np.flatnonzero(declared > limit)
+        # Solo la primera carga que cruza el odómetro en cada vehículo
+        _, first = np.unique(sorted_vehicle[crossed], return_index=True)
+        for k in crossed[first].tolist():
+            vehicle_id = str(vehicle_ids[sorted_vehicle[k]])
+            yield _odometer_finding(records[fill_order[k]], float(declared[k]), vehicles[vehicle_id]["total_miles"])
+
+def _scan_python(records: List[dict], vehicles: Dict[str, dict], check_odometer: bool) -> Iterator[dict]:
+    for record in records:
+        capacity = _capacity(vehicles.get(record["vehicle_id"]))
+        fuel = record.get("fuel_amount") or 0
+        if capacity and fuel > capacity * (1 + TANK_CAPACITY_TOLERANCE):
+            yield finding("over_capacity", record, "high", fuel_amount=fuel, tank_capacity=capacity)
+
+    def parse(value: Optional[str]) -> Optional[datetime]:
+        try:
+            return datetime.fromisoformat(value) if value else None
+        except ValueError:
+            return None
+
+    # Mismo orden que la versión vectorizada; None (sin hora/sin alta) va al final
+    keyed = []
+    for record in records:
+        time, created = parse(fill_time(record)), parse((record.get("created_at") or "")[:19])
+        keyed.append(((record["vehicle_id"], parse((record.get("date") or "")[:10]) or datetime.max,
+                       time is None, time or datetime.min, created is None, created or datetime.min), time, record))
+    keyed.sort(key=lambda item: item[0])
+    for (key_a, time_a, previous), (key_b, time_b, current) in zip(keyed, keyed[1:]):
+        if key_a[:2] != key_b[:2] or key_a[1] == datetime.max:
+            continue
+        if time_a and time_b:
+            minutes = (time_b - time_a).total_seconds() / 60
+            if minutes < DUPLICATE_WINDOW_MINUTES:
+                yield finding("duplicate_fill", current, "medium",
+                              previous_record_id=previous.get("id"), minutes_apart=round(minutes, 1))
+        elif (previous.get("fuel_amount") or 0) == (current.get("fuel_amount") or 0):
+            yield finding("duplicate_fill", current, "medium",
+                          previous_record_id=previous.get("id"), minutes_apart=None)
+
+    by_day = defaultdict(list)
+    for record in records:
+        if (record.get("fuel_price") or 0) > 0 and record.get("date"):
+            by_day[record["date"][:10]].append(record)
+    for day_records in by_day.values():
+        if len(day_records) < PRICE_MIN_SAMPLES:
+            continue
+        prices = sorted(record["fuel_price"] for record in day_records)
+        median = (prices[(len(prices) - 1) // 2] + prices[len(prices) // 2]) / 2
+        for record in day_records:
+            deviation = abs(record["fuel_price"] - median) / median
+            if deviation > PRICE_DEVIATION:
+                yield finding("price_deviation", record, "medium",
+                              fuel_price=record["fuel_price"], day_median=round(median, 3),
+                              deviation=round(deviation, 3))
+
+    if check_odometer:
+        # Solo la primera carga que cruza el odómetro en cada vehículo
+        declared: Dict[str, float] = defaultdict(float)
+        flagged = set()
+        for _, _, record in keyed:
+            vehicle_id = record["vehicle_id"]
+            declared[vehicle_id] += record.get("miles_driven") or 0
+            limit = _odometer_limit(vehicles.get(vehicle_id))
+            if limit and declared[vehicle_id] > limit and vehicle_id not in flagged:
+                flagged.add(vehicle_id)
+                yield _odometer_finding(record, declared[vehicle_id], vehicles[vehicle_id]["total_miles"])
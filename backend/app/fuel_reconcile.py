@@ -0,0 +1,326 @@
+# app/fuel_reconcile.py
+"""
+Conciliación de extractos de tarjeta de combustible contra fuel_records.
+
+El CSV se lee en streaming dos veces: la primera pasada solo obtiene el rango
+de fechas del extracto, así se indexan únicamente los registros de ese periodo
+(+/- la tolerancia); la segunda cruza cada línea contra un índice hash
+(vehículo, día, bucket de monto). Con buckets del ancho de la tolerancia, los
+candidatos de una línea están en los días vecinos y en los buckets b-1..b+1:
+cada línea cuesta O(1) sin importar el tamaño del historial.
+
+La memoria queda acotada por los registros del periodo: las líneas no se
+guardan y cada conjunto del resultado lista a lo sumo `limit` entradas
+(los conteos del resumen siempre son completos).
+"""
+import csv
+import io
+import os
+import re
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from .date_range import DateRange
+from .fuel_anomalies import fetch_fuel_records
+from .models.database import get_db
+
+# Días de diferencia admitidos entre la fecha del extracto y la del registro
+DATE_TOLERANCE_DAYS = int(os.getenv("RECONCILE_DATE_TOLERANCE_DAYS", "1"))
+
+# Diferencia absoluta admitida en el monto (litros o moneda, según la columna)
+AMOUNT_TOLERANCE = float(os.getenv("RECONCILE_AMOUNT_TOLERANCE", "0.5"))
+
+# Dos candidatos cuyas diferencias de monto difieren menos que esto empatan
+AMBIGUITY_TOLERANCE = float(os.getenv("RECONCILE_AMBIGUITY_TOLERANCE", "0.01"))
+
+# Entradas listadas por conjunto en la respuesta
+RESULT_LIMIT = 1000
+
+RECORD_COLUMNS = "id,vehicle_id,date,fuel_amount,total_cost"
+
+# Encabezados aceptados (en minúsculas) -> campo
+VEHICLE_HEADERS = ("vehicle_id", "unit_id", "vehicle", "unidad")
+DATE_HEADERS = ("date", "fecha", "transaction_date")
+# Litros antes que importe: si el extracto trae ambos se concilia por litros
+AMOUNT_HEADERS = (
+    ("fuel_amount", ("fuel_amount", "liters", "litros", "quantity", "gallons")),
+    ("total_cost", ("total_cost", "total", "amount", "importe"))
+)
+
+DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d")
+
+# "1,234" es mil doscientos treinta y cuatro; "0,500" sigue siendo decimal
+THOUSANDS_COMMA = re.compile(r"^[-+]?[1-9]\d{0,2}(,\d{3})+$")
+
+class StatementError(ValueError):
+    """Extracto que no se puede procesar (encabezados faltantes)"""
+
+def parse_date(value: str) -> date:
+    value = value.strip()
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"invalid date '{value}'")
+
+def parse_amount(value: str) -> float:
+    value = value.strip().replace(" ", "")
+    if "," in value and "." in value:
+        # El último separador es el decimal: "1,234.56" y "1.234,56"
+        thousands = "," if value.rfind(",") < value.rfind(".") else "."
+        value = value.replace(thousands, "").replace(",", ".")
+    elif THOUSANDS_COMMA.match(value):
+        # "1,234" / "12,345,678": coma seguida de grupos de exactamente tres dígitos
+        value = value.replace(",", "")
+    elif value.count(".") > 1:
+        # "1.234.567": solo puede ser separador de miles
+        value = value.replace(".", "")
+    else:
+        # "12,5" -> coma decimal
+        value = value.replace(",", ".")
+    return float(value)
+
+class StatementColumns:
+    """Posición de cada campo en el CSV, resuelta desde el encabezado"""
+    def __init__(self, header: List[str]):
+        names = [name.strip().lower() for name in header]
+
+        def find(candidates) -> Optional[int]:
+            return next((names.index(name) for name in candidates if name in names), None)
+
+        self.vehicle = find(VEHICLE_HEADERS)
+        self.date = find(DATE_HEADERS)
+        self.amount, self.field = None, None
+        for field, candidates in AMOUNT_HEADERS:
+            self.amount = find(candidates)
+            if self.amount is not None:
+                self.field = field
+                break
+
+        missing = [
+            name for name, position in (("vehicle", self.vehicle), ("date", self.date), ("amount", self.amount))
+            if position is None
+        ]
+        if missing:
+            raise StatementError(f"Statement is missing columns: {', '.join(missing)}")
+
+class StatementReader:
+    """
+    Filas del extracto como (línea, (vehículo, día, monto) | None, error | None).
+    `file` es binario (UploadFile.file, en disco si es grande): se decodifica
+    de a un buffer a la vez y se puede releer creando otro reader
+    """
+    def __init__(self, file: BinaryIO):
+        file.seek(0)
+        self._text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        try:
+            first = self._text.readline()
+            if not first.strip():
+                raise StatementError("Statement is empty")
+            # Extractos con coma decimal suelen venir separados por ";"
+            delimiter = ";" if first.count(";") > first.count(",") else ","
+            self.columns = StatementColumns(next(csv.reader([first], delimiter=delimiter)))
+            self._reader = csv.reader(self._text, delimiter=delimiter)
+        except Exception:
+            self.close()
+            raise
+
+    def __iter__(self) -> Iterator[Tuple[int, Optional[Tuple[str, date, float]], Optional[str]]]:
+        columns = self.columns
+        try:
+            for row in self._reader:
+                if not any(cell.strip() for cell in row):
+                    continue
+                # +1: el encabezado se leyó fuera del reader
+                line = self._reader.line_num + 1
+                try:
+                    yield line, (
+                        row[columns.vehicle].strip(),
+                        parse_date(row[columns.date]),
+                        parse_amount(row[columns.amount])
+                    ), None
+                except (IndexError, ValueError) as e:
+                    yield line, None, str(e) or "malformed row"
+        finally:
+            self.close()
+
+    def close(self):
+        # detach y no close: el archivo subyacente se vuelve a leer en la segunda pasada
+        if self._text is not None:
+            self._text.detach()
+            self._text = None
+
+class RecordIndex:
+    """Hash (vehicle_id, día ordinal, bucket de monto) -> registros"""
+    def __init__(self, records: List[dict], field: str, tolerance: float):
+        self.field = field
+        self.tolerance = tolerance
+        self.buckets: Dict[tuple, List[dict]] = defaultdict(list)
+        self.claimed = set()
+        self.size = 0
+        for record in records:
+            try:
+                day = date.fromisoformat(record["date"][:10]).toordinal()
+            except (KeyError, TypeError, ValueError):
+                continue
+            amount = record.get(field) or 0
+            self.buckets[(record["vehicle_id"], day, self._bucket(amount))].append(record)
+            self.size += 1
+
+    def _bucket(self, amount: float) -> int:
+        return int(amount // self.tolerance)
+
+    def candidates(self, vehicle_id: str, day: date, amount: float, date_tolerance: int) -> List[tuple]:
+        """(diferencia de días, diferencia de monto, registro) no conciliados aún, más cercanos primero"""
+        bucket = self._bucket(amount)
+        ordinal = day.toordinal()
+        found = []
+        for offset in range(-date_tolerance, date_tolerance + 1):
+            for b in (bucket - 1, bucket, bucket + 1):
+                for record in self.buckets.get((vehicle_id, ordinal + offset, b), ()):
+                    difference = abs((record.get(self.field) or 0) - amount)
+                    if difference <= self.tolerance and record["id"] not in self.claimed:
+                        found.append((abs(offset), difference, record))
+        found.sort(key=lambda candidate: candidate[:2])
+        return found
+
+    def unclaimed(self) -> Iterator[dict]:
+        for records in self.buckets.values():
+            for record in records:
+                if record["id"] not in self.claimed:
+                    yield record
+
+def tied_candidates(candidates: List[tuple]) -> List[dict]:
+    """
+    Registros empatados con el mejor candidato: mismo desvío en días y monto a
+    menos de AMBIGUITY_TOLERANCE. Con más de uno no se puede decidir sin revisión manual
+    """
+    if not candidates:
+        return []
+    best_days, best_difference, _ = candidates[0]
+    return [
+        record for days, difference, record in candidates
+        if days == best_days and difference - best_difference <= AMBIGUITY_TOLERANCE
+    ]
+
+class ReconcileResult:
+    """Conjuntos del resultado: conteos completos, listas truncadas a `limit`"""
+    SETS = ("matched", "ambiguous", "unmatched_statement", "unmatched_records", "invalid")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.counts = {name: 0 for name in self.SETS}
+        self.items: Dict[str, List[dict]] = {name: [] for name in self.SETS}
+
+    def add(self, name: str, item: dict):
+        self.counts[name] += 1
+        if len(self.items[name]) < self.limit:
+            self.items[name].append(item)
+
+    def to_dict(self) -> dict:
+        return {
+            "summary": self.counts,
+            "truncated": any(self.counts[name] > len(self.items[name]) for name in self.SETS),
+            **self.items
+        }
+
+def _vehicle_lookup(company_id: str) -> Dict[str, str]:
+    """id o unit_id (normalizado) -> vehicle_id"""
+    result = get_db().table("vehicles").select("id,unit_id").eq("company_id", company_id).execute()
+    if result.error:
+        raise Exception(result.error)
+    lookup = {}
+    for vehicle in result.data or []:
+        lookup[vehicle["id"].lower()] = vehicle["id"]
+        if vehicle.get("unit_id"):
+            lookup[vehicle["unit_id"].strip().lower()] = vehicle["id"]
+    return lookup
+
+def reconcile_statement(
+    company_id: str,
+    file: BinaryIO,
+    date_tolerance: int = DATE_TOLERANCE_DAYS,
+    amount_tolerance: float = AMOUNT_TOLERANCE,
+    limit: int = RESULT_LIMIT
+) -> dict:
+    # Primera pasada: rango de fechas y líneas válidas
+    first_day, last_day, lines = None, None, 0
+    reader = StatementReader(file)
+    columns = reader.columns
+    for _, parsed, _ in reader:
+        lines += 1
+        if parsed:
+            day = parsed[1]
+            first_day = day if first_day is None else min(first_day, day)
+            last_day = day if last_day is None else max(last_day, day)
+
+    result = ReconcileResult(limit)
+    statement = {
+        "lines": lines,
+        "from": first_day.isoformat() if first_day else None,
+        "to": last_day.isoformat() if last_day else None,
+        "matched_on": columns.field,
+        "date_tolerance_days": date_tolerance,
+        "amount_tolerance": amount_tolerance
+    }
+
+    index = None
+    if first_day:
+        window = DateRange(
+            (first_day - timedelta(days=date_tolerance)).isoformat(),
+            (last_day + timedelta(days=date_tolerance)).isoformat()
+        )
+        index = RecordIndex(fetch_fuel_records(company_id, window, RECORD_COLUMNS), columns.field, amount_tolerance)
+        statement["records_indexed"] = index.size
+    vehicles = _vehicle_lookup(company_id)
+
+    # Segunda pasada: cruce contra el índice
+    for line, parsed, error in StatementReader(file):
+        if not parsed:
+            result.add("invalid", {"line": line, "error": error})
+            continue
+
+        vehicle, day, amount = parsed
+        entry = {"line": line, "vehicle": vehicle, "date": day.isoformat(), "amount": amount}
+        vehicle_id = vehicles.get(vehicle.lower())
+        if not vehicle_id:
+            result.add("unmatched_statement", {**entry, "reason": "unknown_vehicle"})
+            continue
+
+        candidates = index.candidates(vehicle_id, day, amount, date_tolerance)
+        if not candidates:
+            result.add("unmatched_statement", {**entry, "reason": "no_matching_record"})
+            continue
+        tied = tied_candidates(candidates)
+        if len(tied) > 1:
+            result.add("ambiguous", {**entry, "candidates": [record["id"] for record in tied]})
+            continue
+
+        _, difference, record = candidates[0]
+        index.claimed.add(record["id"])
+        result.add("matched", {
+            **entry,
+            "record_id": record["id"],
+            "vehicle_id": vehicle_id,
+            "record_date": record["date"],
+            "record_amount": record.get(columns.field),
+            "difference": round(difference, 3)
+        })
+
+    if index:
+        for record in index.unclaimed():
+            # Solo los del periodo del extracto, no los del margen de tolerancia
+            if statement["from"] <= record["date"][:10] <= statement["to"]:
+                result.add("unmatched_records", {
+                    "record_id": record["id"],
+                    "vehicle_id": record["vehicle_id"],
+                    "date": record["date"],
+                    "amount": record.get(columns.field)
+                })
+
+    return {"statement": statement, **result.to_dict()}
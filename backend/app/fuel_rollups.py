@@ -0,0 +1,212 @@
+# app/fuel_rollups.py
+"""
+Agregados de combustible mantenidos de forma incremental por empresa y por
+vehículo (tabla fuel_rollups, ver database/fuel_rollups.sql), más buckets
+diarios/semanales/mensuales para reportes (tabla fuel_period_rollups).
+
+Cada alta/edición/baja de un registro aplica su delta (filas, buckets y, si
+hace falta, refresco de min/max) con un único RPC atómico; las lecturas de
+métricas leen una fila en lugar de sumar todo el historial.
+Una empresa sin fila de rollup se reconstruye (backfill) en la primera lectura,
+con un RPC que agrega en la BD bajo el mismo lock que los deltas.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+from .fuel_stats import FuelAggregate
+from .models.database import fetch_all, get_db
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = "fuel_rollups"
+PERIOD_TABLE = "fuel_period_rollups"
+# Delta de empresa/vehículo, deltas de buckets y refresco de extremos en una transacción
+CHANGE_RPC = "apply_fuel_record_change"
+REBUILD_RPC = "rebuild_fuel_rollups"
+
+def rollup_id(company_id: str, vehicle_id: Optional[str] = None) -> str:
+    """Fila de empresa = company_id; fila de vehículo = company_id:vehicle_id"""
+    return f"{company_id}:{vehicle_id}" if vehicle_id else company_id
+
+def period_rollup_id(company_id: str, vehicle_id: Optional[str], granularity: str, start: str) -> str:
+    """Mismo formato que arma apply_fuel_period_delta en SQL"""
+    return f"{company_id}:{vehicle_id or ''}:{granularity}:{start}"
+
+def record_day(record: dict) -> str:
+    return record["date"][:10]
+
+def record_delta(added: Optional[dict] = None, removed: Optional[dict] = None) -> dict:
+    """Parámetros del RPC para sumar `added` y restar `removed` (edición = ambos)"""
+    delta = {
+        "d_count": 0,
+        "d_fuel": 0.0,
+        "d_miles": 0.0,
+        "d_cost": 0.0,
+        "d_consumption_sum": 0.0,
+        # min/max solo pueden extenderse con un delta; al quitar un extremo se recalculan
+        "p_consumption": added.get("consumption") if added else None
+    }
+    for record, sign in ((added, 1), (removed, -1)):
+        if not record:
+            continue
+        delta["d_count"] += sign
+        delta["d_fuel"] += sign * (record.get("fuel_amount") or 0)
+        delta["d_miles"] += sign * (record.get("miles_driven") or 0)
+        delta["d_cost"] += sign * (record.get("total_cost") or 0)
+        delta["d_consumption_sum"] += sign * (record.get("consumption") or 0)
+    return delta
+
+def period_deltas(added: Optional[dict] = None, removed: Optional[dict] = None) -> List[dict]:
+    """Deltas por día para los buckets: una edición que no cambia la fecha es uno; si la cambia, dos"""
+    if added and removed and record_day(added) == record_day(removed):
+        changes = [(record_day(added), record_delta(added, removed))]
+    else:
+        changes = [
+            (record_day(record), record_delta(**{side: record}))
+            for side, record in (("removed", removed), ("added", added))
+            if record
+        ]
+    deltas = []
+    for day, delta in changes:
+        delta.pop("p_consumption")
+        deltas.append({"p_day": day, **delta})
+    return deltas
+
+class FuelRollups:
+    def apply(
+        self,
+        company_id: str,
+        vehicle_id: str,
+        added: Optional[dict] = None,
+        removed: Optional[dict] = None
+    ):
+        """
+        Aplica el cambio de un registro a las filas de empresa y vehículo y a sus
+        buckets, con un único RPC (una transacción: nunca queda aplicado a medias).
+        Nunca propaga errores: la escritura del registro ya se hizo, y un rollup
+        inconsistente se invalida para reconstruirlo en la próxima lectura.
+        """
+        try:
+            result = get_db().rpc(CHANGE_RPC, {
+                "p_company_id": company_id,
+                "p_vehicle_id": vehicle_id,
+                **record_delta(added, removed),
+                "p_periods": period_deltas(added, removed),
+                # Si era un extremo de consumo (o la fila queda vacía) el RPC recalcula min/max
+                "p_removed_consumption": (removed.get("consumption") or 0) if removed else None
+            }).execute()
+            if result.error:
+                logger.error(f"❌ Error applying fuel rollup delta for company {company_id}: {result.error}")
+                self.invalidate(company_id)
+        except Exception as e:
+            logger.error(f"❌ Error applying fuel rollup delta for company {company_id}: {e}")
+            self.invalidate(company_id)
+
+    def get(self, company_id: str, vehicle_id: Optional[str] = None) -> FuelAggregate:
+        """Agregado de la empresa o de un vehículo en O(1)"""
+        db = get_db()
+        ids = [rollup_id(company_id)]
+        if vehicle_id:
+            ids.append(rollup_id(company_id, vehicle_id))
+
+        rows = {}
+        for key in ids:
+            result = db.table(ROLLUP_TABLE).select("*").eq("id", key).execute()
+            if result.error:
+                raise Exception(result.error)
+            if result.data:
+                rows[key] = result.data[0]
+
+        if ids[0] not in rows:
+            totals, groups = self.rebuild(company_id)
+            return groups.get(vehicle_id, FuelAggregate()) if vehicle_id else totals
+
+        # Con la empresa ya reconstruida, un vehículo sin fila no tiene registros
+        row = rows.get(ids[-1])
+        return FuelAggregate.from_row(row) if row else FuelAggregate()
+
+    def get_company(self, company_id: str) -> Tuple[FuelAggregate, Dict[str, FuelAggregate]]:
+        """Totales de la empresa y agregados por vehículo: O(vehículos), no O(registros)"""
+        totals, groups = self._read_company(company_id)
+        if totals is None:
+            return self.rebuild(company_id)
+        return totals, groups
+
+    def _read_company(self, company_id: str) -> Tuple[Optional[FuelAggregate], Dict[str, FuelAggregate]]:
+        db = get_db()
+        totals = None
+        groups: Dict[str, FuelAggregate] = {}
+        for row in fetch_all(lambda: db.table(ROLLUP_TABLE).select("*").eq("company_id", company_id).order("id")):
+            if row.get("vehicle_id"):
+                groups[row["vehicle_id"]] = FuelAggregate.from_row(row)
+            else:
+                totals = FuelAggregate.from_row(row)
+        return totals, groups
+
+    def rebuild(self, company_id: str) -> Tuple[FuelAggregate, Dict[str, FuelAggregate]]:
+        """
+        Backfill completo de una empresa desde fuel_records. Se agrega en la BD
+        (rebuild_fuel_rollups): ninguna lectura paginada puede quedar recortada, y
+        el reemplazo de las filas es atómico respecto de los deltas y de otro backfill
+        """
+        result = get_db().rpc(REBUILD_RPC, {"p_company_id": company_id}).execute()
+        if result.error:
+            raise Exception(result.error)
+
+        totals, groups = self._read_company(company_id)
+        if totals is None:
+            raise Exception(f"Fuel rollup backfill left no company row for {company_id}")
+        logger.info(f"🔄 Fuel rollups rebuilt for company {company_id} ({totals.count} records)")
+        return totals, groups
+
+    def periods(
+        self,
+        company_id: str,
+        granularity: str,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        vehicle_id: Optional[str] = None
+    ) -> List[Tuple[str, FuelAggregate]]:
+        """Buckets (inicio, agregado) del rango, en orden cronológico"""
+        # Garantiza el backfill antes de leer los buckets
+        self.get(company_id)
+
+        db = get_db()
+
+        def query():
+            query = db.table(PERIOD_TABLE).select("*").eq("company_id", company_id).eq("granularity", granularity)
+            query = query.eq("vehicle_id", vehicle_id) if vehicle_id else query.is_("vehicle_id", "null")
+            if date_from:
+                query = query.gte("period_start", date_from)
+            if date_to:
+                query = query.lte("period_start", date_to)
+            return query.order("period_start")
+
+        return [(row["period_start"][:10], FuelAggregate.from_row(row)) for row in fetch_all(query)]
+
+    def daily_miles(self, company_id: str, since: str, vehicle_id: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """vehicle_id -> {día: millas} desde `since`, de los buckets diarios por vehículo (paginado)"""
+        self.get(company_id)
+
+        db = get_db()
+
+        def query():
+            query = db.table(PERIOD_TABLE).select("vehicle_id,period_start,miles_driven")
+            query = query.eq("company_id", company_id).eq("granularity", "day").gte("period_start", since)
+            if vehicle_id:
+                query = query.eq("vehicle_id", vehicle_id)
+            return query.order("period_start").order("id")
+
+        daily: Dict[str, Dict[str, float]] = {}
+        for row in fetch_all(query):
+            # Las filas de empresa (vehicle_id null) no aplican
+            if row.get("vehicle_id"):
+                daily.setdefault(row["vehicle_id"], {})[row["period_start"][:10]] = row.get("miles_driven") or 0
+        return daily
+
+    def invalidate(self, company_id: str):
+        """Borra los rollups de la empresa; la próxima lectura los reconstruye"""
+        result = get_db().table(ROLLUP_TABLE).delete().eq("company_id", company_id).execute()
+        if result.error:
+            logger.error(f"❌ Error invalidating fuel rollups for company {company_id}: {result.error}")
+
+fuel_rollups = FuelRollups()
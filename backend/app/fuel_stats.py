@@ -0,0 +1,153 @@
+# app/fuel_stats.py
+"""
+Agregados de combustible en una sola pasada: totales de la empresa y group-by
+por vehículo en O(registros), compartidos por métricas y análisis de consumo.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Granularidades de los rollups por periodo (semanas ISO: empiezan en lunes)
+GRANULARITIES = ("day", "week", "month")
+
+# Umbrales de rendimiento (km/L promedio por registro)
+LOW_PERFORMANCE_THRESHOLD = 7
+CRITICAL_PERFORMANCE_THRESHOLD = 6
+
+class FuelAggregate:
+    __slots__ = ("count", "fuel", "miles", "cost", "consumption_sum", "min_consumption", "max_consumption")
+
+    def __init__(self):
+        self.count = 0
+        self.fuel = 0.0
+        self.miles = 0.0
+        self.cost = 0.0
+        self.consumption_sum = 0.0
+        self.min_consumption: Optional[float] = None
+        self.max_consumption: Optional[float] = None
+
+    def add(self, record: dict):
+        consumption = record.get("consumption") or 0
+        self.count += 1
+        self.fuel += record.get("fuel_amount") or 0
+        self.miles += record.get("miles_driven") or 0
+        self.cost += record.get("total_cost") or 0
+        self.consumption_sum += consumption
+        if self.min_consumption is None or consumption < self.min_consumption:
+            self.min_consumption = consumption
+        if self.max_consumption is None or consumption > self.max_consumption:
+            self.max_consumption = consumption
+
+    def merge(self, other: "FuelAggregate"):
+        """Suma otro agregado (p. ej. varios buckets de periodo)"""
+        self.count += other.count
+        self.fuel += other.fuel
+        self.miles += other.miles
+        self.cost += other.cost
+        self.consumption_sum += other.consumption_sum
+        for value in (other.min_consumption, other.max_consumption):
+            if value is None:
+                continue
+            if self.min_consumption is None or value < self.min_consumption:
+                self.min_consumption = value
+            if self.max_consumption is None or value > self.max_consumption:
+                self.max_consumption = value
+
+    @classmethod
+    def from_row(cls, row: dict) -> "FuelAggregate":
+        """Agregado desde una fila de la tabla fuel_rollups"""
+        aggregate = cls()
+        aggregate.count = row.get("record_count") or 0
+        aggregate.fuel = row.get("fuel_amount") or 0
+        aggregate.miles = row.get("miles_driven") or 0
+        aggregate.cost = row.get("total_cost") or 0
+        aggregate.consumption_sum = row.get("consumption_sum") or 0
+        aggregate.min_consumption = row.get("min_consumption")
+        aggregate.max_consumption = row.get("max_consumption")
+        return aggregate
+
+    def to_row(self) -> dict:
+        return {
+            "record_count": self.count,
+            "fuel_amount": self.fuel,
+            "miles_driven": self.miles,
+            "total_cost": self.cost,
+            "consumption_sum": self.consumption_sum,
+            "min_consumption": self.min_consumption,
+            "max_consumption": self.max_consumption
+        }
+
+    @property
+    def average_consumption(self) -> float:
+        """Consumo global: millas totales / combustible total"""
+        return self.miles / self.fuel if self.fuel > 0 else 0
+
+    @property
+    def mean_consumption(self) -> float:
+        """Promedio simple del consumo de cada registro"""
+        return self.consumption_sum / self.count if self.count else 0
+
+    @property
+    def cost_per_mile(self) -> float:
+        return self.cost / self.miles if self.miles > 0 else 0
+
+def aggregate_fuel(records: Iterable[dict]) -> FuelAggregate:
+    aggregate = FuelAggregate()
+    for record in records:
+        aggregate.add(record)
+    return aggregate
+
+def group_fuel_by_vehicle(records: Iterable[dict]) -> Dict[str, FuelAggregate]:
+    """vehicle_id -> agregado, recorriendo los registros una sola vez"""
+    groups: Dict[str, FuelAggregate] = {}
+    for record in records:
+        aggregate = groups.get(record["vehicle_id"])
+        if aggregate is None:
+            aggregate = groups[record["vehicle_id"]] = FuelAggregate()
+        aggregate.add(record)
+    return groups
+
+def low_performance_vehicles(
+    vehicles: List[dict],
+    groups: Dict[str, FuelAggregate],
+    low_threshold: float = LOW_PERFORMANCE_THRESHOLD,
+    critical_threshold: float = CRITICAL_PERFORMANCE_THRESHOLD
+) -> List[dict]:
+    """Vehículos con consumo promedio bajo el umbral, en el orden de `vehicles`"""
+    low_performance = []
+    for vehicle in vehicles:
+        aggregate = groups.get(vehicle["id"])
+        if not aggregate or not aggregate.count:
+            continue
+        avg_consumption = aggregate.mean_consumption
+        if avg_consumption < low_threshold:
+            low_performance.append({
+                'unit_id': vehicle['unit_id'],
+                'consumption': round(avg_consumption, 1),
+                'status': 'critical' if avg_consumption < critical_threshold else 'low'
+            })
+    return low_performance
+
+def period_start(value: str, granularity: str) -> str:
+    """Inicio del periodo que contiene la fecha ("2024-05-15" -> "2024-05-01" en month)"""
+    day = date.fromisoformat(value[:10])
+    if granularity == "week":
+        day -= timedelta(days=day.weekday())
+    elif granularity == "month":
+        day = day.replace(day=1)
+    return day.isoformat()
+
+def group_fuel_by_period(records: Iterable[dict], granularity: str) -> Dict[Tuple[Optional[str], str], FuelAggregate]:
+    """(vehicle_id, inicio del periodo) -> agregado; vehicle_id None = total de la empresa"""
+    groups: Dict[Tuple[Optional[str], str], FuelAggregate] = {}
+    for record in records:
+        try:
+            start = period_start(record["date"], granularity)
+        except (KeyError, TypeError, ValueError):
+            # Registro sin fecha válida: no pertenece a ningún periodo
+            continue
+        for key in ((None, start), (record["vehicle_id"], start)):
+            aggregate = groups.get(key)
+            if aggregate is None:
+                aggregate = groups[key] = FuelAggregate()
+            aggregate.add(record)
+    return groups
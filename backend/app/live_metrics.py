@@ -0,0 +1,246 @@
+# app/live_metrics.py
+"""
+Métricas en vivo por empresa: en lugar de recalcular en cada poll de GET /metrics/,
+se recalculan como mucho una vez por intervalo cuando llega un evento de
+combustible, mantenimiento o vehículos, se cachean y se empujan como
+METRICS_UPDATED a los sockets suscritos. N dashboards cuestan un solo cálculo.
+
+Si en el worker nadie tiene un socket abierto de la empresa no se recalcula:
+solo se invalida el cache y GET /metrics/ calcula al leer.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from .analytics import FuelAnalytics
+from .batching import BATCH_EVENT_TYPE
+from .date_range import DateRange
+from .fuel_rollups import fuel_rollups
+from .consumption_sketches import SKETCH_MIN_SAMPLES, consumption_sketches
+from .fuel_stats import CRITICAL_PERFORMANCE_THRESHOLD, LOW_PERFORMANCE_THRESHOLD, FuelAggregate, low_performance_vehicles
+from .maintenance_schedule import maintenance_schedule
+from .manager import manager
+from .models.database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo entre dos recálculos de la misma empresa
+METRICS_RECOMPUTE_INTERVAL_SECONDS = float(os.getenv("METRICS_RECOMPUTE_INTERVAL_SECONDS", "5"))
+
+# Cota de frescura para workers que no reciben los eventos de la empresa
+METRICS_CACHE_TTL_SECONDS = float(os.getenv("METRICS_CACHE_TTL_SECONDS", "60"))
+
+METRICS_EVENT_TYPE = "METRICS_UPDATED"
+
+UPCOMING_MAINTENANCE_DAYS = 30
+
+# Eventos que cambian las métricas del dashboard
+METRICS_EVENT_PREFIXES = ("FUEL_", "MAINTENANCE_", "VEHICLE_")
+
+def compute_company_metrics(
+    company_id: str,
+    window: Optional[DateRange] = None,
+    vehicles: Optional[List[dict]] = None,
+    rollups: Optional[Tuple[FuelAggregate, Dict[str, FuelAggregate]]] = None,
+    upcoming: Optional[List[dict]] = None
+) -> dict:
+    """
+    Cálculo completo de las métricas del dashboard (síncrono, consulta la BD).
+    Con ventana de fechas solo se leen los registros del periodo y los campos
+    monthly_* cubren esa ventana. vehicles, rollups (get_company) y upcoming
+    se pasan si el llamador ya los leyó, para no repetir esas consultas
+    """
+    db = get_db()
+
+    if vehicles is None:
+        vehicles = db.table("vehicles").select("*").eq("company_id", company_id).execute().data
+
+    if window and window.active:
+        query = db.table("fuel_records").select("*").eq("company_id", company_id)
+        result = window.apply(query).execute()
+        if result.error:
+            raise Exception(result.error)
+        analytics = FuelAnalytics(result.data or [])
+        totals = monthly = analytics.totals()
+        groups = analytics.by_vehicle()
+    else:
+        # Totales y agregados por vehículo desde los rollups incrementales
+        totals, groups = rollups or fuel_rollups.get_company(company_id)
+
+        # Los campos monthly_* cubren el mes en curso (bucket mensual), no todo el historial
+        month_start = datetime.now().strftime("%Y-%m-01")
+        buckets = fuel_rollups.periods(company_id, "month", month_start, month_start)
+        monthly = buckets[0][1] if buckets else FuelAggregate()
+
+    low_performance = low_performance_vehicles(vehicles, groups, *performance_thresholds(company_id))
+
+    # Mantenimientos de los próximos 30 días desde el índice por next_maintenance_date
+    if upcoming is None:
+        upcoming = maintenance_schedule.upcoming(company_id, UPCOMING_MAINTENANCE_DAYS)
+
+    return {
+        "average_consumption": round(totals.average_consumption, 1),
+        "monthly_fuel_cost": round(monthly.cost, 2),
+        "cost_per_mile": round(totals.cost_per_mile, 2),
+        "monthly_miles": round(monthly.miles, 0),
+        "low_performance_vehicles": low_performance,
+        "upcoming_maintenance": upcoming
+    }
+
+def performance_thresholds(company_id: str) -> Tuple[float, float]:
+    """
+    Umbrales (bajo, crítico) relativos a la flota: p10 y p5 del consumo de todas
+    sus cargas. Con pocas muestras se usan los umbrales fijos de siempre
+    """
+    try:
+        fleet = consumption_sketches.fleet(company_id)
+    except Exception as e:
+        logger.error(f"❌ Error loading fleet consumption sketch for company {company_id}: {e}")
+        return LOW_PERFORMANCE_THRESHOLD, CRITICAL_PERFORMANCE_THRESHOLD
+    if fleet.count < SKETCH_MIN_SAMPLES:
+        return LOW_PERFORMANCE_THRESHOLD, CRITICAL_PERFORMANCE_THRESHOLD
+    return fleet.quantile(0.10), fleet.quantile(0.05)
+
+def affects_metrics(message: dict) -> bool:
+    return (message.get("type") or "").startswith(METRICS_EVENT_PREFIXES)
+
+class LiveMetrics:
+    def __init__(
+        self,
+        compute: Callable[..., dict] = compute_company_metrics,
+        interval_seconds: float = METRICS_RECOMPUTE_INTERVAL_SECONDS,
+        ttl_seconds: float = METRICS_CACHE_TTL_SECONDS
+    ):
+        self.compute = compute
+        self.interval_seconds = interval_seconds
+        self.ttl_seconds = ttl_seconds
+        self.manager = None
+        # company_id -> (métricas, instante del cálculo)
+        self._cache: Dict[str, Tuple[dict, float]] = {}
+        self._last_run: Dict[str, float] = {}
+        self._scheduled: Dict[str, asyncio.Task] = {}
+        # Recálculos de respaldo por cambios de otros workers (ver on_event)
+        self._fallbacks: Dict[str, asyncio.Task] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.computations = 0
+        self.pushes = 0
+        self.skipped = 0
+
+    def attach(self, manager):
+        self.manager = manager
+        manager.add_listener(self.on_event)
+
+    async def get(self, company_id: str, **prefetched) -> dict:
+        """
+        Métricas cacheadas; solo calcula si no hay entrada o expiró.
+        `prefetched` (ver compute_company_metrics) evita releer lo que el llamador ya tiene
+        """
+        entry = self._cache.get(company_id)
+        if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+            return entry[0]
+        return await self._compute(company_id, prefetched)
+
+    def invalidate(self, company_id: str):
+        self._cache.pop(company_id, None)
+
+    async def _compute(self, company_id: str, prefetched: Optional[dict] = None) -> dict:
+        # Polls concurrentes durante un miss comparten el mismo cálculo
+        task = self._inflight.get(company_id)
+        if task is None:
+            task = asyncio.create_task(self._run(company_id, prefetched))
+            self._inflight[company_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(company_id, None))
+        return await asyncio.shield(task)
+
+    async def _run(self, company_id: str, prefetched: Optional[dict] = None) -> dict:
+        self._last_run[company_id] = time.monotonic()
+        self.computations += 1
+        # El cliente de BD es síncrono: fuera del event loop
+        metrics = await asyncio.to_thread(self.compute, company_id, **(prefetched or {}))
+        self._cache[company_id] = (metrics, time.monotonic())
+        return metrics
+
+    def on_event(self, company_id: str, message: dict, local: bool):
+        events = message.get("events", []) if message.get("type") == BATCH_EVENT_TYPE else [message]
+        for event in events:
+            if event.get("type") == METRICS_EVENT_TYPE:
+                # El push de otro worker también refresca el cache de este
+                if not local and isinstance(event.get("data"), dict):
+                    self._cache[company_id] = (event["data"], time.monotonic())
+                    self._cancel_fallback(company_id)
+            elif affects_metrics(event):
+                if not self.listening(company_id):
+                    # Sin dashboards conectados aquí no hay a quién empujar
+                    self.invalidate(company_id)
+                    self.skipped += 1
+                elif local:
+                    self.schedule(company_id)
+                elif company_id not in self._scheduled:
+                    # Cambio de otro worker: lo recalcula quien lo publicó si tiene
+                    # sockets (su METRICS_UPDATED cancela este respaldo); si no, este
+                    self._schedule_fallback(company_id)
+
+    def listening(self, company_id: str) -> bool:
+        return bool(self.manager and self.manager.active_connections.get(company_id))
+
+    def schedule(self, company_id: str):
+        """Programa un recálculo respetando el intervalo mínimo; las ráfagas se agrupan"""
+        if company_id in self._scheduled:
+            return
+        elapsed = time.monotonic() - self._last_run.get(company_id, float("-inf"))
+        delay = max(self.interval_seconds - elapsed, 0)
+        task = asyncio.create_task(self._recompute_later(company_id, delay, self._scheduled))
+        self._scheduled[company_id] = task
+
+    def _schedule_fallback(self, company_id: str):
+        if company_id in self._fallbacks:
+            return
+        task = asyncio.create_task(self._recompute_later(company_id, self.interval_seconds, self._fallbacks))
+        self._fallbacks[company_id] = task
+
+    def _cancel_fallback(self, company_id: str):
+        task = self._fallbacks.pop(company_id, None)
+        if task:
+            task.cancel()
+
+    async def _recompute_later(self, company_id: str, delay: float, pending: Dict[str, asyncio.Task]):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            # Eventos durante el cálculo programan el siguiente
+            if pending.get(company_id) is asyncio.current_task():
+                del pending[company_id]
+        try:
+            metrics = await self._compute(company_id)
+        except Exception as e:
+            logger.error(f"❌ Error recomputing metrics for company {company_id}: {e}")
+            return
+
+        self.pushes += 1
+        self._cancel_fallback(company_id)
+        await self.manager.broadcast_to_company({
+            "type": METRICS_EVENT_TYPE,
+            "data": metrics,
+            "timestamp": datetime.now().isoformat()
+        }, company_id)
+
+    def stop(self):
+        for task in [*self._scheduled.values(), *self._fallbacks.values()]:
+            task.cancel()
+        self._scheduled.clear()
+        self._fallbacks.clear()
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "cached_companies": len(self._cache),
+            "pending_recomputes": len(self._scheduled) + len(self._fallbacks),
+            "computations": self.computations,
+            "pushes": self.pushes,
+            "skipped_recomputes": self.skipped
+        }
+
+live_metrics = LiveMetrics()
+live_metrics.attach(manager)
@@ -0,0 +1,362 @@
+# app/maintenance_planner.py
+"""
+Planner de mantenimiento preventivo: para cada plan (cada N millas y/o cada
+M días por maintenance_type, de un modelo o de toda la flota) proyecta cuándo
+vence cada vehículo.
+
+- Por días: último servicio de ese tipo (o alta del vehículo) + M días.
+- Por millas: millas desde el último servicio (buckets diarios de
+  fuel_period_rollups) contra N, proyectadas con el ritmo de millas/día de
+  los últimos RATE_WINDOW_DAYS. Sin servicio registrado se usa el odómetro
+  (vehicles.total_miles) y el próximo múltiplo de N.
+
+La empresa se carga una vez; después cada evento toca solo su vehículo: una
+carga nueva suma sus millas y re-proyecta ese vehículo, sin recalcular la
+flota. Ediciones/bajas marcan el vehículo para releerlo en la próxima consulta.
+
+Antes de cargar, el worker se suscribe al canal de la empresa
+(manager.watch_company) para recibir también los cambios de los otros workers.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Set
+from .batching import BATCH_EVENT_TYPE
+from .fuel_rollups import fuel_rollups
+from .maintenance_schedule import INACTIVE_STATUSES, MAINTENANCE_EVENT_PREFIX, PLAN_EVENT_PREFIX, CompanySchedule
+from .manager import manager
+from .models.database import get_db
+
+logger = logging.getLogger(__name__)
+
+PLAN_TABLE = "maintenance_plans"
+
+# Ventana para el ritmo de millas/día de cada vehículo
+RATE_WINDOW_DAYS = int(os.getenv("PLANNER_RATE_WINDOW_DAYS", "90"))
+
+# Recarga completa periódica: la ventana del ritmo se desplaza cada día
+PLANNER_TTL_SECONDS = float(os.getenv("PLANNER_TTL_SECONDS", "3600"))
+
+FUEL_EVENT_PREFIX = "FUEL_RECORD_"
+VEHICLE_EVENT_PREFIX = "VEHICLE_"
+
+# Marca de "recargar la empresa completa" entre los vehículos tocados durante una carga
+RELOAD_ALL = "*"
+
+def plan_applies(plan: dict, vehicle: dict) -> bool:
+    return not plan.get("model") or plan["model"] == vehicle.get("model")
+
+def _parse_day(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value[:10]) if value else None
+    except ValueError:
+        return None
+
+def project(
+    plan: dict,
+    vehicle: dict,
+    last_service: Optional[str],
+    miles_since: float,
+    miles_per_day: float,
+    today: date
+) -> Optional[dict]:
+    """Próximo vencimiento de un plan para un vehículo (lo que llegue primero)"""
+    candidates = []
+    used = remaining = None
+    if plan.get("interval_miles"):
+        interval = plan["interval_miles"]
+        used = miles_since if last_service else (vehicle.get("total_miles") or 0) % interval
+        remaining = interval - used
+        if miles_per_day > 0:
+            # Negativo si ya se pasó: la fecha estimada queda en el pasado
+            candidates.append((today + timedelta(days=math.ceil(remaining / miles_per_day)), "miles"))
+        elif remaining <= 0:
+            candidates.append((today, "miles"))
+    if plan.get("interval_days"):
+        base = _parse_day(last_service) or _parse_day(vehicle.get("created_at")) or today
+        candidates.append((base + timedelta(days=plan["interval_days"]), "days"))
+    if not candidates:
+        return None
+
+    due, trigger = min(candidates)
+    return {
+        "id": f"{plan['id']}:{vehicle['id']}",
+        "plan_id": plan["id"],
+        "vehicle_id": vehicle["id"],
+        "unit_id": vehicle.get("unit_id"),
+        "model": vehicle.get("model"),
+        "maintenance_type": plan["maintenance_type"],
+        "last_service_date": last_service,
+        "miles_since_service": round(used, 1) if used is not None else None,
+        "miles_remaining": round(remaining, 1) if remaining is not None else None,
+        "miles_per_day": round(miles_per_day, 1),
+        "due_date": due.isoformat(),
+        "trigger": trigger,
+        "overdue": due < today
+    }
+
+class CompanyPlanner:
+    """Estado de una empresa: planes, vehículos, últimos servicios y millas diarias"""
+    def __init__(self, plans: List[dict], vehicles: List[dict]):
+        self.plans = plans
+        self.vehicles: Dict[str, dict] = {vehicle["id"]: vehicle for vehicle in vehicles}
+        # vehicle_id -> {maintenance_type: fecha del último servicio}
+        self.last_service: Dict[str, Dict[str, str]] = {}
+        # vehicle_id -> {día: millas}
+        self.daily: Dict[str, Dict[str, float]] = {}
+        self.schedule = CompanySchedule([], due=lambda entry: entry["due_date"])
+        self.entries: Dict[str, List[str]] = {}
+        self.dirty: Set[str] = set()
+        self.refreshing: Set[str] = set()
+        self.loaded_at = time.monotonic()
+        # Suscrito al canal de la empresa: los eventos propios llegan también como eco del pub/sub
+        self.watched = False
+
+    def record_service(self, record: dict):
+        if record.get("status") in INACTIVE_STATUSES or not record.get("date"):
+            return
+        services = self.last_service.setdefault(record["vehicle_id"], {})
+        day = record["date"][:10]
+        if day > services.get(record["maintenance_type"], ""):
+            services[record["maintenance_type"]] = day
+
+    def history_start(self, today: date, vehicle_id: Optional[str] = None) -> str:
+        """Primer día de millas necesario: ventana del ritmo o el servicio más antiguo"""
+        start = (today - timedelta(days=RATE_WINDOW_DAYS)).isoformat()
+        planned = {plan["maintenance_type"] for plan in self.plans if plan.get("interval_miles")}
+        scopes = [self.last_service.get(vehicle_id, {})] if vehicle_id else self.last_service.values()
+        for services in scopes:
+            for maintenance_type, day in services.items():
+                if maintenance_type in planned:
+                    start = min(start, day)
+        return start
+
+    def project_vehicle(self, vehicle_id: str, today: date):
+        for entry_id in self.entries.pop(vehicle_id, []):
+            self.schedule.remove(entry_id)
+        vehicle = self.vehicles.get(vehicle_id)
+        if vehicle is None:
+            return
+
+        daily = self.daily.get(vehicle_id, {})
+        window_start = (today - timedelta(days=RATE_WINDOW_DAYS)).isoformat()
+        miles_per_day = sum(miles for day, miles in daily.items() if day >= window_start) / RATE_WINDOW_DAYS
+        services = self.last_service.get(vehicle_id, {})
+
+        entry_ids = []
+        for plan in self.plans:
+            if not plan_applies(plan, vehicle):
+                continue
+            last_service = services.get(plan["maintenance_type"])
+            # Las cargas del mismo día del servicio se asumen anteriores a él
+            miles_since = sum(miles for day, miles in daily.items() if day > last_service) if last_service else 0
+            entry = project(plan, vehicle, last_service, miles_since, miles_per_day, today)
+            if entry:
+                self.schedule.put(entry)
+                entry_ids.append(entry["id"])
+        self.entries[vehicle_id] = entry_ids
+
+    def project_all(self, today: date):
+        for vehicle_id in self.vehicles:
+            self.project_vehicle(vehicle_id, today)
+
+class MaintenancePlanner:
+    def __init__(self, ttl_seconds: float = PLANNER_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._companies: Dict[str, CompanyPlanner] = {}
+        # company_id -> vehículos tocados por eventos mientras se carga
+        self._loading: Dict[str, Set[str]] = {}
+        self.loads = 0
+        self.incremental_updates = 0
+        self.vehicle_refreshes = 0
+        self.manager = None
+
+    def attach(self, manager):
+        self.manager = manager
+        manager.add_listener(self.on_event)
+
+    def due(
+        self,
+        company_id: str,
+        within_days: int,
+        include_overdue: bool = False,
+        vehicle_id: Optional[str] = None
+    ) -> List[dict]:
+        """Vencimientos proyectados entre hoy y hoy + within_days, por fecha (síncrono)"""
+        today = date.today()
+        planner = self._planner(company_id)
+        start = None if include_overdue else today.isoformat()
+        end = (today + timedelta(days=within_days)).isoformat()
+        with self._lock:
+            entries = planner.schedule.between(start, end)
+        if vehicle_id:
+            entries = [entry for entry in entries if entry["vehicle_id"] == vehicle_id]
+        return entries
+
+    def _planner(self, company_id: str) -> CompanyPlanner:
+        with self._lock:
+            planner = self._companies.get(company_id)
+        if not planner or time.monotonic() - planner.loaded_at >= self.ttl_seconds:
+            planner = self._load(company_id)
+        with self._lock:
+            dirty = planner.dirty - planner.refreshing
+            planner.dirty -= dirty
+            planner.refreshing |= dirty
+        for vehicle_id in dirty:
+            self._refresh_vehicle(company_id, planner, vehicle_id)
+        return planner
+
+    def _load(self, company_id: str) -> CompanyPlanner:
+        # Suscrito antes de leer: ningún cambio de otro worker queda entre la consulta y los eventos
+        watched = bool(self.manager and self.manager.watch_company(company_id))
+        with self._lock:
+            self._loading.setdefault(company_id, set())
+        try:
+            db = get_db()
+            plans = db.table(PLAN_TABLE).select("*").eq("company_id", company_id).execute()
+            vehicles = db.table("vehicles").select("id,unit_id,model,total_miles,created_at").eq("company_id", company_id).execute()
+            services = db.table("maintenance").select("vehicle_id,maintenance_type,date,status").eq("company_id", company_id).execute()
+            for result in (plans, vehicles, services):
+                if result.error:
+                    raise Exception(result.error)
+
+            today = date.today()
+            planner = CompanyPlanner(plans.data or [], vehicles.data or [])
+            planner.watched = watched
+            for record in services.data or []:
+                planner.record_service(record)
+            if any(plan.get("interval_miles") for plan in planner.plans):
+                planner.daily = fuel_rollups.daily_miles(company_id, planner.history_start(today))
+        except Exception:
+            with self._lock:
+                self._loading.pop(company_id, None)
+            raise
+
+        with self._lock:
+            planner.project_all(today)
+            touched = self._loading.pop(company_id, set())
+            if RELOAD_ALL in touched:
+                # Cambió un plan durante la carga: la próxima consulta recarga
+                planner.loaded_at = float("-inf")
+            planner.dirty |= touched - {RELOAD_ALL}
+            self._companies[company_id] = planner
+        self.loads += 1
+        logger.info(f"🔄 Maintenance planner loaded for company {company_id} ({len(planner.schedule.records)} projections)")
+        return planner
+
+    def _refresh_vehicle(self, company_id: str, planner: CompanyPlanner, vehicle_id: str):
+        """Relee un solo vehículo (tras ediciones/bajas que no se pueden aplicar como delta)"""
+        try:
+            db = get_db()
+            vehicle = db.table("vehicles").select("id,unit_id,model,total_miles,created_at").eq("id", vehicle_id).eq("company_id", company_id).execute()
+            services = db.table("maintenance").select("vehicle_id,maintenance_type,date,status").eq("company_id", company_id).eq("vehicle_id", vehicle_id).execute()
+            for result in (vehicle, services):
+                if result.error:
+                    raise Exception(result.error)
+
+            today = date.today()
+            scratch = CompanyPlanner(planner.plans, vehicle.data or [])
+            for record in services.data or []:
+                scratch.record_service(record)
+            daily = {}
+            if any(plan.get("interval_miles") for plan in planner.plans):
+                daily = fuel_rollups.daily_miles(company_id, scratch.history_start(today, vehicle_id), vehicle_id).get(vehicle_id, {})
+        except Exception as e:
+            logger.error(f"❌ Error refreshing planner vehicle {vehicle_id}: {e}")
+            with self._lock:
+                planner.refreshing.discard(vehicle_id)
+                planner.dirty.add(vehicle_id)
+            return
+
+        with self._lock:
+            planner.refreshing.discard(vehicle_id)
+            if vehicle.data:
+                planner.vehicles[vehicle_id] = vehicle.data[0]
+            else:
+                planner.vehicles.pop(vehicle_id, None)
+            planner.last_service[vehicle_id] = scratch.last_service.get(vehicle_id, {})
+            planner.daily[vehicle_id] = daily
+            planner.project_vehicle(vehicle_id, today)
+        self.vehicle_refreshes += 1
+
+    def invalidate(self, company_id: str):
+        with self._lock:
+            self._companies.pop(company_id, None)
+
+    def _apply(self, planner: CompanyPlanner, event: dict) -> Optional[str]:
+        """Aplica un evento; devuelve el vehículo afectado (RELOAD_ALL si cambió un plan)"""
+        event_type = event.get("type") or ""
+        data = event.get("data") or {}
+        if event_type.startswith(PLAN_EVENT_PREFIX):
+            return RELOAD_ALL
+
+        if event_type.startswith(VEHICLE_EVENT_PREFIX):
+            vehicle_id = data.get("id")
+            if not vehicle_id:
+                return None
+            if event_type == "VEHICLE_DELETED":
+                planner.vehicles.pop(vehicle_id, None)
+            else:
+                planner.vehicles[vehicle_id] = {**planner.vehicles.get(vehicle_id, {}), **data}
+        else:
+            vehicle_id = data.get("vehicle_id")
+            if not vehicle_id:
+                return None
+            if vehicle_id in planner.refreshing:
+                # La relectura en curso puede no incluir este cambio: se repite
+                planner.dirty.add(vehicle_id)
+                return vehicle_id
+            if event_type == "FUEL_RECORD_CREATED" and data.get("date"):
+                daily = planner.daily.setdefault(vehicle_id, {})
+                day = data["date"][:10]
+                daily[day] = daily.get(day, 0) + (data.get("miles_driven") or 0)
+                self.incremental_updates += 1
+            elif event_type in ("MAINTENANCE_CREATED", "MAINTENANCE_APPROVED") and data.get("maintenance_type"):
+                # Un servicio más reciente solo acorta la historia necesaria
+                planner.record_service(data)
+                self.incremental_updates += 1
+            else:
+                planner.dirty.add(vehicle_id)
+                return vehicle_id
+
+        planner.project_vehicle(vehicle_id, date.today())
+        return vehicle_id
+
+    def on_event(self, company_id: str, message: dict, local: bool):
+        events = message.get("events", []) if message.get("type") == BATCH_EVENT_TYPE else [message]
+        with self._lock:
+            for event in events:
+                event_type = event.get("type") or ""
+                if not event_type.startswith((FUEL_EVENT_PREFIX, MAINTENANCE_EVENT_PREFIX, VEHICLE_EVENT_PREFIX)):
+                    continue
+                planner = self._companies.get(company_id)
+                # Sumar millas no es idempotente: con el canal suscrito se aplica solo
+                # la copia del pub/sub (propia o de otro worker), si no solo la local
+                if planner and local == planner.watched:
+                    planner = None
+                touched = self._apply(planner, event) if planner else None
+                if touched == RELOAD_ALL:
+                    self._companies.pop(company_id, None)
+                if company_id in self._loading:
+                    data = event.get("data") or {}
+                    if event_type.startswith(PLAN_EVENT_PREFIX):
+                        self._loading[company_id].add(RELOAD_ALL)
+                    elif data.get("vehicle_id") or data.get("id"):
+                        self._loading[company_id].add(data.get("vehicle_id") or data["id"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "companies": len(self._companies),
+                "projections": sum(len(planner.schedule.records) for planner in self._companies.values()),
+                "loads": self.loads,
+                "incremental_updates": self.incremental_updates,
+                "vehicle_refreshes": self.vehicle_refreshes
+            }
+
+maintenance_planner = MaintenancePlanner()
+maintenance_planner.attach(manager)
@@ -0,0 +1,181 @@
+# app/maintenance_schedule.py
+"""
+Índice de mantenimientos por fecha de próximo servicio (next_maintenance_date).
+
+Cada empresa se carga una vez desde la BD a una lista ordenada de
+(fecha, id); después se mantiene con los eventos MAINTENANCE_* del manager
+(locales y de otros workers vía pub/sub), así que "qué vence en los próximos
+N días" es un bisect: O(log n + k) sin releer la tabla.
+
+Antes de cargar una empresa el worker se suscribe a su canal
+(manager.watch_company): sin sockets abiertos de esa empresa no recibiría
+los cambios hechos en los otros workers de uvicorn.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from .batching import BATCH_EVENT_TYPE
+from .manager import manager
+from .models.database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Recarga completa periódica por si se perdió algún evento
+SCHEDULE_TTL_SECONDS = float(os.getenv("MAINTENANCE_SCHEDULE_TTL_SECONDS", "900"))
+
+MAINTENANCE_EVENT_PREFIX = "MAINTENANCE_"
+# Cambios de planes preventivos (app/maintenance_planner.py), no de registros
+PLAN_EVENT_PREFIX = "MAINTENANCE_PLAN_"
+
+# Registros que no vuelven a vencer
+INACTIVE_STATUSES = ("cancelled",)
+
+def due_date(record: dict) -> Optional[str]:
+    value = record.get("next_maintenance_date")
+    return value[:10] if value else None
+
+def active_due_date(record: dict) -> Optional[str]:
+    return None if record.get("status") in INACTIVE_STATUSES else due_date(record)
+
+class CompanySchedule:
+    """
+    Registros de una empresa ordenados por fecha de vencimiento. `due` extrae
+    la fecha (None = no vence); también lo usa el planner con sus proyecciones
+    """
+    def __init__(self, records: List[dict], due: Callable[[dict], Optional[str]] = None):
+        self.due = due or active_due_date
+        self.keys: List[Tuple[str, str]] = []
+        self.records: Dict[str, dict] = {}
+        self.loaded_at = time.monotonic()
+        for record in records:
+            self.put(record)
+
+    def put(self, record: dict):
+        self.remove(record["id"])
+        due = self.due(record)
+        if not due:
+            return
+        self.records[record["id"]] = record
+        insort(self.keys, (due, record["id"]))
+
+    def remove(self, record_id: str):
+        record = self.records.pop(record_id, None)
+        if record is None:
+            return
+        key = (self.due(record), record_id)
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def between(self, start: Optional[str], end: str) -> List[dict]:
+        """Vencimientos en [start, end] (start=None: también los atrasados)"""
+        low = bisect_left(self.keys, (start,)) if start else 0
+        # (end, "\uffff") queda después de cualquier id con fecha end
+        high = bisect_right(self.keys, (end, "\uffff"))
+        return [self.records[record_id] for _, record_id in self.keys[low:high]]
+
+class MaintenanceSchedule:
+    def __init__(self, ttl_seconds: float = SCHEDULE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # Las consultas corren en threads (to_thread) y los eventos en el loop
+        self._lock = threading.Lock()
+        self._companies: Dict[str, CompanySchedule] = {}
+        # company_id -> eventos recibidos mientras se carga desde la BD
+        self._loading: Dict[str, List[dict]] = {}
+        self.loads = 0
+        self.manager = None
+
+    def attach(self, manager):
+        self.manager = manager
+        manager.add_listener(self.on_event)
+
+    def upcoming(
+        self,
+        company_id: str,
+        within_days: int,
+        include_overdue: bool = False,
+        vehicle_id: Optional[str] = None
+    ) -> List[dict]:
+        """Mantenimientos que vencen entre hoy y hoy + within_days, por fecha (síncrono)"""
+        today = date.today()
+        start = None if include_overdue else today.isoformat()
+        end = (today + timedelta(days=within_days)).isoformat()
+        schedule = self._schedule(company_id)
+        with self._lock:
+            records = schedule.between(start, end)
+        if vehicle_id:
+            records = [record for record in records if record.get("vehicle_id") == vehicle_id]
+        return records
+
+    def _schedule(self, company_id: str) -> CompanySchedule:
+        with self._lock:
+            schedule = self._companies.get(company_id)
+        if schedule and time.monotonic() - schedule.loaded_at < self.ttl_seconds:
+            return schedule
+        return self._load(company_id)
+
+    def _load(self, company_id: str) -> CompanySchedule:
+        # Suscrito antes de leer: ningún cambio de otro worker queda entre la consulta y los eventos
+        if self.manager:
+            self.manager.watch_company(company_id)
+        with self._lock:
+            self._loading.setdefault(company_id, [])
+        try:
+            result = get_db().table("maintenance").select("*").eq("company_id", company_id).execute()
+            if result.error:
+                raise Exception(result.error)
+        except Exception:
+            with self._lock:
+                self._loading.pop(company_id, None)
+            raise
+
+        schedule = CompanySchedule(result.data or [])
+        with self._lock:
+            # Cambios ocurridos durante la consulta: se aplican encima de lo leído
+            for event in self._loading.pop(company_id, []):
+                self._apply(schedule, event)
+            self._companies[company_id] = schedule
+        self.loads += 1
+        logger.info(f"🔄 Maintenance schedule loaded for company {company_id} ({len(schedule.records)} due dates)")
+        return schedule
+
+    def invalidate(self, company_id: str):
+        with self._lock:
+            self._companies.pop(company_id, None)
+
+    def _apply(self, schedule: CompanySchedule, event: dict):
+        data = event.get("data") or {}
+        if not data.get("id"):
+            return
+        if event["type"] == "MAINTENANCE_DELETED":
+            schedule.remove(data["id"])
+        elif "next_maintenance_date" in data:
+            schedule.put(data)
+
+    def on_event(self, company_id: str, message: dict, local: bool):
+        events = message.get("events", []) if message.get("type") == BATCH_EVENT_TYPE else [message]
+        with self._lock:
+            for event in events:
+                event_type = event.get("type") or ""
+                if not event_type.startswith(MAINTENANCE_EVENT_PREFIX) or event_type.startswith(PLAN_EVENT_PREFIX):
+                    continue
+                if company_id in self._companies:
+                    self._apply(self._companies[company_id], event)
+                # También durante una recarga por TTL, para no perderlo al reemplazar el índice
+                if company_id in self._loading:
+                    self._loading[company_id].append(event)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "companies": len(self._companies),
+                "indexed": sum(len(schedule.records) for schedule in self._companies.values()),
+                "loads": self.loads
+            }
+
+maintenance_schedule = MaintenanceSchedule()
+maintenance_schedule.attach(manager)
@@ -1,34 +1,780 @@
 # app/manager.py
 from fastapi import WebSocket
-from typing import Dict, List
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import itertools
 import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+from .batching import BATCH_EVENT_TYPE, EventBatcher
+from .pubsub import PubSubBackend, channel_company, company_channel, create_pubsub
 
-class ConnectionManager:
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:  # codificación binaria opcional
+    msgpack = None
+
+# Tiempo máximo por envío; un socket más lento se considera caído
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "2"))
+
+# Mensajes pendientes por conexión antes de aplicar la política de overflow
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+
+# drop_oldest | coalesce | disconnect
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# Eventos recientes por empresa disponibles para reanudar con ?since=<seq>
+WS_EVENT_LOG_SIZE = int(os.getenv("WS_EVENT_LOG_SIZE", "500"))
+
+# Tiempo que se conserva el log (y la suscripción) tras desconectarse el último cliente
+WS_EVENT_LOG_GRACE_SECONDS = float(os.getenv("WS_EVENT_LOG_GRACE_SECONDS", "120"))
+
+# Heartbeat: ping a conexiones inactivas y cierre de las que no aceptan envíos.
+# Los sockets medio abiertos los detecta uvicorn con pings del protocolo
+# (WS_PING_INTERVAL_SECONDS / WS_PING_TIMEOUT_SECONDS en main.py y start.sh)
+WS_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "20"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+
+# Espera máxima de watch_company por la suscripción al canal de la empresa
+WS_WATCH_TIMEOUT_SECONDS = float(os.getenv("WS_WATCH_TIMEOUT_SECONDS", "5"))
+
+# Límites de conexiones simultáneas (por worker)
+WS_MAX_CONNECTIONS_PER_COMPANY = int(os.getenv("WS_MAX_CONNECTIONS_PER_COMPANY", "200"))
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "5"))
+
+# Codificaciones negociables con el cliente (?encoding= o subprotocolo WebSocket)
+ENCODINGS = ("json", "msgpack")
+
+class ConnectionLimitExceeded(Exception):
+    """La empresa o el usuario ya tiene el máximo de sockets abiertos"""
+    pass
+
+def event_vehicle_id(message: dict) -> Optional[str]:
+    """Vehículo al que se refiere el evento (None si no aplica)"""
+    data = message.get("data")
+    if not isinstance(data, dict):
+        return None
+    if data.get("vehicle_id"):
+        return data["vehicle_id"]
+    if str(message.get("type", "")).startswith("VEHICLE_"):
+        return data.get("id")
+    return None
+
+class Frame:
+    """
+    Evento pre-codificado una sola vez por broadcast; todas las conexiones de la
+    empresa comparten el mismo texto/binario en lugar de re-serializar N veces
+    """
+    __slots__ = ("message", "event_type", "vehicle_id", "_text", "_binary", "_sse", "_views")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.event_type = message.get("type")
+        self.vehicle_id = event_vehicle_id(message)
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+        self._sse: Optional[str] = None
+        self._views: Dict[tuple, Optional["Frame"]] = {}
+
+    def view_for(self, connection: "ClientConnection") -> Optional["Frame"]:
+        """
+        Frame que corresponde a la conexión según sus filtros. Un BATCH se recorta
+        a los eventos aceptados; el recorte se cachea por combinación de filtros
+        para codificarlo una sola vez
+        """
+        if connection.event_types is None and connection.vehicle_ids is None:
+            return self
+        if self.event_type != BATCH_EVENT_TYPE:
+            return self if connection.accepts_event(self.event_type, self.vehicle_id) else None
+
+        key = connection.filter_key
+        if key not in self._views:
+            events = [
+                event for event in self.message["events"]
+                if connection.accepts_event(event.get("type"), event_vehicle_id(event))
+            ]
+            self._views[key] = Frame({**self.message, "events": events}) if events else None
+        return self._views[key]
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            # Mismo formato compacto que WebSocket.send_json
+            self._text = json.dumps(self.message, separators=(",", ":"), ensure_ascii=False, default=str)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(self.message, default=str)
+        return self._binary
+
+    @property
+    def sse(self) -> str:
+        """Evento Server-Sent Events; el seq va en `id:` para reanudar con Last-Event-ID"""
+        if self._sse is None:
+            if self.event_type == "ping":
+                self._sse = ": ping\n\n"
+            else:
+                seq = self.message.get("seq")
+                event_id = f"id: {seq}\n" if seq is not None else ""
+                self._sse = f"{event_id}data: {self.text}\n\n"
+        return self._sse
+
+def negotiate_encoding(websocket: WebSocket) -> Tuple[str, Optional[str]]:
+    """Devuelve (codificación, subprotocolo a aceptar); JSON si msgpack no está disponible"""
+    requested = websocket.scope.get("subprotocols") or []
+    if msgpack is not None:
+        if "msgpack" in requested:
+            return "msgpack", "msgpack"
+        if websocket.query_params.get("encoding") == "msgpack":
+            return "msgpack", None
+    return "json", "json" if "json" in requested else None
+
+def coalesce_key(message: dict) -> Optional[Tuple[str, str]]:
+    """Eventos del mismo tipo sobre la misma entidad se reemplazan por el más reciente"""
+    data = message.get("data")
+    if isinstance(data, dict) and data.get("id"):
+        return message.get("type"), data["id"]
+    return None
+
+class EventLog:
+    """
+    Ring buffer acotado de los últimos eventos de una empresa, ordenado por seq.
+    Guarda los mismos Frames del broadcast, así el replay no re-serializa.
+    """
+    def __init__(self, size: int = WS_EVENT_LOG_SIZE):
+        self._events: Deque[Frame] = deque(maxlen=size)
+        self.last_seq: Optional[int] = None
+
+    def append(self, frame: Frame):
+        seq = frame.message.get("seq")
+        if seq is None:
+            # Evento sin seq (transporte caído): ya no se puede garantizar continuidad
+            self._events.clear()
+            self.last_seq = None
+            return
+        if self.last_seq is not None and seq != self.last_seq + 1:
+            self._events.clear()
+        self._events.append(frame)
+        self.last_seq = seq
+
+    def since(self, seq: int) -> Optional[List[Frame]]:
+        """Eventos posteriores a `seq`, o None si el hueco ya no está en el buffer"""
+        if self.last_seq is None or seq > self.last_seq:
+            return None
+        if seq == self.last_seq:
+            return []
+        first_seq = self._events[0].message["seq"]
+        if seq < first_seq - 1:
+            return None
+        return list(itertools.islice(self._events, seq - first_seq + 1, None))
+
+def parse_filter(values) -> Optional[Set[str]]:
+    """Lista JSON o CSV de query param -> set; vacío/None = sin filtro"""
+    if not values:
+        return None
+    if isinstance(values, str):
+        values = values.split(",")
+    return {str(value).strip() for value in values if str(value).strip()} or None
+
+class SubscriptionIndex:
+    """
+    Índice de suscripciones de una empresa para rutear cada evento solo a las
+    conexiones interesadas, sin recorrer todos los sockets de la flota
+    """
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.everything: Set["ClientConnection"] = set()
+        self.by_type: Dict[str, Set["ClientConnection"]] = {}
+        self.by_vehicle: Dict[str, Set["ClientConnection"]] = {}
+        self.vehicle_only: Set["ClientConnection"] = set()
+
+    def add(self, connection: "ClientConnection"):
+        if connection.event_types is None and connection.vehicle_ids is None:
+            self.everything.add(connection)
+            return
+        if connection.event_types is not None:
+            for event_type in connection.event_types:
+                self.by_type.setdefault(event_type, set()).add(connection)
+        else:
+            self.vehicle_only.add(connection)
+            for vehicle_id in connection.vehicle_ids:
+                self.by_vehicle.setdefault(vehicle_id, set()).add(connection)
+
+    def remove(self, connection: "ClientConnection"):
+        self.everything.discard(connection)
+        self.vehicle_only.discard(connection)
+        for event_type in connection.event_types or ():
+            self._discard(self.by_type, event_type, connection)
+        for vehicle_id in connection.vehicle_ids or ():
+            self._discard(self.by_vehicle, vehicle_id, connection)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set["ClientConnection"]], key: str, connection: "ClientConnection"):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(connection)
+            if not bucket:
+                del index[key]
+
+    def match(self, frame: "Frame") -> Set["ClientConnection"]:
+        targets = set(self.everything)
+        for connection in self.by_type.get(frame.event_type, ()):
+            if connection.accepts_vehicle(frame.vehicle_id):
+                targets.add(connection)
+        if frame.vehicle_id is None:
+            # Eventos sin vehículo no se restringen por vehicle_ids
+            targets |= self.vehicle_only
+        else:
+            targets |= self.by_vehicle.get(frame.vehicle_id, set())
+        return targets
+
+class ClientConnection:
+    """
+    Conexión WebSocket con cola de salida acotada drenada por su propia tarea,
+    así un cliente lento no acumula envíos en memoria ni frena a los demás
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        company_id: str,
+        on_failure: Callable[["ClientConnection"], None],
+        user_id: Optional[str] = None,
+        encoding: str = "json",
+        max_queue: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT_SECONDS
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.company_id = company_id
+        self.user_id = user_id
+        self.encoding = encoding
+        self.last_seen = time.monotonic()
+        # Filtros de suscripción (None = todos)
+        self.event_types: Optional[Set[str]] = None
+        self.vehicle_ids: Optional[Set[str]] = None
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self._on_failure = on_failure
+        self._queue: Deque[Tuple[float, Frame]] = deque()
+        self._ready = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # Métricas de lag por conexión
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.max_depth = 0
+
+    def accepts_vehicle(self, vehicle_id: Optional[str]) -> bool:
+        return self.vehicle_ids is None or vehicle_id is None or vehicle_id in self.vehicle_ids
+
+    def accepts_event(self, event_type: Optional[str], vehicle_id: Optional[str]) -> bool:
+        if self.event_types is not None and event_type not in self.event_types:
+            return False
+        return self.accepts_vehicle(vehicle_id)
+
+    @property
+    def filter_key(self) -> tuple:
+        return frozenset(self.event_types or ()), frozenset(self.vehicle_ids or ())
+
+    def touch(self):
+        """Un mensaje del cliente o un envío completado demuestra que el socket sigue vivo"""
+        self.last_seen = time.monotonic()
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_seen
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: Frame) -> bool:
+        """Encola sin bloquear; devuelve False si la conexión debe cerrarse"""
+        if self.closed:
+            return False
+
+        if len(self._queue) >= self.max_queue:
+            if self.overflow_policy == "disconnect":
+                return False
+            if self.overflow_policy == "coalesce" and self._coalesce(frame):
+                return True
+            self._queue.popleft()
+            self.dropped += 1
+
+        self._queue.append((time.monotonic(), frame))
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._ready.set()
+        return True
+
+    def _coalesce(self, frame: Frame) -> bool:
+        key = coalesce_key(frame.message)
+        if key is None:
+            return False
+        for index, (enqueued_at, queued) in enumerate(self._queue):
+            if coalesce_key(queued.message) == key:
+                # Conserva la posición (y el lag) del original con el estado más reciente
+                self._queue[index] = (enqueued_at, frame)
+                self.coalesced += 1
+                return True
+        return False
+
+    async def _writer(self):
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
 
-    async def connect(self, websocket: WebSocket, company_id: str):
-        await websocket.accept()
-        if company_id not in self.active_connections:
-            self.active_connections[company_id] = []
-        self.active_connections[company_id].append(websocket)
+            enqueued_at, frame = self._queue.popleft()
+            try:
+                await asyncio.wait_for(self._send_frame(frame), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ WebSocket send failed ({type(e).__name__}), dropping connection")
+                self._on_failure(self)
+                return
 
-    def disconnect(self, websocket: WebSocket, company_id: str):
-        if company_id in self.active_connections:
-            self.active_connections[company_id].remove(websocket)
-            if not self.active_connections[company_id]:
-                del self.active_connections[company_id]
+            # Un cliente que solo escucha no responde al ping: el envío basta
+            self.touch()
+            self.sent += 1
+            self.last_lag_ms = (time.monotonic() - enqueued_at) * 1000
+            self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+
+    def _send_frame(self, frame: Frame):
+        if self.encoding == "msgpack":
+            return self.websocket.send_bytes(frame.binary)
+        return self.websocket.send_text(frame.text)
+
+    async def close(self):
+        self.closed = True
+        self._queue.clear()
+        if self._writer_task and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "idle_seconds": round(self.idle_seconds, 1),
+            "queued": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1)
+        }
+
+class StreamConnection(ClientConnection):
+    """
+    Cliente Server-Sent Events: misma cola, filtros y métricas que un WebSocket,
+    pero la drena la respuesta HTTP en streaming en lugar de una tarea writer
+    """
+    def __init__(self, company_id: str, on_failure: Callable[["ClientConnection"], None], **kwargs):
+        super().__init__(None, company_id, on_failure, **kwargs)
+
+    def start(self):
+        pass
+
+    async def events(self):
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            enqueued_at, frame = self._queue.popleft()
+            yield frame.sse
+            # El cliente no envía mensajes: cada escritura cuenta como actividad
+            self.touch()
+            self.sent += 1
+            self.last_lag_ms = (time.monotonic() - enqueued_at) * 1000
+            self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+
+    async def close(self):
+        self.closed = True
+        self._queue.clear()
+        self._ready.set()
+
+class ConnectionManager:
+    """
+    Manager ÚNICO de conexiones WebSocket (usado por main.py y todos los routers).
+    Los broadcasts pasan por el pub/sub para llegar también a los otros workers.
+    """
+    def __init__(
+        self,
+        send_timeout: float = WS_SEND_TIMEOUT_SECONDS,
+        pubsub: Optional[PubSubBackend] = None,
+        max_queue: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        max_per_company: int = WS_MAX_CONNECTIONS_PER_COMPANY,
+        max_per_user: int = WS_MAX_CONNECTIONS_PER_USER
+    ):
+        # company_id -> {connection_id: conexión}: altas y bajas en O(1)
+        self.active_connections: Dict[str, Dict[str, ClientConnection]] = {}
+        self.send_timeout = send_timeout
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.max_per_company = max_per_company
+        self.max_per_user = max_per_user
+        self.user_connections: Dict[str, int] = {}
+        self.rejected = 0
+        self.pubsub = pubsub or create_pubsub()
+        self.event_logs: Dict[str, EventLog] = {}
+        self.subscriptions: Dict[str, SubscriptionIndex] = {}
+        self.batcher = EventBatcher(self._publish)
+        self.evicted = 0
+        self.reaped = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._release_tasks: Dict[str, asyncio.Task] = {}
+        # Servicios que reaccionan a eventos: callback(company_id, message, local)
+        self._listeners: List[Callable[[str, dict, bool], None]] = []
+        # Referencias a las tareas en curso para que no las recolecte el GC
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Empresas con cachés en memoria en este worker (ver watch_company)
+        self._watched: Dict[str, Future] = {}
+        self._watch_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.pubsub.start(self._on_channel_message)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        logger.info(f"📡 WebSocket pub/sub backend: {self.pubsub.name}")
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        for task in self._release_tasks.values():
+            task.cancel()
+        await self.batcher.flush_all()
+        await self.pubsub.stop()
+
+    def check_limits(self, company_id: str, user_id: Optional[str]):
+        if len(self.active_connections.get(company_id, {})) >= self.max_per_company:
+            self.rejected += 1
+            raise ConnectionLimitExceeded("Too many connections for this company")
+        if user_id and self.user_connections.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            raise ConnectionLimitExceeded("Too many connections for this user")
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        company_id: str,
+        since: Optional[int] = None,
+        user_id: Optional[str] = None
+    ) -> ClientConnection:
+        """
+        Registra el socket; con `since` reenvía los eventos perdidos desde ese seq
+        o un RESYNC_REQUIRED si el hueco ya no está en el log.
+        Lanza ConnectionLimitExceeded (antes del accept) si se supera algún límite.
+        """
+        self._reserve(company_id, user_id)
+        encoding, subprotocol = negotiate_encoding(websocket)
+        try:
+            await websocket.accept(subprotocol=subprotocol)
+        except Exception:
+            self._release_user_slot(user_id)
+            raise
+        connection = ClientConnection(
+            websocket,
+            company_id,
+            on_failure=self._evict,
+            user_id=user_id,
+            encoding=encoding,
+            max_queue=self.max_queue,
+            overflow_policy=self.overflow_policy,
+            send_timeout=self.send_timeout
+        )
+        # Filtros iniciales opcionales: ?types=A,B&vehicle_ids=x,y
+        connection.event_types = parse_filter(websocket.query_params.get("types"))
+        connection.vehicle_ids = parse_filter(websocket.query_params.get("vehicle_ids"))
+        await self._register(connection, since)
+        return connection
+
+    async def connect_stream(
+        self,
+        company_id: str,
+        since: Optional[int] = None,
+        user_id: Optional[str] = None,
+        event_types=None,
+        vehicle_ids=None
+    ) -> StreamConnection:
+        """Registra un cliente SSE con la misma semántica de replay y filtros"""
+        self._reserve(company_id, user_id)
+        connection = StreamConnection(
+            company_id,
+            on_failure=self._evict,
+            user_id=user_id,
+            max_queue=self.max_queue,
+            overflow_policy=self.overflow_policy,
+            send_timeout=self.send_timeout
+        )
+        connection.event_types = parse_filter(event_types)
+        connection.vehicle_ids = parse_filter(vehicle_ids)
+        await self._register(connection, since)
+        return connection
+
+    def _reserve(self, company_id: str, user_id: Optional[str]):
+        self.check_limits(company_id, user_id)
+        if user_id:
+            # Se reserva antes de los awaits para que dos handshakes simultáneos no superen el límite
+            self.user_connections[user_id] = self.user_connections.get(user_id, 0) + 1
+
+    async def _register(self, connection: ClientConnection, since: Optional[int]):
+        company_id = connection.company_id
+        release = self._release_tasks.pop(company_id, None)
+        if release:
+            release.cancel()
+        if company_id not in self.event_logs:
+            self.event_logs[company_id] = EventLog()
+            await self.pubsub.subscribe(company_channel(company_id))
+
+        # Sin awaits desde aquí: el replay queda en la cola antes que cualquier evento nuevo
+        log = self.event_logs[company_id]
+        if since is None:
+            connection.enqueue(Frame({"type": "CONNECTED", "seq": log.last_seq}))
+        else:
+            missed = log.since(since)
+            if missed is None or len(missed) >= connection.max_queue:
+                connection.enqueue(Frame({"type": "RESYNC_REQUIRED", "seq": log.last_seq}))
+            else:
+                for frame in missed:
+                    view = frame.view_for(connection)
+                    if view is not None:
+                        connection.enqueue(view)
+
+        self.active_connections.setdefault(company_id, {})[connection.id] = connection
+        self.subscriptions.setdefault(company_id, SubscriptionIndex()).add(connection)
+        connection.start()
+
+    def disconnect(self, connection: ClientConnection):
+        """Baja idempotente de una conexión"""
+        self._remove(connection)
+        if not connection.closed:
+            self._spawn(connection.close())
+
+    def _remove(self, connection: ClientConnection):
+        connections = self.active_connections.get(connection.company_id)
+        if connections and connections.pop(connection.id, None) is not None:
+            self._release_user_slot(connection.user_id)
+            self.subscriptions[connection.company_id].remove(connection)
+            if not connections:
+                del self.active_connections[connection.company_id]
+                del self.subscriptions[connection.company_id]
+                self._schedule_release(connection.company_id)
+
+    def _release_user_slot(self, user_id: Optional[str]):
+        if not user_id:
+            return
+        remaining = self.user_connections.get(user_id, 0) - 1
+        if remaining > 0:
+            self.user_connections[user_id] = remaining
+        else:
+            self.user_connections.pop(user_id, None)
+
+    def _schedule_release(self, company_id: str):
+        """Conserva log y suscripción un tiempo para que los clientes puedan reanudar"""
+        async def release():
+            await asyncio.sleep(WS_EVENT_LOG_GRACE_SECONDS)
+            self._release_tasks.pop(company_id, None)
+            if company_id not in self.active_connections:
+                self.event_logs.pop(company_id, None)
+                if company_id not in self._watched:
+                    await self.pubsub.unsubscribe(company_channel(company_id))
+
+        task = asyncio.create_task(release())
+        self._release_tasks[company_id] = task
+
+    async def _heartbeat(self):
+        """
+        Cada intervalo envía un ping a las conexiones sin actividad y cierra las que
+        superan el idle timeout. El ping no exige respuesta: un envío completado
+        cuenta como actividad, así que solo se cierran las conexiones cuyo writer
+        no consigue escribir. Los sockets medio abiertos (el kernel acepta el envío
+        pero el cliente ya no está) los cierra el ping/pong del protocolo WebSocket
+        que hace uvicorn
+        """
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL_SECONDS)
+            ping = Frame({"type": "ping", "timestamp": datetime.now().isoformat()})
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections.values()):
+                    if connection.idle_seconds > WS_IDLE_TIMEOUT_SECONDS:
+                        self.reaped += 1
+                        self.disconnect(connection)
+                    elif connection.idle_seconds >= WS_HEARTBEAT_INTERVAL_SECONDS:
+                        if not connection.enqueue(ping):
+                            self._evict(connection)
+
+    def _evict(self, connection: ClientConnection):
+        """Saca de la empresa un consumidor lento o caído y cierra su socket"""
+        self.evicted += 1
+        self._remove(connection)
+        self._spawn(connection.close())
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        await websocket.send_text(message)
+
+    def send_to_connection(self, connection: ClientConnection, message: dict):
+        """Respuesta a un solo cliente por su cola (respeta su codificación y el orden)"""
+        if not connection.enqueue(Frame(message)):
+            self._evict(connection)
+
+    def update_subscription(self, connection: ClientConnection, event_types=None, vehicle_ids=None):
+        """Reemplaza los filtros de la conexión (listas vacías o None = todos)"""
+        index = self.subscriptions.get(connection.company_id)
+        if index is None or connection.closed:
+            return
+        index.remove(connection)
+        connection.event_types = parse_filter(event_types)
+        connection.vehicle_ids = parse_filter(vehicle_ids)
+        index.add(connection)
+        self.send_to_connection(connection, {
+            "type": "SUBSCRIBED",
+            "event_types": sorted(connection.event_types) if connection.event_types else None,
+            "vehicle_ids": sorted(connection.vehicle_ids) if connection.vehicle_ids else None
+        })
 
     async def broadcast_to_company(self, message: dict, company_id: str):
-        if company_id in self.active_connections:
-            disconnected = []
-            for connection in self.active_connections[company_id]:
-                try:
-                    await connection.send_json(message)
-                except:
-                    disconnected.append(connection)
-            
-            for connection in disconnected:
-                self.disconnect(connection, company_id)
-
-manager = ConnectionManager()
\ No newline at end of file
+        """
+        Agrega el evento a la ventana de batching de la empresa y retorna
+        inmediatamente; la publicación y el envío corren en segundo plano
+        """
+        self._notify(company_id, message, local=True)
+        await self.batcher.add(company_id, message)
+
+    def watch_company(self, company_id: str, timeout: float = WS_WATCH_TIMEOUT_SECONDS) -> bool:
+        """
+        Suscribe este worker al canal de la empresa aunque no tenga sockets
+        abiertos, para que los listeners con cachés en memoria (índice de
+        mantenimientos, planner, TCO) reciban los cambios hechos en otros workers.
+        Síncrono y thread-safe: llamarlo antes de cargar desde la BD; desde un
+        thread espera a que la suscripción esté activa. False si no se pudo
+        garantizar (sin loop, desde el loop o timeout)
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        with self._watch_lock:
+            future = self._watched.get(company_id)
+            if future is None:
+                future = asyncio.run_coroutine_threadsafe(self.pubsub.subscribe(company_channel(company_id)), loop)
+                self._watched[company_id] = future
+
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            # Bloquear acá trabaría el loop que corre la suscripción
+            return future.done() and future.exception() is None
+
+        try:
+            future.result(timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Could not subscribe to company {company_id} for cache invalidation: {e}")
+            with self._watch_lock:
+                if self._watched.get(company_id) is future:
+                    del self._watched[company_id]
+            return False
+
+    def add_listener(self, callback: Callable[[str, dict, bool], None]):
+        """
+        Registra un callback síncrono para cada evento: local=True al publicarlo
+        este worker, local=False al recibirlo del pub/sub (cualquier worker)
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, company_id: str, message: dict, local: bool):
+        for callback in self._listeners:
+            try:
+                callback(company_id, message, local)
+            except Exception as e:
+                logger.error(f"❌ Error in event listener for company {company_id}: {e}")
+
+    async def _publish(self, company_id: str, message: dict):
+        await self.pubsub.publish(company_channel(company_id), message)
+
+    async def _on_channel_message(self, channel: str, message: dict):
+        company_id = channel_company(channel)
+        frame = Frame(message)
+        log = self.event_logs.get(company_id)
+        if log:
+            log.append(frame)
+        self._fanout(frame, company_id)
+        self._notify(company_id, message, local=False)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _fanout(self, frame: Frame, company_id: str):
+        """Encola el mismo Frame en las conexiones suscritas; los writers envían en paralelo"""
+        index = self.subscriptions.get(company_id)
+        if index is None:
+            return
+        if frame.event_type == BATCH_EVENT_TYPE:
+            # Un batch mezcla tipos y vehículos: cada conexión recibe su recorte
+            targets = list(self.active_connections.get(company_id, {}).values())
+        else:
+            targets = index.match(frame)
+        for connection in targets:
+            view = frame.view_for(connection)
+            if view is not None and not connection.enqueue(view):
+                self._evict(connection)
+
+    def connection_counts(self) -> Dict[str, int]:
+        return {company_id: len(connections) for company_id, connections in self.active_connections.items()}
+
+    def stats(self) -> dict:
+        connections = [c for conns in self.active_connections.values() for c in conns.values()]
+        return {
+            "pubsub_backend": self.pubsub.name,
+            "worker_id": self.pubsub.worker_id,
+            "overflow_policy": self.overflow_policy,
+            "frames_sent": sum(c.sent for c in connections),
+            "frames_dropped": sum(c.dropped for c in connections),
+            "frames_coalesced": sum(c.coalesced for c in connections),
+            "queued": sum(c.depth for c in connections),
+            "max_lag_ms": round(max((c.max_lag_ms for c in connections), default=0.0), 1),
+            "evicted_connections": self.evicted,
+            "reaped_connections": self.reaped,
+            "rejected_connections": self.rejected,
+            "watched_companies": len(self._watched),
+            "batching": self.batcher.stats(),
+            "pubsub": self.pubsub.metrics.snapshot()
+        }
+
+    def connection_stats(self, company_id: str) -> List[dict]:
+        return [c.stats() for c in self.active_connections.get(company_id, {}).values()]
+
+manager = ConnectionManager()
@@ -2,7 +2,7 @@
 import os
 import requests
 from dotenv import load_dotenv
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Iterator, Optional, List
 import logging
 
 # Configurar logging
@@ -11,6 +11,11 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Filas por página al leer tablas completas. No debe superar el max-rows de
+# PostgREST (1000 por defecto en Supabase): una página recortada por el servidor
+# se confundiría con la última
+DB_PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", "1000"))
+
 class SupabaseClient:
     """
     Cliente profesional para Supabase con soporte JWT para RLS
@@ -95,15 +100,68 @@ class TableQuery:
         self.params[column] = f"eq.{value}"
         return self
     
+    def _add_filter(self, column: str, expression: str) -> 'TableQuery':
+        # Varios filtros sobre la misma columna viajan como parámetros repetidos
+        existing = self.params.get(column)
+        if existing is None:
+            self.params[column] = expression
+        elif isinstance(existing, list):
+            existing.append(expression)
+        else:
+            self.params[column] = [existing, expression]
+        return self
+    
+    def gte(self, column: str, value: Any) -> 'TableQuery':
+        return self._add_filter(column, f"gte.{value}")
+    
+    def gt(self, column: str, value: Any) -> 'TableQuery':
+        return self._add_filter(column, f"gt.{value}")
+    
+    def lte(self, column: str, value: Any) -> 'TableQuery':
+        return self._add_filter(column, f"lte.{value}")
+    
+    def lt(self, column: str, value: Any) -> 'TableQuery':
+        return self._add_filter(column, f"lt.{value}")
+    
+    def in_(self, column: str, values: List[Any]) -> 'TableQuery':
+        # Entre comillas para admitir comas o espacios en los valores
+        quoted = ",".join('"' + str(value).replace('"', '\\"') + '"' for value in values)
+        self.params[column] = f"in.({quoted})"
+        return self
+    
+    def is_(self, column: str, value: Any) -> 'TableQuery':
+        """Filtro IS (p. ej. is_("vehicle_id", "null"))"""
+        self.params[column] = f"is.{value}"
+        return self
+    
+    def order(self, column: str, desc: bool = False) -> 'TableQuery':
+        # Llamadas sucesivas ordenan por varias columnas (order=a.asc,b.asc)
+        expression = f"{column}.{'desc' if desc else 'asc'}"
+        existing = self.params.get("order")
+        self.params["order"] = f"{existing},{expression}" if existing else expression
+        return self
+    
     def limit(self, n: int) -> 'TableQuery':
         self.params["limit"] = str(n)
         return self
     
+    def range(self, start: int, end: int) -> 'TableQuery':
+        """Filas start..end inclusive (misma semántica que supabase-py)"""
+        self.params["offset"] = str(start)
+        self.params["limit"] = str(end - start + 1)
+        return self
+    
     def insert(self, data: Dict[str, Any]) -> 'TableQuery':
         self.method = "INSERT"
         self.data_to_send = data
         return self
     
+    def upsert(self, data: Any) -> 'TableQuery':
+        """INSERT que actualiza la fila si ya existe la clave primaria"""
+        self.method = "UPSERT"
+        self.data_to_send = data
+        return self
+    
     def update(self, data: Dict[str, Any]) -> 'TableQuery':
         self.method = "UPDATE"
         self.data_to_send = data
@@ -131,6 +189,10 @@ class TableQuery:
                 headers["Prefer"] = "return=representation"
                 response = requests.post(url, headers=headers, json=self.data_to_send, params=self.params, timeout=10)
                 
+            elif self.method == "UPSERT":
+                headers["Prefer"] = "resolution=merge-duplicates,return=representation"
+                response = requests.post(url, headers=headers, json=self.data_to_send, params=self.params, timeout=10)
+                
             elif self.method == "UPDATE":
                 headers["Prefer"] = "return=representation"
                 response = requests.patch(url, headers=headers, json=self.data_to_send, params=self.params, timeout=10)
@@ -208,6 +270,23 @@ def get_authenticated_db(token: str):
     
     return AuthenticatedDB(token)
 
+def fetch_all(build_query: Callable[[], 'TableQuery'], page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Todas las filas de una consulta, página a página con .range().
+    build_query arma la consulta (con un orden estable) para cada página
+    """
+    page_size = page_size or DB_PAGE_SIZE
+    offset = 0
+    while True:
+        result = build_query().range(offset, offset + page_size - 1).execute()
+        if result.error:
+            raise Exception(result.error)
+        page = result.data or []
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
 def health_check() -> bool:
     return supabase.health_check()
 
@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+
+class MaintenancePlanBase(BaseModel):
+    maintenance_type: str
+    model: Optional[str] = None  # None = aplica a todos los modelos
+    interval_miles: Optional[float] = None  # Cada N millas
+    interval_days: Optional[int] = None  # Cada M días (vence lo que llegue primero)
+    description: Optional[str] = None
+
+class MaintenancePlanCreate(MaintenancePlanBase):
+    pass
+
+class MaintenancePlanUpdate(BaseModel):
+    maintenance_type: Optional[str] = None
+    model: Optional[str] = None
+    interval_miles: Optional[float] = None
+    interval_days: Optional[int] = None
+    description: Optional[str] = None
+
+class MaintenancePlan(MaintenancePlanBase):
+    id: str
+    company_id: str
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
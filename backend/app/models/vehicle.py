@@ -9,6 +9,7 @@ class VehicleBase(BaseModel):
     total_miles: float
     status: str
     company_id: str  # ← NUEVO: Para filtrado por compañía
+    tank_capacity: Optional[float] = None  # Litros; habilita el chequeo de sobrecarga
 
 class VehicleCreate(VehicleBase):
     total_miles: float = 0
@@ -20,6 +21,7 @@ class VehicleUpdate(BaseModel):
     model: Optional[str] = None
     total_miles: Optional[float] = None
     status: Optional[str] = None
+    tank_capacity: Optional[float] = None
     # company_id no se puede actualizar
 
 class Vehicle(VehicleBase):
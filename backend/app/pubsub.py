@@ -0,0 +1,360 @@
+# app/pubsub.py
+"""
+Transporte pub/sub para que los broadcasts WebSocket lleguen a TODOS los workers.
+
+Con `uvicorn --workers N` cada proceso tiene sus propias conexiones; cada evento
+se publica en el canal de su empresa (`company:<id>`) y cada worker lo entrega a
+sus sockets locales.
+
+Backends (WS_PUBSUB_BACKEND):
+- memory: un solo proceso, sin transporte
+- unix:   broker local sobre Unix socket (por defecto en Linux/macOS)
+- redis:  adapter Redis PUBLISH/SUBSCRIBE (requiere el paquete `redis`)
+
+Cada evento recibe un `seq` creciente por canal asignado en un único punto
+(contador local, el broker Unix o INCR en Redis), así los números son
+comparables entre workers y los clientes pueden reanudar con `?since=<seq>`.
+
+Un adapter nuevo (p. ej. Postgres LISTEN/NOTIFY) implementa
+`_transport_publish` (asignando el seq y entregando también localmente),
+`_transport_subscribe` y `_transport_unsubscribe`, y llama a `_on_remote`
+con cada mensaje recibido.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, dict], Awaitable[None]]
+
+PUBSUB_BACKEND = os.getenv("WS_PUBSUB_BACKEND", "unix" if hasattr(socket, "AF_UNIX") else "memory")
+PUBSUB_SOCKET_PATH = os.getenv(
+    "WS_PUBSUB_SOCKET",
+    os.path.join(tempfile.gettempdir(), "road-service-pubsub.sock")
+)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Tamaño máximo de un frame entre workers (los eventos incluyen el registro completo)
+MAX_FRAME_BYTES = 4 * 1024 * 1024
+
+def company_channel(company_id: str) -> str:
+    return f"company:{company_id}"
+
+def channel_company(channel: str) -> str:
+    return channel.split(":", 1)[1]
+
+class PubSubMetrics:
+    """Contadores de entrega por worker y por canal"""
+    def __init__(self):
+        self.published = 0
+        self.received = 0
+        self.transport_errors = 0
+        self.per_channel: Dict[str, Dict[str, int]] = defaultdict(lambda: {"published": 0, "received": 0})
+
+    def record_published(self, channel: str):
+        self.published += 1
+        self.per_channel[channel]["published"] += 1
+
+    def record_received(self, channel: str):
+        self.received += 1
+        self.per_channel[channel]["received"] += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "published": self.published,
+            "received_from_other_workers": self.received,
+            "transport_errors": self.transport_errors,
+            "channels": {channel: dict(counts) for channel, counts in self.per_channel.items()}
+        }
+
+class PubSubBackend:
+    """
+    Backend en memoria (un solo worker) y clase base de los adapters
+    """
+    name = "memory"
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.metrics = PubSubMetrics()
+        self._handler: Optional[MessageHandler] = None
+        self._channels: Set[str] = set()
+        self._last_seq: Dict[str, int] = {}
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+
+    async def stop(self):
+        self._handler = None
+
+    async def publish(self, channel: str, payload: dict):
+        """Asigna el seq y entrega el evento a todos los workers (incluido este)"""
+        self.metrics.record_published(channel)
+        try:
+            await self._transport_publish(channel, payload)
+        except Exception as e:
+            self.metrics.transport_errors += 1
+            logger.error(f"❌ Pub/sub publish failed on {channel}: {e}")
+            # Sin transporte el evento llega al menos a los sockets locales (sin seq)
+            await self._dispatch(channel, payload)
+
+    async def subscribe(self, channel: str):
+        if channel in self._channels:
+            return
+        self._channels.add(channel)
+        await self._transport_subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        if channel not in self._channels:
+            return
+        self._channels.discard(channel)
+        await self._transport_unsubscribe(channel)
+
+    def encode(self, channel: str, payload: dict) -> bytes:
+        frame = {"op": "publish", "channel": channel, "origin": self.worker_id, "payload": payload}
+        return json.dumps(frame, default=str).encode() + b"\n"
+
+    def last_seq(self, channel: str) -> int:
+        return self._last_seq.get(channel, 0)
+
+    async def _dispatch(self, channel: str, payload: dict):
+        seq = payload.get("seq")
+        if seq is not None and seq > self.last_seq(channel):
+            self._last_seq[channel] = seq
+        if self._handler:
+            await self._handler(channel, payload)
+
+    async def _on_remote(self, channel: str, payload: dict):
+        self.metrics.record_received(channel)
+        if channel in self._channels:
+            await self._dispatch(channel, payload)
+
+    async def _transport_publish(self, channel: str, payload: dict):
+        # Un solo proceso: el contador local es la fuente del seq
+        await self._dispatch(channel, {**payload, "seq": self.last_seq(channel) + 1})
+
+    async def _transport_subscribe(self, channel: str):
+        pass
+
+    async def _transport_unsubscribe(self, channel: str):
+        pass
+
+class UnixSocketPubSub(PubSubBackend):
+    """
+    Broker local sobre Unix socket. El worker que obtiene el lock del archivo
+    `<socket>.lock` levanta el broker; todos (incluido él) se conectan como
+    clientes. Si el broker muere, el lock se libera y otro worker lo reemplaza.
+    """
+    name = "unix"
+
+    def __init__(self, path: str = PUBSUB_SOCKET_PATH, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._broker_clients: Dict[asyncio.StreamWriter, Set[str]] = {}
+        self._broker_seq: Dict[str, int] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._client_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        self._closing = False
+        self._client_task = asyncio.create_task(self._run_client())
+
+    async def stop(self):
+        self._closing = True
+        if self._client_task:
+            self._client_task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for writer in list(self._broker_clients):
+                writer.close()
+            self._server = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+        await super().stop()
+
+    # --- Broker -------------------------------------------------------------
+
+    async def _ensure_broker(self):
+        """Intenta convertirse en broker; no hace nada si otro worker ya lo es"""
+        if self._server:
+            return
+        import fcntl
+
+        lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return
+
+        # Tenemos el lock: cualquier socket existente es de un broker muerto
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._serve_worker, path=self.path, limit=MAX_FRAME_BYTES
+        )
+        self._lock_file = lock_file
+        logger.info(f"📡 Pub/sub broker listening on {self.path}")
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._broker_clients[writer] = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                op = frame.get("op")
+                if op == "subscribe":
+                    channel = frame["channel"]
+                    self._broker_clients[writer].add(channel)
+                    # Tras un failover el nuevo broker continúa desde el último seq conocido
+                    self._broker_seq[channel] = max(self._broker_seq.get(channel, 0), frame.get("last_seq", 0))
+                elif op == "unsubscribe":
+                    self._broker_clients[writer].discard(frame["channel"])
+                elif op == "publish":
+                    await self._relay(frame)
+        except Exception as e:
+            logger.warning(f"⚠️ Pub/sub broker dropped a worker: {e}")
+        finally:
+            self._broker_clients.pop(writer, None)
+            writer.close()
+
+    async def _relay(self, frame: dict):
+        """Asigna el seq del canal y reenvía a todos los workers suscritos (incluido el origen)"""
+        channel = frame["channel"]
+        seq = self._broker_seq.get(channel, 0) + 1
+        self._broker_seq[channel] = seq
+        frame["payload"]["seq"] = seq
+        line = json.dumps(frame, default=str).encode() + b"\n"
+
+        targets = [
+            writer for writer, channels in self._broker_clients.items()
+            if channel in channels
+        ]
+        for writer in targets:
+            writer.write(line)
+        await asyncio.gather(*(writer.drain() for writer in targets), return_exceptions=True)
+
+    # --- Cliente ------------------------------------------------------------
+
+    async def _run_client(self):
+        while not self._closing:
+            try:
+                await self._ensure_broker()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_BYTES)
+                self._writer = writer
+                for channel in self._channels:
+                    self._write({"op": "subscribe", "channel": channel, "last_seq": self.last_seq(channel)})
+
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    frame = json.loads(line)
+                    if frame.get("op") != "publish":
+                        continue
+                    if frame.get("origin") == self.worker_id:
+                        await self._dispatch(frame["channel"], frame["payload"])
+                    else:
+                        await self._on_remote(frame["channel"], frame["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics.transport_errors += 1
+                logger.warning(f"⚠️ Pub/sub connection lost ({e}), reconnecting")
+            finally:
+                self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _write(self, frame: dict):
+        if self._writer:
+            self._writer.write(json.dumps(frame).encode() + b"\n")
+
+    async def _transport_publish(self, channel: str, payload: dict):
+        if not self._writer:
+            raise ConnectionError("broker not connected")
+        self._writer.write(self.encode(channel, payload))
+
+    async def _transport_subscribe(self, channel: str):
+        self._write({"op": "subscribe", "channel": channel, "last_seq": self.last_seq(channel)})
+
+    async def _transport_unsubscribe(self, channel: str):
+        self._write({"op": "unsubscribe", "channel": channel})
+
+class RedisPubSub(PubSubBackend):
+    """Adapter Redis PUBLISH/SUBSCRIBE para despliegues con varios hosts"""
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL):
+        super().__init__()
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("WS_PUBSUB_BACKEND=redis requires the 'redis' package")
+        self._redis = aioredis.from_url(url)
+        self._pubsub = self._redis.pubsub()
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+        await self._pubsub.close()
+        await self._redis.close()
+        await super().stop()
+
+    async def _listen(self):
+        while True:
+            if not self._channels:
+                await asyncio.sleep(1)
+                continue
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                frame = json.loads(message["data"])
+                if frame.get("origin") != self.worker_id:
+                    await self._on_remote(frame["channel"], frame["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics.transport_errors += 1
+                logger.warning(f"⚠️ Redis pub/sub error: {e}")
+                await asyncio.sleep(1)
+
+    async def _transport_publish(self, channel: str, payload: dict):
+        seq = await self._redis.incr(f"seq:{channel}")
+        stamped = {**payload, "seq": seq}
+        await self._redis.publish(channel, self.encode(channel, stamped))
+        await self._dispatch(channel, stamped)
+
+    async def _transport_subscribe(self, channel: str):
+        await self._pubsub.subscribe(channel)
+
+    async def _transport_unsubscribe(self, channel: str):
+        await self._pubsub.unsubscribe(channel)
+
+def create_pubsub(backend: str = PUBSUB_BACKEND) -> PubSubBackend:
+    if backend == "unix":
+        return UnixSocketPubSub()
+    if backend == "redis":
+        return RedisPubSub()
+    return PubSubBackend()
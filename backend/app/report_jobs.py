@@ -0,0 +1,597 @@
+# app/report_jobs.py
+"""
+Cola de jobs en proceso para los reportes pesados (app/reports.py): el admin
+encola el reporte, recibe un job_id y consulta el estado o espera el evento
+REPORT_JOB_COMPLETED por WebSocket, en lugar de bloquear el request.
+
+- Pool acotado: REPORT_JOB_WORKERS tareas consumen la cola y corren cada
+  reporte en un thread (el cliente de BD es síncrono).
+- Por empresa: como mucho REPORT_JOB_MAX_RUNNING_PER_COMPANY jobs admitidos
+  en el pool a la vez; el resto espera en su propia fila, así una empresa
+  grande no acapara los workers. Más de REPORT_JOB_MAX_PENDING_PER_COMPANY
+  jobs sin terminar se rechazan (JobQueueFull). Con store ambos límites
+  valen para todos los workers juntos: se cuentan en el store con el lock
+  tomado, y un job que encuentra el cupo lleno en otro worker vuelve a la
+  cola cada REPORT_JOB_BUSY_RETRY_SECONDS.
+- El mismo reporte con los mismos parámetros reutiliza el job en curso o su
+  resultado mientras no expire (REPORT_JOB_RESULT_TTL_SECONDS).
+- Cada job se guarda en REPORT_JOB_STORE_DIR al encolarlo y en cada cambio
+  de estado, y ese archivo es la fuente de verdad: con varios workers de
+  uvicorn (start.sh usa --workers 2) cualquiera responde get/list/cancel de
+  un job encolado en otro, la deduplicación se hace contra el store y las
+  transiciones se serializan con un lock de archivo. El worker que encoló el
+  job es el que lo corre; si otro lo cancela, lo ve en el store antes de
+  empezar y al terminar. Todos los workers deben compartir el directorio
+  (mismo host o volumen compartido). Sin store (store_dir=None) la cola es
+  válida solo con un worker.
+- El store tiene un directorio por empresa; cada job es un archivo de
+  metadatos (<id>.json) y, al terminar, uno con el resultado (<id>.result),
+  así listar o consultar el estado no carga resultados.
+- submit/get/list/cancel hacen I/O de archivos y esperan el lock del store:
+  son síncronos y thread-safe, y desde async se llaman con asyncio.to_thread.
+- Un job en cola o corriendo cuyo worker ya no existe (reinicio) se marca
+  como fallido al arrancar; hay que volver a encolarlo.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from .manager import manager
+from .reports import REPORTS
+
+logger = logging.getLogger(__name__)
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "4"))
+
+REPORT_JOB_MAX_RUNNING_PER_COMPANY = int(os.getenv("REPORT_JOB_MAX_RUNNING_PER_COMPANY", "1"))
+
+REPORT_JOB_MAX_PENDING_PER_COMPANY = int(os.getenv("REPORT_JOB_MAX_PENDING_PER_COMPANY", "10"))
+
+# Cada cuánto reintenta un job cuya empresa ya corre el máximo en otro worker
+REPORT_JOB_BUSY_RETRY_SECONDS = float(os.getenv("REPORT_JOB_BUSY_RETRY_SECONDS", "2"))
+
+# Cuánto se conserva un job terminado (resultado incluido)
+REPORT_JOB_RESULT_TTL_SECONDS = float(os.getenv("REPORT_JOB_RESULT_TTL_SECONDS", "900"))
+
+REPORT_JOB_STORE_DIR = os.getenv(
+    "REPORT_JOB_STORE_DIR",
+    os.path.join(tempfile.gettempdir(), "road-service-report-jobs")
+)
+
+REPORT_JOB_EVENT_TYPE = "REPORT_JOB_COMPLETED"
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+# Estados que sirven para deduplicar: el job en curso o su resultado
+REUSABLE_STATUSES = (QUEUED, RUNNING, DONE)
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+class JobQueueFull(Exception):
+    """La empresa ya tiene el máximo de jobs sin terminar"""
+    pass
+
+class ReportJob:
+    __slots__ = (
+        "id", "company_id", "user_id", "report", "params", "status",
+        "created_at", "started_at", "finished_at", "expires_at", "result", "error", "owner"
+    )
+
+    def __init__(self, company_id: str, user_id: Optional[str], report: str, params: dict):
+        self.id = str(uuid.uuid4())
+        self.company_id = company_id
+        self.user_id = user_id
+        self.report = report
+        self.params = params
+        self.status = QUEUED
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        # Epoch (no monotonic): se persiste y lo leen otros procesos
+        self.expires_at = None
+        self.result = None
+        self.error = None
+        # PID del worker que lo corre
+        self.owner = os.getpid()
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return (self.company_id, self.report, json.dumps(self.params, sort_keys=True))
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+    def finish(self, status: str):
+        self.status = status
+        self.finished_at = datetime.now().isoformat()
+        self.expires_at = time.time() + REPORT_JOB_RESULT_TTL_SECONDS
+
+    def to_dict(self, include_result: bool = False) -> dict:
+        data = {field: getattr(self, field) for field in self.__slots__ if field != "result"}
+        if include_result:
+            data["result"] = self.result
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReportJob":
+        job = cls.__new__(cls)
+        for field in cls.__slots__:
+            setattr(job, field, data.get(field))
+        return job
+
+def _company_dir(store_dir: str, company_id: str) -> str:
+    # company_id viene del token; el hash da un nombre de directorio seguro
+    return os.path.join(store_dir, hashlib.sha1(str(company_id).encode()).hexdigest())
+
+def _job_path(store_dir: str, company_id: str, job_id: str, suffix: str = ".json") -> Optional[str]:
+    # El id viene de la URL: solo UUIDs, nada de rutas arbitrarias
+    try:
+        return os.path.join(_company_dir(store_dir, company_id), f"{uuid.UUID(job_id)}{suffix}")
+    except ValueError:
+        return None
+
+def _key_path(store_dir: str, key: Tuple[str, str, str]) -> str:
+    """Archivo (empresa, reporte, parámetros) -> job_id vigente, para deduplicar entre workers"""
+    digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+    return os.path.join(_company_dir(store_dir, key[0]), f"key-{digest}")
+
+RESULT_SUFFIX = ".result"
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Existe pero es de otro usuario
+        return True
+    return True
+
+class ReportJobQueue:
+    def __init__(
+        self,
+        workers: int = REPORT_JOB_WORKERS,
+        max_running_per_company: int = REPORT_JOB_MAX_RUNNING_PER_COMPANY,
+        max_pending_per_company: int = REPORT_JOB_MAX_PENDING_PER_COMPANY,
+        store_dir: Optional[str] = REPORT_JOB_STORE_DIR
+    ):
+        self.workers = workers
+        self.max_running_per_company = max_running_per_company
+        self.max_pending_per_company = max_pending_per_company
+        self.store_dir = store_dir
+        self.manager = None
+        self._jobs: Dict[str, ReportJob] = {}
+        # (empresa, reporte, parámetros) -> job_id vigente
+        self._keys: Dict[Tuple[str, str, str], str] = {}
+        # Jobs admitidos en el pool (en la cola o corriendo) por empresa; solo en el event loop
+        self._admitted: Dict[str, int] = {}
+        # Jobs que esperan a que la empresa libere un cupo; solo en el event loop
+        self._waiting: Dict[str, Deque[ReportJob]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        # _jobs/_keys se tocan desde threads (submit/cancel vía to_thread)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def attach(self, manager):
+        self.manager = manager
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        if self.store_dir:
+            await asyncio.to_thread(self._load)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"🧾 Report job queue started ({self.workers} workers, store: {self.store_dir or 'none'})")
+
+    async def stop(self):
+        pending = sum(1 for job in list(self._jobs.values()) if job.status in (QUEUED, RUNNING))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if pending:
+            logger.warning(f"⚠️ Report job queue stopped with {pending} unfinished jobs")
+
+    def submit(self, company_id: str, user_id: Optional[str], report: str, params: dict) -> Tuple[ReportJob, bool]:
+        """
+        Encola el reporte y retorna (job, creado). Si ya hay uno igual en curso
+        o terminado sin expirar (en cualquier worker) se retorna ese con creado=False
+        """
+        if report not in REPORTS:
+            raise KeyError(report)
+        if self._ready is None:
+            raise RuntimeError("Report job queue is not running")
+
+        job = ReportJob(company_id, user_id, report, params)
+        with self._store_lock():
+            self._purge()
+            existing = self._existing(job.key)
+            if existing:
+                return existing, False
+
+            pending = self._unfinished(company_id)
+            if pending >= self.max_pending_per_company:
+                raise JobQueueFull(f"Too many pending report jobs (max {self.max_pending_per_company})")
+
+            self._jobs[job.id] = job
+            self._keys[job.key] = job.id
+            if self.store_dir:
+                self._save(job)
+                self._save_key(job)
+        self._on_loop(self._admit, job)
+        return job, True
+
+    def get(self, job_id: str, company_id: str, include_result: bool = False) -> Optional[ReportJob]:
+        """Estado del job; con include_result también lee el archivo del resultado"""
+        job = self._current(job_id, company_id, include_result)
+        if job is None or job.company_id != company_id or job.expired:
+            return None
+        return job
+
+    def list(self, company_id: str) -> List[ReportJob]:
+        """Jobs de la empresa (de cualquier worker), solo metadatos"""
+        with self._store_lock():
+            self._purge()
+            jobs = {job.id: job for job in self._jobs.values() if job.company_id == company_id}
+            # Los del store (de cualquier worker) pisan la copia local
+            for job in self._stored(company_id):
+                jobs[job.id] = job
+        return sorted(jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str, company_id: str) -> Optional[ReportJob]:
+        """
+        Cancela un job en cola o corriendo, de este worker o de otro. Un reporte
+        que ya corre en su thread no se puede interrumpir: termina, pero su
+        resultado se descarta y sigue ocupando el cupo de la empresa hasta entonces
+        """
+        with self._store_lock():
+            job = self._current(job_id, company_id)
+            if job is None or job.company_id != company_id:
+                return None
+            if job.status in (QUEUED, RUNNING):
+                local = self._jobs.get(job_id)
+                if local is not None:
+                    self._cancel_local(local)
+                if job is not local:
+                    job.finish(CANCELLED)
+                if self.store_dir:
+                    self._save(job)
+                    self._forget_key(job)
+        return job
+
+    def _on_loop(self, callback, *args):
+        """Corre callback en el event loop de la cola (submit puede llegar desde un thread)"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _admit(self, job: ReportJob):
+        admitted = self._admitted.get(job.company_id, 0)
+        if admitted < self.max_running_per_company:
+            self._admitted[job.company_id] = admitted + 1
+            self._ready.put_nowait(job)
+        else:
+            self._waiting.setdefault(job.company_id, deque()).append(job)
+
+    def _release(self, company_id: str):
+        self._admitted[company_id] -= 1
+        if not self._admitted[company_id]:
+            del self._admitted[company_id]
+        waiting = self._waiting.get(company_id)
+        while waiting:
+            # Los cancelados siguen en la fila (cancel corre en otro thread) y se saltan aquí
+            job = waiting.popleft()
+            if job.status == QUEUED:
+                self._admit(job)
+                break
+        if not waiting:
+            self._waiting.pop(company_id, None)
+
+    async def _worker(self):
+        while True:
+            job = await self._ready.get()
+            retry = False
+            try:
+                # Cancelado mientras esperaba en la cola (aquí o en otro worker)
+                if job.status == QUEUED:
+                    started = await asyncio.to_thread(self._start, job)
+                    if started is None:
+                        # La empresa ya corre su máximo en otros workers: conserva el cupo y reintenta
+                        retry = True
+                        self._loop.call_later(REPORT_JOB_BUSY_RETRY_SECONDS, self._ready.put_nowait, job)
+                    elif started:
+                        await self._run(job)
+            except Exception as e:
+                logger.error(f"❌ Report job {job.id} crashed: {e}")
+            finally:
+                if not retry:
+                    self._release(job.company_id)
+
+    async def _run(self, job: ReportJob):
+        try:
+            result = await asyncio.to_thread(REPORTS[job.report], job.company_id, job.params)
+        except Exception as e:
+            result, error = None, str(e)
+        else:
+            error = None
+
+        if not await asyncio.to_thread(self._complete, job, result, error):
+            return
+        if error:
+            self.failed += 1
+            logger.error(f"❌ Report job {job.id} ({job.report}) failed for company {job.company_id}: {error}")
+        else:
+            self.completed += 1
+        if self.manager:
+            # Sin el resultado: el cliente lo pide a GET /jobs/{id}/result
+            await self.manager.broadcast_to_company({
+                "type": REPORT_JOB_EVENT_TYPE,
+                "data": job.to_dict(),
+                "timestamp": datetime.now().isoformat()
+            }, job.company_id)
+
+    def _start(self, job: ReportJob) -> Optional[bool]:
+        """
+        queued -> running; False si se canceló mientras esperaba, None si la
+        empresa ya corre el máximo de jobs contando todos los workers
+        """
+        with self._store_lock():
+            if self._cancelled(job):
+                return False
+            if self.store_dir and self._unfinished(job.company_id, (RUNNING,)) >= self.max_running_per_company:
+                return None
+            job.status = RUNNING
+            job.started_at = datetime.now().isoformat()
+            if self.store_dir:
+                self._save(job)
+        return True
+
+    def _complete(self, job: ReportJob, result, error: Optional[str]) -> bool:
+        """running -> done/failed; False (resultado descartado) si se canceló mientras corría"""
+        # El resultado se serializa fuera del lock: con el lock solo se decide y se renombra
+        temp_path = self._prepare_result(job, result) if self.store_dir else None
+        with self._store_lock():
+            if self._cancelled(job):
+                if temp_path:
+                    self._discard(temp_path)
+                return False
+            job.error = error
+            job.finish(FAILED if error else DONE)
+            if self.store_dir:
+                # Con store el resultado vive solo en su archivo, no en memoria
+                if temp_path:
+                    self._commit(temp_path, _job_path(self.store_dir, job.company_id, job.id, RESULT_SUFFIX))
+                self._save(job)
+            else:
+                job.result = result
+        return True
+
+    def _unfinished(self, company_id: str, statuses: Tuple[str, ...] = (QUEUED, RUNNING)) -> int:
+        """
+        Jobs de la empresa en esos estados. Con store cuenta los de todos los
+        workers vivos; sin store, los locales. Llamar con el lock tomado
+        """
+        if not self.store_dir:
+            return sum(
+                1 for job in self._jobs.values()
+                if job.company_id == company_id and job.status in statuses
+            )
+        return sum(1 for job in self._stored(company_id) if job.status in statuses and _alive(job.owner))
+
+    def _cancelled(self, job: ReportJob) -> bool:
+        """Adopta una cancelación hecha en otro worker (llamar con el lock tomado)"""
+        if job.status == CANCELLED:
+            return True
+        stored = self._read(job.company_id, job.id) if self.store_dir else None
+        if stored is None or stored.status != CANCELLED:
+            return False
+        self._cancel_local(job)
+        job.finished_at, job.expires_at = stored.finished_at, stored.expires_at
+        return True
+
+    def _cancel_local(self, job: ReportJob):
+        if job.status not in (QUEUED, RUNNING):
+            return
+        job.finish(CANCELLED)
+        if self._keys.get(job.key) == job.id:
+            del self._keys[job.key]
+
+    def _existing(self, key: Tuple[str, str, str]) -> Optional[ReportJob]:
+        job_id = self._keys.get(key)
+        if self.store_dir:
+            job_id = self._read_key(key) or job_id
+        job = self._current(job_id, key[0]) if job_id else None
+        if job and job.status in REUSABLE_STATUSES and not job.expired:
+            return job
+        return None
+
+    def _current(self, job_id: str, company_id: str, include_result: bool = False) -> Optional[ReportJob]:
+        """Versión del store (la vigente entre workers) o, sin store, la local"""
+        job = self._read(company_id, job_id, include_result) if self.store_dir else None
+        return job or self._jobs.get(job_id)
+
+    def _purge(self):
+        """Olvida los jobs locales expirados (llamar con el lock tomado)"""
+        for job in [job for job in self._jobs.values() if job.expired]:
+            del self._jobs[job.id]
+            if self._keys.get(job.key) == job.id:
+                del self._keys[job.key]
+            if self.store_dir:
+                self._delete(job)
+
+    @contextmanager
+    def _store_lock(self):
+        """
+        Serializa las transiciones de estado entre threads de este worker y,
+        con store, entre los workers que lo comparten (flock)
+        """
+        with self._lock:
+            if not self.store_dir:
+                yield
+                return
+            try:
+                os.makedirs(self.store_dir, exist_ok=True)
+                handle = open(os.path.join(self.store_dir, ".lock"), "a")
+            except OSError as e:
+                logger.warning(f"⚠️ Could not lock report job store: {e}")
+                yield
+                return
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+
+    def _save(self, job: ReportJob):
+        """Metadatos del job (sin resultado): escritura atómica, otro proceso nunca lee un archivo a medias"""
+        path = _job_path(self.store_dir, job.company_id, job.id)
+        temp_path = self._write_temp(path, job.to_dict())
+        if temp_path:
+            self._commit(temp_path, path)
+
+    def _prepare_result(self, job: ReportJob, result) -> Optional[str]:
+        return self._write_temp(_job_path(self.store_dir, job.company_id, job.id, RESULT_SUFFIX), result)
+
+    def _write_temp(self, path: str, data) -> Optional[str]:
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as handle:
+                json.dump(data, handle, default=str)
+            return temp_path
+        except OSError as e:
+            logger.warning(f"⚠️ Could not persist report job file {path}: {e}")
+            self._discard(temp_path)
+            return None
+
+    def _commit(self, temp_path: str, path: str):
+        try:
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not persist report job file {path}: {e}")
+            self._discard(temp_path)
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _read(self, company_id: str, job_id: str, include_result: bool = False) -> Optional[ReportJob]:
+        path = _job_path(self.store_dir, company_id, job_id)
+        if not path:
+            return None
+        try:
+            with open(path, encoding="utf-8") as handle:
+                job = ReportJob.from_dict(json.load(handle))
+        except (OSError, ValueError):
+            return None
+        if include_result and job.status == DONE:
+            try:
+                with open(_job_path(self.store_dir, company_id, job_id, RESULT_SUFFIX), encoding="utf-8") as handle:
+                    job.result = json.load(handle)
+            except (OSError, ValueError):
+                pass
+        return job
+
+    def _save_key(self, job: ReportJob):
+        path = _key_path(self.store_dir, job.key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as handle:
+                handle.write(job.id)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not persist report job key {job.id}: {e}")
+
+    def _read_key(self, key: Tuple[str, str, str]) -> Optional[str]:
+        try:
+            with open(_key_path(self.store_dir, key), encoding="utf-8") as handle:
+                return handle.read().strip() or None
+        except OSError:
+            return None
+
+    def _forget_key(self, job: ReportJob):
+        if self._read_key(job.key) == job.id:
+            self._discard(_key_path(self.store_dir, job.key))
+
+    def _delete(self, job: ReportJob):
+        self._forget_key(job)
+        for suffix in (".json", RESULT_SUFFIX):
+            self._discard(_job_path(self.store_dir, job.company_id, job.id, suffix))
+
+    def _stored(self, company_id: Optional[str] = None) -> Iterator[ReportJob]:
+        """
+        Metadatos de los jobs vigentes del store (de una empresa o de todas, de
+        todos los workers); borra los expirados. Llamar con el lock tomado
+        """
+        if not self.store_dir:
+            return
+        if company_id is not None:
+            directories = [_company_dir(self.store_dir, company_id)]
+        else:
+            try:
+                directories = [entry.path for entry in os.scandir(self.store_dir) if entry.is_dir()]
+            except OSError:
+                return
+        for directory in directories:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(directory, name), encoding="utf-8") as handle:
+                        job = ReportJob.from_dict(json.load(handle))
+                except (OSError, ValueError):
+                    continue
+                if job.expired:
+                    self._delete(job)
+                    continue
+                yield job
+
+    def _load(self):
+        """Al arrancar: borra los expirados y marca como fallidos los jobs de workers que ya no existen"""
+        with self._store_lock():
+            for job in list(self._stored()):
+                if job.status in (QUEUED, RUNNING) and not _alive(job.owner):
+                    job.error = "Interrupted by a restart"
+                    job.finish(FAILED)
+                    self._save(job)
+                    self._forget_key(job)
+
+    def stats(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in list(self._jobs.values()):
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": len(self._tasks),
+            "jobs": statuses,
+            "waiting": sum(1 for waiting in self._waiting.values() for job in waiting if job.status == QUEUED),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+report_jobs = ReportJobQueue()
+report_jobs.attach(manager)
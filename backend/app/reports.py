@@ -0,0 +1,90 @@
+# app/reports.py
+"""
+Reportes administrativos pesados. Son funciones síncronas (el cliente de BD
+lo es) con firma (company_id, params) -> dict serializable a JSON, para que
+los endpoints directos las corran con asyncio.to_thread y la cola de jobs
+(app/report_jobs.py) las ejecute en segundo plano y persista el resultado.
+"""
+from datetime import datetime
+from typing import Callable, Dict, Optional
+from .date_range import DateRange
+from .fuel_rollups import fuel_rollups
+from .fuel_stats import FuelAggregate
+from .models.database import get_db
+
+def fuel_monthly_report(company_id: str, params: dict) -> dict:
+    month = params.get("month") or datetime.now().strftime("%Y-%m")
+
+    # Bucket mensual pre-agregado en lugar de filtrar todo el historial
+    buckets = fuel_rollups.periods(company_id, "month", f"{month}-01", f"{month}-01")
+    monthly = buckets[0][1] if buckets else FuelAggregate()
+
+    return {
+        "month": month,
+        "total_fuel_used": round(monthly.fuel, 2),
+        "total_cost": round(monthly.cost, 2),
+        "total_miles": round(monthly.miles, 2),
+        "records_count": monthly.count,
+        "average_consumption": round(monthly.average_consumption, 2)
+    }
+
+def inventory_report(company_id: str, params: dict) -> dict:
+    db = get_db()
+    inventory = db.table("inventory").select("*").eq("company_id", company_id).execute().data
+
+    total_items = len(inventory)
+    low_stock = len([item for item in inventory if item.get('status') == 'low_stock'])
+    out_of_stock = len([item for item in inventory if item.get('quantity', 0) == 0])
+
+    return {
+        "company_id": company_id,
+        "total_items": total_items,
+        "low_stock_items": low_stock,
+        "out_of_stock_items": out_of_stock,
+        "inventory_value": sum(item.get('quantity', 0) for item in inventory),
+        "alerts": low_stock + out_of_stock
+    }
+
+def company_overview(company_id: str, params: dict) -> dict:
+    db = get_db()
+    window = DateRange(params.get("from"), params.get("to"))
+
+    # Obtener todos los datos de la compañía
+    vehicles = db.table("vehicles").select("*").eq("company_id", company_id).execute().data
+    # Registros de la ventana (si hay): solo se cuentan, basta con el id
+    fuel_records = window.apply(db.table("fuel_records").select("id").eq("company_id", company_id)).execute().data
+    maintenance = window.apply(db.table("maintenance").select("id").eq("company_id", company_id)).execute().data
+    users = db.table("users").select("*").eq("company_id", company_id).execute().data
+
+    return {
+        "company_id": company_id,
+        "total_vehicles": len(vehicles),
+        "total_users": len(users),
+        "total_fuel_records": len(fuel_records),
+        "total_maintenance": len(maintenance),
+        "date_range": window.to_dict(),
+        "active_vehicles": len([v for v in vehicles if v.get('status') == 'active']),
+        "in_maintenance": len([v for v in vehicles if v.get('status') == 'maintenance']),
+        "users_by_role": {
+            "super_admin": len([u for u in users if u.get('role') == 'super_admin']),
+            "company_admin": len([u for u in users if u.get('role') == 'company_admin']),
+            "worker": len([u for u in users if u.get('role') == 'worker'])
+        }
+    }
+
+REPORTS: Dict[str, Callable[[str, dict], dict]] = {
+    "fuel_monthly": fuel_monthly_report,
+    "inventory": inventory_report,
+    "company_overview": company_overview
+}
+
+def report_params(report: str, window: DateRange, month: Optional[str] = None) -> dict:
+    """
+    Parámetros efectivos del reporte, resueltos al encolar: "este mes" queda
+    fijo en el job y forma parte de la clave de su resultado cacheado
+    """
+    if report == "fuel_monthly":
+        return {"month": month or datetime.now().strftime("%Y-%m")}
+    if report == "company_overview":
+        return window.to_dict()
+    return {}
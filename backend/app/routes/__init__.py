@@ -8,6 +8,9 @@ from .metrics import router as metrics_router
 from .admin import router as admin_router
 from .users import router as users_router
 from .companies import router as companies_router
+from .events import router as events_router
+from .dashboard import router as dashboard_router
+from .jobs import router as jobs_router
 
 __all__ = [
     'auth_router',
@@ -18,5 +21,8 @@ __all__ = [
     'metrics_router',
     'admin_router',
     'users_router',
-    'companies_router'
+    'companies_router',
+    'events_router',
+    'dashboard_router',
+    'jobs_router'
 ]
\ No newline at end of file
@@ -5,6 +5,8 @@ from ..models.company import CompanyCreate, CompanyUpdate, CompanyResponse, Comp
 from ..models.user import UserResponse, UserRole, UserStatus
 from ..models.database import get_db
 from ..auth.jwt_handler import require_super_admin, can_manage_companies
+from ..auth.license_manager import company_status_cache
+from ..manager import manager
 import uuid
 from datetime import datetime
 
@@ -175,9 +177,16 @@ async def update_company(
         update_data["updated_at"] = datetime.now().isoformat()
         
         result = db.table("companies").update(update_data).eq("id", company_id).execute()
+        company_status_cache.invalidate(company_id)
         
         if result.data:
             updated_company = db.table("companies").select("*").eq("id", company_id).execute()
+            # Invalida el estado cacheado en los demás workers (vía pub/sub)
+            await manager.broadcast_to_company({
+                "type": "COMPANY_UPDATED",
+                "data": {"id": company_id, "status": updated_company.data[0].get("status")},
+                "timestamp": datetime.now().isoformat()
+            }, company_id)
             return CompanyResponse(**updated_company.data[0])
         else:
             raise HTTPException(status_code=400, detail="Error updating company")
@@ -212,8 +221,14 @@ async def delete_company(
             )
         
         result = db.table("companies").delete().eq("id", company_id).execute()
+        company_status_cache.invalidate(company_id)
         
         if result.data is not None:
+            await manager.broadcast_to_company({
+                "type": "COMPANY_DELETED",
+                "data": {"id": company_id},
+                "timestamp": datetime.now().isoformat()
+            }, company_id)
             return {"message": "Company deleted successfully"}
         else:
             error_msg = result.error.message if result.error else "Unknown error"
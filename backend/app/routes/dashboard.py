@@ -0,0 +1,90 @@
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from ..models.database import get_db
+from ..live_metrics import live_metrics
+from ..fuel_rollups import fuel_rollups
+from ..maintenance_schedule import maintenance_schedule
+from ..auth.jwt_handler import get_current_active_user
+import asyncio
+import hashlib
+import json
+
+router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+# Ventana de mantenimientos próximos que muestra el dashboard
+UPCOMING_MAINTENANCE_DAYS = 30
+
+VEHICLE_COLUMNS = "id,unit_id,mechanic_name,model,total_miles,status,created_at"
+INVENTORY_COLUMNS = "id,vehicle_id,item_name,quantity,unit,min_quantity,status,last_updated"
+
+def _fetch(query) -> list:
+    result = query.execute()
+    if result.error:
+        raise Exception(result.error)
+    return result.data or []
+
+def _vehicles(company_id: str) -> list:
+    return _fetch(get_db().table("vehicles").select(VEHICLE_COLUMNS).eq("company_id", company_id).order("unit_id"))
+
+def _low_stock(company_id: str) -> list:
+    query = get_db().table("inventory").select(INVENTORY_COLUMNS).eq("company_id", company_id).eq("status", "low_stock")
+    return _fetch(query.order("item_name"))
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+@router.get("/snapshot")
+async def get_dashboard_snapshot(
+    request: Request,
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver el dashboard
+):
+    """
+    Todo lo que necesita Dashboard.tsx en una sola llamada: métricas (cache en
+    vivo), vehículos con su consumo promedio (rollups), alertas de stock bajo y
+    mantenimientos de los próximos 30 días. Las consultas corren en paralelo y
+    la respuesta lleva ETag: con If-None-Match igual se responde 304 sin cuerpo.
+    Si las métricas no están en cache se calculan con lo ya leído acá
+    (vehículos, rollups, mantenimientos) en lugar de volver a consultarlo
+    """
+    company_id = user["company_id"]
+    try:
+        vehicles, (totals, groups), low_stock, upcoming = await asyncio.gather(
+            asyncio.to_thread(_vehicles, company_id),
+            asyncio.to_thread(fuel_rollups.get_company, company_id),
+            asyncio.to_thread(_low_stock, company_id),
+            asyncio.to_thread(maintenance_schedule.upcoming, company_id, UPCOMING_MAINTENANCE_DAYS)
+        )
+        metrics = await live_metrics.get(
+            company_id, vehicles=vehicles, rollups=(totals, groups), upcoming=upcoming
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    status_counts = {}
+    for vehicle in vehicles:
+        status_counts[vehicle.get("status")] = status_counts.get(vehicle.get("status"), 0) + 1
+        group = groups.get(vehicle["id"])
+        vehicle["average_consumption"] = round(group.mean_consumption, 2) if group else None
+
+    payload = {
+        # upcoming_maintenance directo del índice: más fresco que el cache de métricas
+        "metrics": {**metrics, "upcoming_maintenance": upcoming},
+        "vehicles": vehicles,
+        "vehicle_status": status_counts,
+        "low_stock": low_stock,
+        "fuel_totals": {
+            "records_count": totals.count,
+            "total_cost": round(totals.cost, 2),
+            "total_miles": round(totals.miles, 2)
+        }
+    }
+
+    # Sin timestamp en el cuerpo: mismo contenido -> mismo ETag
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
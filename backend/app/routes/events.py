@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from ..auth.jwt_handler import get_current_active_user
+from ..manager import manager, ConnectionLimitExceeded
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+@router.get("/stream")
+async def stream_events(
+    since: Optional[int] = None,
+    types: Optional[str] = None,
+    vehicle_ids: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden escuchar
+):
+    """
+    Stream Server-Sent Events con los mismos eventos que /ws/{company_id}.
+    Para dashboards de solo lectura: HTTP plano, sin loop de recepción por socket.
+    El navegador reanuda solo con Last-Event-ID; `?since=` sirve para el primer connect.
+    """
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    try:
+        connection = await manager.connect_stream(
+            user["company_id"],
+            since=since,
+            user_id=user.get("user_id"),
+            event_types=types,
+            vehicle_ids=vehicle_ids
+        )
+    except ConnectionLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    async def event_stream():
+        try:
+            async for chunk in connection.events():
+                yield chunk
+        finally:
+            manager.disconnect(connection)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # nginx/Render: no bufferizar el stream
+        }
+    )
@@ -1,14 +1,48 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Query, File, UploadFile
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from ..models.fuel import FuelRecord, FuelRecordCreate, FuelRecordUpdate
 from ..models.database import get_db
 from ..auth.jwt_handler import get_current_active_user, require_company_admin
 from ..manager import manager
+from ..fuel_rollups import fuel_rollups
+from ..consumption_sketches import SKETCH_MIN_SAMPLES, consumption_sketches
+from ..analytics import ROLLING_FIELDS, FuelAnalytics, consumption_trends
+from ..date_range import DateRange, date_range_params
+from ..fuel_stats import GRANULARITIES, FuelAggregate, period_start
+from ..fuel_anomalies import fetch_fuel_records, scan_fuel_records
+from ..reports import fuel_monthly_report
+from ..fuel_reconcile import AMOUNT_TOLERANCE, DATE_TOLERANCE_DAYS, RESULT_LIMIT, StatementError, reconcile_statement
+import asyncio
+import json
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 
 router = APIRouter(prefix="/fuel", tags=["fuel"])
 
+def apply_fuel_change(company_id: str, vehicle_id: str, added: Optional[dict] = None, removed: Optional[dict] = None) -> Optional[dict]:
+    """
+    Propaga un alta/edición/baja a los rollups y a los sketches de consumo.
+    Devuelve el diagnóstico si la carga nueva es atípica para su vehículo.
+    Hace varias llamadas síncronas a la BD: correr con asyncio.to_thread.
+    En ediciones y bajas los sketches se reparan después con schedule_sketch_repair
+    """
+    fuel_rollups.apply(company_id, vehicle_id, added=added, removed=removed)
+    return consumption_sketches.apply(company_id, vehicle_id, added=added, removed=removed)
+
+def schedule_sketch_repair(background_tasks: BackgroundTasks, company_id: str, vehicle_id: str):
+    """Reconstruye los sketches del vehículo después de responder"""
+    if consumption_sketches.schedule_repair(company_id, vehicle_id):
+        background_tasks.add_task(consumption_sketches.repair, company_id, vehicle_id)
+
+async def broadcast_outlier(outlier: Optional[dict], company_id: str):
+    if outlier:
+        await manager.broadcast_to_company({
+            "type": "CONSUMPTION_OUTLIER",
+            "data": outlier,
+            "timestamp": datetime.now().isoformat()
+        }, company_id)
+
 @router.get("/", response_model=List[FuelRecord])
 async def get_fuel_records(
     vehicle_id: Optional[str] = None,
@@ -59,10 +93,11 @@ async def create_fuel_record(
             "created_at": datetime.now().isoformat()
         }
         
-        result = db.table("fuel_records").insert(record)
+        result = db.table("fuel_records").insert(record).execute()
         
         if result.data:
             new_record = result.data[0]
+            outlier = await asyncio.to_thread(apply_fuel_change, user["company_id"], new_record["vehicle_id"], added=new_record)
             
             # Broadcast real-time
             await manager.broadcast_to_company({
@@ -70,6 +105,7 @@ async def create_fuel_record(
                 "data": new_record,
                 "timestamp": datetime.now().isoformat()
             }, user["company_id"])
+            await broadcast_outlier(outlier, user["company_id"])
             
             return new_record
         else:
@@ -78,6 +114,105 @@ async def create_fuel_record(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def period_summary(aggregate: FuelAggregate) -> dict:
+    return {
+        "total_fuel_used": round(aggregate.fuel, 2),
+        "total_cost": round(aggregate.cost, 2),
+        "total_miles": round(aggregate.miles, 2),
+        "records_count": aggregate.count,
+        "average_consumption": round(aggregate.average_consumption, 2),
+        "cost_per_mile": round(aggregate.cost_per_mile, 2)
+    }
+
+# Declarada antes de /{record_id} para que "reports" no se tome como un id
+@router.get("/reports")
+async def get_fuel_reports(
+    granularity: str = "month",
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    vehicle_id: Optional[str] = None,
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver reportes
+):
+    """
+    Reporte por periodo (day | week | month) desde los rollups pre-agregados:
+    un rango de N periodos lee N filas, sin importar cuántos registros tenga
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    try:
+        # El bucket que contiene `from` también entra en el reporte
+        start = period_start(date_from, granularity) if date_from else None
+        end = date.fromisoformat(date_to[:10]).isoformat() if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from/to must be ISO dates (YYYY-MM-DD)")
+
+    try:
+        db = get_db()
+        
+        if vehicle_id:
+            vehicle_check = db.table("vehicles").select("id").eq("id", vehicle_id).eq("company_id", user["company_id"]).execute()
+            if not vehicle_check.data:
+                raise HTTPException(status_code=404, detail="Vehicle not found")
+        
+        buckets = fuel_rollups.periods(user["company_id"], granularity, start, end, vehicle_id)
+        
+        totals = FuelAggregate()
+        for _, aggregate in buckets:
+            totals.merge(aggregate)
+        
+        return {
+            "granularity": granularity,
+            "from": date_from,
+            "to": date_to,
+            "vehicle_id": vehicle_id,
+            "periods": [
+                {"period_start": bucket_start, **period_summary(aggregate)}
+                for bucket_start, aggregate in buckets
+            ],
+            "totals": period_summary(totals)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Declarada antes de /{record_id} para que "anomalies" no se tome como un id
+@router.get("/anomalies")
+async def get_fuel_anomalies(
+    window: DateRange = Depends(date_range_params),
+    user: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin auditan cargas
+):
+    """
+    Escaneo de fraude/errores en las cargas (ver app/fuel_anomalies.py).
+    Responde NDJSON: un hallazgo por línea a medida que se detectan y una
+    última línea {"summary": ...}. El chequeo de odómetro solo corre sin
+    ventana, porque compara el historial completo contra total_miles.
+    """
+    try:
+        db = get_db()
+        company_id = user["company_id"]
+        records = await asyncio.to_thread(fetch_fuel_records, company_id, window if window.active else None)
+        vehicles = db.table("vehicles").select("id,unit_id,total_miles,tank_capacity").eq("company_id", company_id).execute()
+        if vehicles.error:
+            raise Exception(vehicles.error)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def stream():
+        counts = {}
+        for finding in scan_fuel_records(records, vehicles.data or [], check_odometer=not window.active):
+            counts[finding["check"]] = counts.get(finding["check"], 0) + 1
+            yield json.dumps(finding) + "\n"
+        yield json.dumps({"summary": {
+            "records_scanned": len(records),
+            "findings": sum(counts.values()),
+            "by_check": counts,
+            "date_range": window.to_dict()
+        }}) + "\n"
+
+    # Generador síncrono: Starlette lo itera en el threadpool, sin bloquear el loop
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @router.get("/{record_id}", response_model=FuelRecord)
 async def get_fuel_record(
     record_id: str,
@@ -96,6 +231,7 @@ async def get_fuel_record(
 async def update_fuel_record(
     record_id: str,
     fuel_data: FuelRecordUpdate,
+    background_tasks: BackgroundTasks,
     user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden actualizar
 ):
     try:
@@ -123,6 +259,15 @@ async def update_fuel_record(
         
         if result.data:
             updated_record = result.data[0]
+            outlier = await asyncio.to_thread(
+                apply_fuel_change,
+                user["company_id"],
+                updated_record["vehicle_id"],
+                added=updated_record,
+                removed=check_result.data[0]
+            )
+            for vehicle_id in {updated_record["vehicle_id"], check_result.data[0]["vehicle_id"]}:
+                schedule_sketch_repair(background_tasks, user["company_id"], vehicle_id)
             
             # Broadcast real-time
             await manager.broadcast_to_company({
@@ -130,6 +275,7 @@ async def update_fuel_record(
                 "data": updated_record,
                 "timestamp": datetime.now().isoformat()
             }, user["company_id"])
+            await broadcast_outlier(outlier, user["company_id"])
             
             return updated_record
         else:
@@ -141,23 +287,28 @@ async def update_fuel_record(
 @router.delete("/{record_id}")
 async def delete_fuel_record(
     record_id: str,
+    background_tasks: BackgroundTasks,
     user: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin pueden eliminar
 ):
     try:
         db = get_db()
         
         # Verificar que el registro pertenezca a la compañía
-        check_result = db.table("fuel_records").select("id").eq("id", record_id).eq("company_id", user["company_id"]).execute()
+        check_result = db.table("fuel_records").select("*").eq("id", record_id).eq("company_id", user["company_id"]).execute()
         if not check_result.data:
             raise HTTPException(status_code=404, detail="Fuel record not found")
         
         result = db.table("fuel_records").delete().eq("id", record_id).execute()
+        if not result.error:
+            deleted_record = check_result.data[0]
+            await asyncio.to_thread(apply_fuel_change, user["company_id"], deleted_record["vehicle_id"], removed=deleted_record)
+            schedule_sketch_repair(background_tasks, user["company_id"], deleted_record["vehicle_id"])
         
         if result.data:
             # Broadcast real-time
             await manager.broadcast_to_company({
                 "type": "FUEL_RECORD_DELETED",
-                "data": {"id": record_id},
+                "data": {"id": record_id, "vehicle_id": check_result.data[0].get("vehicle_id")},
                 "timestamp": datetime.now().isoformat()
             }, user["company_id"])
             
@@ -171,50 +322,162 @@ async def delete_fuel_record(
 # Ruta para análisis de combustible
 @router.get("/analysis/consumption")
 async def get_consumption_analysis(
+    window: DateRange = Depends(date_range_params),
     user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver análisis
 ):
     """
-    Análisis de consumo de combustible
+    Análisis de consumo de combustible (todo el historial, o ?from=&to= / ?last_n_days=)
     """
     try:
-        db = get_db()
-        fuel_records = db.table("fuel_records").select("*").eq("company_id", user["company_id"]).execute().data
+        if window.active:
+            # La ventana se filtra en la BD: solo viajan las filas del periodo
+            db = get_db()
+            query = db.table("fuel_records").select("*").eq("company_id", user["company_id"])
+            analytics = FuelAnalytics(window.apply(query).execute().data or [])
+            totals, groups = analytics.totals(), analytics.by_vehicle()
+        else:
+            # Rollups incrementales: una fila por empresa y una por vehículo
+            totals, groups = fuel_rollups.get_company(user["company_id"])
         
-        if not fuel_records:
+        if not totals.count:
             return {"message": "No fuel records found for analysis"}
         
-        # Calcular métricas de consumo
-        total_fuel = sum(record['fuel_amount'] for record in fuel_records)
-        total_miles = sum(record['miles_driven'] for record in fuel_records)
-        total_cost = sum(record['total_cost'] for record in fuel_records)
+        vehicle_avg = {
+            vehicle_id: aggregate.mean_consumption
+            for vehicle_id, aggregate in groups.items()
+            if aggregate.count
+        }
         
-        avg_consumption = total_miles / total_fuel if total_fuel > 0 else 0
-        cost_per_mile = total_cost / total_miles if total_miles > 0 else 0
+        return {
+            "total_fuel_used": round(totals.fuel, 2),
+            "total_miles_driven": round(totals.miles, 2),
+            "total_fuel_cost": round(totals.cost, 2),
+            "average_consumption": round(totals.average_consumption, 2),
+            "cost_per_mile": round(totals.cost_per_mile, 2),
+            "vehicle_consumption": vehicle_avg,
+            "date_range": window.to_dict()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Columnas que usan los percentiles, los periodos y la suma móvil
+TREND_COLUMNS = "vehicle_id,date,fuel_amount,miles_driven,total_cost,consumption"
+
+@router.get("/analysis/trends")
+async def get_consumption_trends(
+    window: DateRange = Depends(date_range_params),
+    granularity: str = "month",
+    rolling_days: int = Query(30, ge=1, le=365),
+    field: str = "cost",
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver análisis
+):
+    """
+    Percentiles exactos de consumo (p10/p50/p90 de la flota y de cada
+    vehículo), serie de la flota por ?granularity=day|week|month y suma móvil
+    de ?field=cost|fuel|miles|consumption en ?rolling_days días, sobre todo el
+    historial o la ventana ?from=&to= / ?last_n_days=
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    if field not in ROLLING_FIELDS:
+        raise HTTPException(status_code=400, detail=f"field must be one of: {', '.join(ROLLING_FIELDS)}")
+    try:
+        records = await asyncio.to_thread(fetch_fuel_records, user["company_id"], window, TREND_COLUMNS)
+        if not records:
+            return {"message": "No fuel records found for analysis"}
+        trends = await asyncio.to_thread(consumption_trends, records, granularity, rolling_days, field)
+        return {**trends, "granularity": granularity, "date_range": window.to_dict()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analysis/outliers")
+async def get_consumption_outliers(
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver análisis
+):
+    """
+    Vehículos cuyo consumo mediano cae bajo el p10 de la flota o de su modelo,
+    según los sketches de cuantiles (sin releer el historial de cargas)
+    """
+    try:
+        db = get_db()
+        company_id = user["company_id"]
+        sketches = consumption_sketches.load(company_id)
+        vehicles = db.table("vehicles").select("id,unit_id,model").eq("company_id", company_id).execute().data or []
         
-        # Consumo por vehículo
-        vehicles_consumption = {}
-        for record in fuel_records:
-            vehicle_id = record['vehicle_id']
-            if vehicle_id not in vehicles_consumption:
-                vehicles_consumption[vehicle_id] = []
-            vehicles_consumption[vehicle_id].append(record['consumption'])
+        fleet_p10 = sketches.fleet.quantile(0.10) if sketches.fleet.count >= SKETCH_MIN_SAMPLES else None
+        model_p10 = {
+            model: sketch.quantile(0.10)
+            for model, sketch in sketches.models.items()
+            if sketch.count >= SKETCH_MIN_SAMPLES
+        }
         
-        # Promedio por vehículo
-        vehicle_avg = {}
-        for vehicle_id, consumptions in vehicles_consumption.items():
-            vehicle_avg[vehicle_id] = sum(consumptions) / len(consumptions)
+        flagged = []
+        for vehicle in vehicles:
+            sketch = sketches.vehicles.get(vehicle["id"])
+            if not sketch or not sketch.count:
+                continue
+            median = sketch.quantile(0.5)
+            reasons = []
+            if fleet_p10 is not None and median < fleet_p10:
+                reasons.append("below_fleet_p10")
+            if vehicle.get("model") in model_p10 and median < model_p10[vehicle["model"]]:
+                reasons.append("below_model_p10")
+            if reasons:
+                flagged.append({
+                    "vehicle_id": vehicle["id"],
+                    "unit_id": vehicle.get("unit_id"),
+                    "model": vehicle.get("model"),
+                    "median_consumption": round(median, 2),
+                    "fleet_percentile": round(sketches.fleet.cdf(median) * 100, 1),
+                    "samples": int(sketch.count),
+                    "reasons": reasons
+                })
         
         return {
-            "total_fuel_used": round(total_fuel, 2),
-            "total_miles_driven": round(total_miles, 2),
-            "total_fuel_cost": round(total_cost, 2),
-            "average_consumption": round(avg_consumption, 2),
-            "cost_per_mile": round(cost_per_mile, 2),
-            "vehicle_consumption": vehicle_avg
+            "fleet": {
+                "samples": int(sketches.fleet.count),
+                "p10": round(fleet_p10, 2) if fleet_p10 is not None else None,
+                "p50": round(sketches.fleet.quantile(0.5), 2) if sketches.fleet.count else None,
+                "p90": round(sketches.fleet.quantile(0.9), 2) if sketches.fleet.count else None
+            },
+            "models": {model: round(value, 2) for model, value in model_p10.items()},
+            "vehicles": sorted(flagged, key=lambda v: v["median_consumption"])
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/reconcile")
+async def reconcile_fuel_statement(
+    statement: UploadFile = File(...),
+    date_tolerance_days: int = Query(DATE_TOLERANCE_DAYS, ge=0, le=7),
+    amount_tolerance: float = Query(AMOUNT_TOLERANCE, gt=0),
+    limit: int = Query(RESULT_LIMIT, ge=0, le=10000),
+    user: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin concilian extractos
+):
+    """
+    Concilia un extracto CSV de tarjeta de combustible (columnas vehículo/unit_id,
+    fecha y litros o importe) contra los registros de la empresa.
+    Devuelve matched / ambiguous / unmatched_statement / unmatched_records / invalid
+    """
+    try:
+        # El upload ya está en un archivo temporal: se recorre en un thread sin cargarlo en memoria
+        return await asyncio.to_thread(
+            reconcile_statement,
+            user["company_id"],
+            statement.file,
+            date_tolerance_days,
+            amount_tolerance,
+            limit
+        )
+    except StatementError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Statement must be a UTF-8 CSV file")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await statement.close()
+
 # Ruta administrativa para reportes
 @router.get("/admin/monthly-report")
 async def get_monthly_fuel_report(
@@ -222,27 +485,9 @@ async def get_monthly_fuel_report(
 ):
     """
     Reporte mensual de combustible - solo para company_admin y super_admin
+    (en segundo plano: POST /jobs/fuel_monthly)
     """
     try:
-        db = get_db()
-        current_month = datetime.now().strftime("%Y-%m")
-        
-        fuel_records = db.table("fuel_records").select("*").eq("company_id", admin["company_id"]).execute().data
-        
-        # Filtrar por mes actual
-        monthly_records = [r for r in fuel_records if r['date'].startswith(current_month)]
-        
-        monthly_fuel = sum(r['fuel_amount'] for r in monthly_records)
-        monthly_cost = sum(r['total_cost'] for r in monthly_records)
-        monthly_miles = sum(r['miles_driven'] for r in monthly_records)
-        
-        return {
-            "month": current_month,
-            "total_fuel_used": round(monthly_fuel, 2),
-            "total_cost": round(monthly_cost, 2),
-            "total_miles": round(monthly_miles, 2),
-            "records_count": len(monthly_records),
-            "average_consumption": round(monthly_miles / monthly_fuel if monthly_fuel > 0 else 0, 2)
-        }
+        return await asyncio.to_thread(fuel_monthly_report, admin["company_id"], {})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -4,6 +4,8 @@ from ..models.inventory import Inventory, InventoryCreate, InventoryUpdate
 from ..models.database import get_db
 from ..auth.jwt_handler import get_current_active_user, require_company_admin
 from ..manager import manager
+from ..reports import inventory_report
+import asyncio
 import uuid
 from datetime import datetime
 
@@ -140,7 +142,7 @@ async def delete_inventory_item(
         db = get_db()
         
         # Verificar que el item pertenezca a la compañía
-        check_result = db.table("inventory").select("id").eq("id", item_id).eq("company_id", user["company_id"]).execute()
+        check_result = db.table("inventory").select("id,vehicle_id").eq("id", item_id).eq("company_id", user["company_id"]).execute()
         if not check_result.data:
             raise HTTPException(status_code=404, detail="Inventory item not found")
         
@@ -150,7 +152,7 @@ async def delete_inventory_item(
             # Broadcast real-time
             await manager.broadcast_to_company({
                 "type": "INVENTORY_DELETED",
-                "data": {"id": item_id},
+                "data": {"id": item_id, "vehicle_id": check_result.data[0].get("vehicle_id")},
                 "timestamp": datetime.now().isoformat()
             }, user["company_id"])
             
@@ -183,22 +185,9 @@ async def get_inventory_report(
 ):
     """
     Reporte completo de inventario - solo para company_admin y super_admin
+    (en segundo plano: POST /jobs/inventory)
     """
     try:
-        db = get_db()
-        inventory = db.table("inventory").select("*").eq("company_id", admin["company_id"]).execute().data
-        
-        total_items = len(inventory)
-        low_stock = len([item for item in inventory if item.get('status') == 'low_stock'])
-        out_of_stock = len([item for item in inventory if item.get('quantity', 0) == 0])
-        
-        return {
-            "company_id": admin["company_id"],
-            "total_items": total_items,
-            "low_stock_items": low_stock,
-            "out_of_stock_items": out_of_stock,
-            "inventory_value": sum(item.get('quantity', 0) for item in inventory),
-            "alerts": low_stock + out_of_stock
-        }
+        return await asyncio.to_thread(inventory_report, admin["company_id"], {})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,78 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import JSONResponse
+from typing import Optional
+from ..auth.jwt_handler import require_company_admin
+from ..date_range import DateRange, date_range_params
+from ..report_jobs import DONE, FAILED, JobQueueFull, report_jobs
+from ..reports import REPORTS, report_params
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# La cola lee y escribe su store de archivos con un lock: fuera del event loop
+async def _get_job(job_id: str, admin: dict, include_result: bool = False):
+    job = await asyncio.to_thread(report_jobs.get, job_id, admin["company_id"], include_result)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/")
+async def list_report_jobs(
+    admin: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin
+):
+    return [job.to_dict() for job in await asyncio.to_thread(report_jobs.list, admin["company_id"])]
+
+@router.post("/{report}", status_code=202)
+async def submit_report_job(
+    report: str,
+    window: DateRange = Depends(date_range_params),
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-(0[1-9]|1[0-2])$"),
+    admin: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin
+):
+    """
+    Encola un reporte pesado (fuel_monthly | inventory | company_overview) y
+    retorna 202 con el job. Al terminar llega REPORT_JOB_COMPLETED por
+    WebSocket; el resultado se pide a GET /jobs/{job_id}/result. Si ya hay
+    un job igual en curso o con resultado vigente se retorna ese (200)
+    """
+    if report not in REPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown report. Available: {', '.join(REPORTS)}")
+    try:
+        job, created = await asyncio.to_thread(
+            report_jobs.submit,
+            admin["company_id"], admin.get("user_id"), report, report_params(report, window, month)
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(status_code=202 if created else 200, content=job.to_dict())
+
+@router.get("/{job_id}")
+async def get_report_job(
+    job_id: str,
+    admin: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin
+):
+    return (await _get_job(job_id, admin)).to_dict()
+
+@router.get("/{job_id}/result")
+async def get_report_job_result(
+    job_id: str,
+    admin: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin
+):
+    job = await _get_job(job_id, admin, include_result=True)
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error or "Report failed")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result
+
+@router.delete("/{job_id}")
+async def cancel_report_job(
+    job_id: str,
+    admin: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin
+):
+    job = await asyncio.to_thread(report_jobs.cancel, job_id, admin["company_id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
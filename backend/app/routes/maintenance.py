@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import List, Optional
 from ..models.maintenance import Maintenance, MaintenanceCreate, MaintenanceUpdate
-from ..models.database import get_db
+from ..models.maintenance_plan import MaintenancePlan, MaintenancePlanCreate, MaintenancePlanUpdate
+from ..models.database import fetch_all, get_db
 from ..auth.jwt_handler import get_current_active_user, require_company_admin
 from ..manager import manager
+from ..maintenance_schedule import INACTIVE_STATUSES, maintenance_schedule
+from ..maintenance_planner import PLAN_TABLE, maintenance_planner
+from ..analytics import maintenance_costs_by_vehicle
+from ..date_range import DateRange, date_range_params
+import asyncio
 import uuid
 from datetime import datetime
 
@@ -48,7 +54,7 @@ async def create_maintenance(
             "company_id": user["company_id"],
             "created_at": datetime.now().isoformat()
         }
-        result = db.table("maintenance").insert(maintenance)
+        result = db.table("maintenance").insert(maintenance).execute()
         
         if result.data:
             new_maintenance = result.data[0]
@@ -67,6 +73,193 @@ async def create_maintenance(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Declarada antes de /{maintenance_id} para que "upcoming" no se tome como un id
+@router.get("/upcoming")
+async def get_upcoming_maintenance(
+    within_days: int = Query(30, ge=0, le=365),
+    include_overdue: bool = False,
+    include_planned: bool = True,
+    vehicle_id: Optional[str] = None,
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver
+):
+    """
+    Mantenimientos cuyo next_maintenance_date vence en los próximos `within_days`
+    días (con include_overdue=true también los ya vencidos), ordenados por fecha.
+    Sale del índice en memoria (app/maintenance_schedule.py), no de la tabla.
+    `planned` son los vencimientos proyectados por los planes preventivos
+    """
+    try:
+        company_id = user["company_id"]
+        records, planned = await asyncio.gather(
+            asyncio.to_thread(maintenance_schedule.upcoming, company_id, within_days, include_overdue, vehicle_id),
+            asyncio.to_thread(maintenance_planner.due, company_id, within_days, include_overdue, vehicle_id)
+            if include_planned else asyncio.sleep(0, result=[])
+        )
+        return {
+            "within_days": within_days,
+            "include_overdue": include_overdue,
+            "count": len(records),
+            "maintenance": records,
+            "planned": planned
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def maintenance_cost_summary(company_id: str, window: DateRange) -> dict:
+    """Cantidad y costo de mantenimiento por vehículo (sin los cancelados), de mayor a menor costo"""
+    db = get_db()
+    records = [
+        record for record in fetch_all(
+            lambda: window.apply(
+                db.table("maintenance").select("id,vehicle_id,date,cost,status").eq("company_id", company_id)
+            ).order("id")
+        )
+        if record.get("status") not in INACTIVE_STATUSES
+    ]
+    vehicles = {
+        vehicle["id"]: vehicle for vehicle in fetch_all(
+            lambda: db.table("vehicles").select("id,unit_id").eq("company_id", company_id).order("id")
+        )
+    }
+    costs = maintenance_costs_by_vehicle(records)
+    return {
+        "total_cost": round(sum(entry["cost"] for entry in costs.values()), 2),
+        "total_count": sum(entry["count"] for entry in costs.values()),
+        "vehicles": sorted(
+            (
+                {
+                    "vehicle_id": vehicle_id,
+                    "unit_id": vehicles.get(vehicle_id, {}).get("unit_id"),
+                    "count": entry["count"],
+                    "cost": round(entry["cost"], 2),
+                    "average_cost": round(entry["cost"] / entry["count"], 2)
+                }
+                for vehicle_id, entry in costs.items()
+            ),
+            key=lambda entry: entry["cost"],
+            reverse=True
+        ),
+        "date_range": window.to_dict()
+    }
+
+@router.get("/analysis/costs")
+async def get_maintenance_costs(
+    window: DateRange = Depends(date_range_params),
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver análisis
+):
+    """
+    Costo de mantenimiento por vehículo (todo el historial, o ?from=&to= /
+    ?last_n_days=), agrupado con el motor columnar de app/analytics.py
+    """
+    try:
+        return await asyncio.to_thread(maintenance_cost_summary, user["company_id"], window)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _check_intervals(plan: dict):
+    if not plan.get("interval_miles") and not plan.get("interval_days"):
+        raise HTTPException(status_code=400, detail="A plan needs interval_miles and/or interval_days")
+    for field in ("interval_miles", "interval_days"):
+        if plan.get(field) is not None and plan[field] <= 0:
+            raise HTTPException(status_code=400, detail=f"{field} must be positive")
+
+@router.get("/plans", response_model=List[MaintenancePlan])
+async def get_maintenance_plans(
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver
+):
+    try:
+        db = get_db()
+        result = db.table(PLAN_TABLE).select("*").eq("company_id", user["company_id"]).order("maintenance_type").execute()
+        return result.data
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/plans", response_model=MaintenancePlan)
+async def create_maintenance_plan(
+    plan_data: MaintenancePlanCreate,
+    user: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin definen planes
+):
+    plan = {
+        "id": str(uuid.uuid4()),
+        **plan_data.dict(),
+        "company_id": user["company_id"],
+        "created_at": datetime.now().isoformat()
+    }
+    _check_intervals(plan)
+    try:
+        db = get_db()
+        result = db.table(PLAN_TABLE).insert(plan).execute()
+        if not result.data:
+            raise HTTPException(status_code=400, detail="Error creating maintenance plan")
+        
+        new_plan = result.data[0]
+        await manager.broadcast_to_company({
+            "type": "MAINTENANCE_PLAN_CREATED",
+            "data": new_plan,
+            "timestamp": datetime.now().isoformat()
+        }, user["company_id"])
+        return new_plan
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/plans/{plan_id}", response_model=MaintenancePlan)
+async def update_maintenance_plan(
+    plan_id: str,
+    plan_data: MaintenancePlanUpdate,
+    user: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin definen planes
+):
+    try:
+        db = get_db()
+        check_result = db.table(PLAN_TABLE).select("*").eq("id", plan_id).eq("company_id", user["company_id"]).execute()
+        if not check_result.data:
+            raise HTTPException(status_code=404, detail="Maintenance plan not found")
+        
+        changes = plan_data.dict(exclude_unset=True)
+        _check_intervals({**check_result.data[0], **changes})
+        result = db.table(PLAN_TABLE).update(changes).eq("id", plan_id).execute()
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Maintenance plan not found")
+        
+        updated_plan = result.data[0]
+        await manager.broadcast_to_company({
+            "type": "MAINTENANCE_PLAN_UPDATED",
+            "data": updated_plan,
+            "timestamp": datetime.now().isoformat()
+        }, user["company_id"])
+        return updated_plan
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/plans/{plan_id}")
+async def delete_maintenance_plan(
+    plan_id: str,
+    user: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin definen planes
+):
+    try:
+        db = get_db()
+        check_result = db.table(PLAN_TABLE).select("id").eq("id", plan_id).eq("company_id", user["company_id"]).execute()
+        if not check_result.data:
+            raise HTTPException(status_code=404, detail="Maintenance plan not found")
+        
+        result = db.table(PLAN_TABLE).delete().eq("id", plan_id).execute()
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Maintenance plan not found")
+        
+        await manager.broadcast_to_company({
+            "type": "MAINTENANCE_PLAN_DELETED",
+            "data": {"id": plan_id},
+            "timestamp": datetime.now().isoformat()
+        }, user["company_id"])
+        return {"message": "Maintenance plan deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{maintenance_id}", response_model=Maintenance)
 async def get_maintenance_record(
     maintenance_id: str,
@@ -123,7 +316,7 @@ async def delete_maintenance(
         db = get_db()
         
         # Verificar que el registro pertenezca a la compañía
-        check_result = db.table("maintenance").select("id").eq("id", maintenance_id).eq("company_id", user["company_id"]).execute()
+        check_result = db.table("maintenance").select("id,vehicle_id").eq("id", maintenance_id).eq("company_id", user["company_id"]).execute()
         if not check_result.data:
             raise HTTPException(status_code=404, detail="Maintenance record not found")
         
@@ -133,7 +326,7 @@ async def delete_maintenance(
             # Broadcast real-time
             await manager.broadcast_to_company({
                 "type": "MAINTENANCE_DELETED",
-                "data": {"id": maintenance_id},
+                "data": {"id": maintenance_id, "vehicle_id": check_result.data[0].get("vehicle_id")},
                 "timestamp": datetime.now().isoformat()
             }, user["company_id"])
             
@@ -1,73 +1,41 @@
 from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
 from ..models.metrics import Metrics
 from ..models.database import get_db
+from ..live_metrics import live_metrics, compute_company_metrics
+from ..analytics import FuelAnalytics
+from ..date_range import DateRange, date_range_params
+from ..fuel_rollups import fuel_rollups
+from ..fuel_stats import GRANULARITIES
+from ..tco import tco_engine
+from ..reports import company_overview
 from ..auth.jwt_handler import get_current_active_user, require_company_admin, require_super_admin
 from datetime import datetime, timedelta
+import asyncio
 
 router = APIRouter(prefix="/metrics", tags=["metrics"])
 
 @router.get("/", response_model=Metrics)
-async def get_metrics(user: dict = Depends(get_current_active_user)):  # ✅ Todos los roles pueden ver
+async def get_metrics(
+    window: DateRange = Depends(date_range_params),
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver
+):
+    """
+    Métricas del dashboard desde el cache en vivo: se recalculan al cambiar
+    combustible/mantenimiento/vehículos y se empujan como METRICS_UPDATED.
+    Con ?from=&to= o ?last_n_days= se calculan solo sobre esa ventana (sin cache)
+    """
     try:
-        db = get_db()
-        company_id = user["company_id"]
-        
-        # Get all fuel records for the current month con filtro de compañía
-        current_month = datetime.now().strftime("%Y-%m")
-        fuel_records = db.table("fuel_records").select("*").eq("company_id", company_id).execute().data
-        
-        # Get all vehicles con filtro de compañía
-        vehicles = db.table("vehicles").select("*").eq("company_id", company_id).execute().data
-        
-        # Get all maintenance records con filtro de compañía
-        maintenance = db.table("maintenance").select("*").eq("company_id", company_id).execute().data
-        
-        # Calculate metrics
-        if fuel_records:
-            total_fuel = sum(record['fuel_amount'] for record in fuel_records)
-            total_miles = sum(record['miles_driven'] for record in fuel_records)
-            total_cost = sum(record['total_cost'] for record in fuel_records)
-            
-            average_consumption = total_miles / total_fuel if total_fuel > 0 else 0
-            cost_per_mile = total_cost / total_miles if total_miles > 0 else 0
-        else:
-            average_consumption = 0
-            cost_per_mile = 0
-            total_cost = 0
-            total_miles = 0
-        
-        # Get low performance vehicles (consumption < 7 km/L)
-        low_performance = []
-        
-        for vehicle in vehicles:
-            vehicle_fuel = [r for r in fuel_records if r['vehicle_id'] == vehicle['id']]
-            if vehicle_fuel:
-                avg_consumption = sum(r['consumption'] for r in vehicle_fuel) / len(vehicle_fuel)
-                if avg_consumption < 7:
-                    low_performance.append({
-                        'unit_id': vehicle['unit_id'],
-                        'consumption': round(avg_consumption, 1),
-                        'status': 'critical' if avg_consumption < 6 else 'low'
-                    })
-        
-        # Get upcoming maintenance (next 30 days)
-        next_month = (datetime.now() + timedelta(days=30)).isoformat()
-        upcoming = [m for m in maintenance if m.get('next_service_date') and m['next_service_date'] <= next_month]
-        
-        return Metrics(
-            average_consumption=round(average_consumption, 1),
-            monthly_fuel_cost=round(total_cost, 2),
-            cost_per_mile=round(cost_per_mile, 2),
-            monthly_miles=round(total_miles, 0),
-            low_performance_vehicles=low_performance,
-            upcoming_maintenance=upcoming
-        )
+        if window.active:
+            return await asyncio.to_thread(compute_company_metrics, user["company_id"], window)
+        return await live_metrics.get(user["company_id"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/vehicle/{vehicle_id}")
 async def get_vehicle_metrics(
     vehicle_id: str, 
+    window: DateRange = Depends(date_range_params),
     user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver
 ):
     try:
@@ -79,72 +47,65 @@ async def get_vehicle_metrics(
         if not vehicle_check.data:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
-        # Get fuel records for specific vehicle con filtro de compañía
-        fuel_records = db.table("fuel_records").select("*").eq("vehicle_id", vehicle_id).eq("company_id", company_id).execute().data
-        
         # Get vehicle info
         vehicle = db.table("vehicles").select("*").eq("id", vehicle_id).execute().data
         
-        # Calculate vehicle-specific metrics
-        if fuel_records:
-            total_fuel = sum(record['fuel_amount'] for record in fuel_records)
-            total_miles = sum(record['miles_driven'] for record in fuel_records)
-            total_cost = sum(record['total_cost'] for record in fuel_records)
-            
-            avg_consumption = total_miles / total_fuel if total_fuel > 0 else 0
-            cost_per_mile = total_cost / total_miles if total_miles > 0 else 0
-            
-            # Last 5 records for trend analysis
-            recent_records = sorted(fuel_records, key=lambda x: x['date'], reverse=True)[:5]
+        def fuel_query():
+            query = db.table("fuel_records").select("*").eq("vehicle_id", vehicle_id).eq("company_id", company_id)
+            return window.apply(query)
+        
+        # Calculate vehicle-specific metrics: rollup incremental en O(1), o solo las filas de la ventana
+        if window.active:
+            totals = FuelAnalytics(fuel_query().execute().data or []).totals()
         else:
-            avg_consumption = 0
-            cost_per_mile = 0
-            total_cost = 0
-            recent_records = []
+            totals = fuel_rollups.get(company_id, vehicle_id)
+        
+        # Last 5 records for trend analysis
+        recent_records = fuel_query().order("date", desc=True).limit(5).execute().data or []
         
         return {
             "vehicle": vehicle[0],
-            "average_consumption": round(avg_consumption, 1),
-            "total_fuel_cost": round(total_cost, 2),
-            "cost_per_mile": round(cost_per_mile, 2),
-            "total_miles": round(total_miles, 0),
-            "recent_records": recent_records
+            "average_consumption": round(totals.average_consumption, 1),
+            "total_fuel_cost": round(totals.cost, 2),
+            "cost_per_mile": round(totals.cost_per_mile, 2),
+            "total_miles": round(totals.miles, 0),
+            "recent_records": recent_records,
+            "date_range": window.to_dict()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/tco")
+async def get_tco(
+    window: DateRange = Depends(date_range_params),
+    granularity: Optional[str] = None,
+    user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden ver
+):
+    """
+    Costo total de propiedad (combustible + mantenimiento) por vehículo, por
+    modelo y de la flota, con costo por milla. Con ?granularity=day|week|month
+    cada vehículo incluye además la serie por periodo. Cacheado por empresa e
+    invalidado con cualquier cambio de combustible, mantenimiento o vehículos
+    """
+    if granularity and granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    try:
+        return await asyncio.to_thread(tco_engine.get, user["company_id"], window, granularity)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Métricas administrativas de la empresa
 @router.get("/company/overview")
 async def get_company_overview(
+    window: DateRange = Depends(date_range_params),
     admin: dict = Depends(require_company_admin)  # ✅ SOLO Company Admin y Super Admin
 ):
     """
     Métricas completas de la compañía - solo para company_admin y super_admin
+    (en segundo plano: POST /jobs/company_overview)
     """
     try:
-        db = get_db()
-        company_id = admin["company_id"]
-        
-        # Obtener todos los datos de la compañía
-        vehicles = db.table("vehicles").select("*").eq("company_id", company_id).execute().data
-        fuel_records = db.table("fuel_records").select("*").eq("company_id", company_id).execute().data
-        maintenance = db.table("maintenance").select("*").eq("company_id", company_id).execute().data
-        users = db.table("users").select("*").eq("company_id", company_id).execute().data
-        
-        return {
-            "company_id": company_id,
-            "total_vehicles": len(vehicles),
-            "total_users": len(users),
-            "total_fuel_records": len(fuel_records),
-            "total_maintenance": len(maintenance),
-            "active_vehicles": len([v for v in vehicles if v.get('status') == 'active']),
-            "in_maintenance": len([v for v in vehicles if v.get('status') == 'maintenance']),
-            "users_by_role": {
-                "super_admin": len([u for u in users if u.get('role') == 'super_admin']),
-                "company_admin": len([u for u in users if u.get('role') == 'company_admin']),
-                "worker": len([u for u in users if u.get('role') == 'worker'])
-            }
-        }
+        return await asyncio.to_thread(company_overview, admin["company_id"], window.to_dict())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
 from typing import List, Optional
 from ..models.vehicle import Vehicle, VehicleCreate, VehicleUpdate
 from ..models.database import get_db
 from ..auth.jwt_handler import get_current_active_user, require_company_admin
 from ..manager import manager
+from ..consumption_sketches import consumption_sketches
 import uuid
 from datetime import datetime, date
 
@@ -75,12 +76,13 @@ async def get_vehicle(
 async def update_vehicle(
     vehicle_id: str,
     vehicle_data: VehicleUpdate,
+    background_tasks: BackgroundTasks,
     user: dict = Depends(get_current_active_user)  # ✅ Todos los roles pueden actualizar
 ):
     try:
         db = get_db()
         # Verificar que el vehículo pertenezca a la compañía del usuario
-        check_result = db.table("vehicles").select("id").eq("id", vehicle_id).eq("company_id", user["company_id"]).execute()
+        check_result = db.table("vehicles").select("id,model").eq("id", vehicle_id).eq("company_id", user["company_id"]).execute()
         if not check_result.data:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
@@ -89,6 +91,14 @@ async def update_vehicle(
         if result.data:
             updated_vehicle = result.data[0]
             
+            # Un cambio de modelo mueve el sketch de consumo del vehículo de modelo
+            old_model = check_result.data[0].get("model")
+            if updated_vehicle.get("model") != old_model:
+                background_tasks.add_task(
+                    consumption_sketches.reassign_model,
+                    user["company_id"], vehicle_id, old_model, updated_vehicle.get("model")
+                )
+            
             # Broadcast real-time
             await manager.broadcast_to_company({
                 "type": "VEHICLE_UPDATED",
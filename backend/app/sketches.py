@@ -0,0 +1,138 @@
+# app/sketches.py
+"""
+t-digest (variante "merging"): sketch de cuantiles mergeable y de tamaño acotado.
+Con compression=100 guarda ~100 centroides sin importar cuántos valores vio,
+es exacto en las colas (p1/p99) y dos sketches se combinan sumando centroides,
+así que el de un modelo es el merge de los de sus vehículos.
+"""
+import math
+from typing import List, Optional
+
+DEFAULT_COMPRESSION = 100
+
+class TDigest:
+    __slots__ = ("compression", "centroids", "count", "min", "max", "_buffer")
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION):
+        self.compression = compression
+        # [media, peso] ordenados por media
+        self.centroids: List[List[float]] = []
+        self.count = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self._buffer: List[List[float]] = []
+
+    def add(self, value: float, weight: float = 1):
+        self._buffer.append([value, weight])
+        self.count += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        if not other.count:
+            return
+        self._buffer.extend([mean, weight] for mean, weight in other.centroids + other._buffer)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+
+    def _k(self, q: float) -> float:
+        # Función de escala k1: centroides chicos en las colas, grandes en el centro
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer)
+        self._buffer = []
+
+        merged = []
+        mean, weight = points[0]
+        so_far = 0.0
+        k_lower = self._k(0.0)
+        for next_mean, next_weight in points[1:]:
+            proposed = weight + next_weight
+            if self._k((so_far + proposed) / self.count) - k_lower <= 1:
+                mean += (next_mean - mean) * next_weight / proposed
+                weight = proposed
+            else:
+                merged.append([mean, weight])
+                so_far += weight
+                k_lower = self._k(so_far / self.count)
+                mean, weight = next_mean, next_weight
+        merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Valor en el cuantil q (0..1); None si el sketch está vacío"""
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        target = q * self.count
+        # Interpolación lineal entre los puntos medios de centroides vecinos
+        previous_mean, previous_mid = self.min, 0.0
+        cumulative = 0.0
+        for mean, weight in self.centroids:
+            mid = cumulative + weight / 2
+            if target <= mid:
+                span = mid - previous_mid
+                fraction = (target - previous_mid) / span if span > 0 else 0
+                return previous_mean + (mean - previous_mean) * fraction
+            previous_mean, previous_mid = mean, mid
+            cumulative += weight
+
+        span = self.count - previous_mid
+        fraction = (target - previous_mid) / span if span > 0 else 1
+        return previous_mean + (self.max - previous_mean) * min(fraction, 1)
+
+    def cdf(self, value: float) -> Optional[float]:
+        """Fracción de valores <= value (0..1); None si el sketch está vacío"""
+        self._compress()
+        if not self.centroids:
+            return None
+        if value <= self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+
+        previous_mean, previous_mid = self.min, 0.0
+        cumulative = 0.0
+        for mean, weight in self.centroids:
+            mid = cumulative + weight / 2
+            if value < mean:
+                span = mean - previous_mean
+                fraction = (value - previous_mean) / span if span > 0 else 0
+                return (previous_mid + (mid - previous_mid) * fraction) / self.count
+            previous_mean, previous_mid = mean, mid
+            cumulative += weight
+
+        span = self.max - previous_mean
+        fraction = (value - previous_mean) / span if span > 0 else 1
+        return (previous_mid + (self.count - previous_mid) * fraction) / self.count
+
+    def to_dict(self) -> dict:
+        """Forma compacta para persistir (jsonb)"""
+        self._compress()
+        return {
+            "c": [[round(mean, 4), weight] for mean, weight in self.centroids],
+            "n": self.count,
+            "min": self.min,
+            "max": self.max,
+            "k": self.compression
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "TDigest":
+        digest = cls((data or {}).get("k", DEFAULT_COMPRESSION))
+        if data:
+            digest.centroids = [list(centroid) for centroid in data.get("c", [])]
+            digest.count = data.get("n", 0)
+            digest.min = data.get("min")
+            digest.max = data.get("max")
+        return digest
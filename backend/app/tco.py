@@ -0,0 +1,224 @@
+# app/tco.py
+"""
+Costo total de propiedad (TCO) por vehículo y por modelo: combustible +
+mantenimiento, sobre una ventana de fechas y opcionalmente por periodo.
+
+Los dos historiales se leen paginados y ordenados por (vehicle_id, date) y se
+combinan con un merge de un solo paso (heapq.merge): cada fila se visita una
+vez y en memoria solo hay una página de cada stream más los acumuladores.
+Los resultados se cachean por empresa y se invalidan con cualquier evento de
+combustible, mantenimiento o vehículos. Para recibir también los de otros
+workers, antes de calcular se suscribe el worker al canal de la empresa
+(manager.watch_company), tenga o no sockets abiertos de ella.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Iterator, Optional
+from .batching import BATCH_EVENT_TYPE
+from .date_range import DateRange
+from .fuel_stats import period_start
+from .maintenance_schedule import INACTIVE_STATUSES, PLAN_EVENT_PREFIX
+from .manager import manager
+from .models.database import fetch_all, get_db
+
+logger = logging.getLogger(__name__)
+
+# Cota de frescura del cache aunque no lleguen eventos
+TCO_CACHE_TTL_SECONDS = float(os.getenv("TCO_CACHE_TTL_SECONDS", "600"))
+
+# Combinaciones ventana/granularidad cacheadas por empresa
+TCO_CACHE_ENTRIES = 8
+
+TCO_EVENT_PREFIXES = ("FUEL_RECORD_", "MAINTENANCE_", "VEHICLE_")
+
+FUEL, MAINTENANCE = 0, 1
+
+class TCOAggregate:
+    __slots__ = ("fuel_cost", "maintenance_cost", "miles", "fuel_records", "maintenance_count")
+
+    def __init__(self):
+        self.fuel_cost = 0.0
+        self.maintenance_cost = 0.0
+        self.miles = 0.0
+        self.fuel_records = 0
+        self.maintenance_count = 0
+
+    def add(self, kind: int, row: dict):
+        if kind == FUEL:
+            self.fuel_cost += row.get("total_cost") or 0
+            self.miles += row.get("miles_driven") or 0
+            self.fuel_records += 1
+        else:
+            self.maintenance_cost += row.get("cost") or 0
+            self.maintenance_count += 1
+
+    def merge(self, other: "TCOAggregate"):
+        for field in self.__slots__:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    @property
+    def total_cost(self) -> float:
+        return self.fuel_cost + self.maintenance_cost
+
+    def _per_mile(self, cost: float) -> Optional[float]:
+        return round(cost / self.miles, 3) if self.miles > 0 else None
+
+    def to_dict(self) -> dict:
+        return {
+            "fuel_cost": round(self.fuel_cost, 2),
+            "maintenance_cost": round(self.maintenance_cost, 2),
+            "total_cost": round(self.total_cost, 2),
+            "miles": round(self.miles, 1),
+            "fuel_records": self.fuel_records,
+            "maintenance_count": self.maintenance_count,
+            "cost_per_mile": self._per_mile(self.total_cost),
+            "fuel_cost_per_mile": self._per_mile(self.fuel_cost),
+            "maintenance_cost_per_mile": self._per_mile(self.maintenance_cost),
+            "maintenance_share": round(self.maintenance_cost / self.total_cost, 3) if self.total_cost else None
+        }
+
+def stream_rows(table: str, columns: str, company_id: str, window: Optional[DateRange]) -> Iterator[dict]:
+    """Filas de la empresa ordenadas por (vehicle_id, date, id), página a página"""
+    db = get_db()
+
+    def query():
+        query = db.table(table).select(columns).eq("company_id", company_id)
+        if window and window.active:
+            query = window.apply(query)
+        return query.order("vehicle_id").order("date").order("id")
+
+    return fetch_all(query)
+
+def merge_costs(fuel: Iterator[dict], maintenance: Iterator[dict]) -> Iterator[tuple]:
+    """(vehicle_id, día, tipo, fila) de ambos streams en orden, en una sola pasada"""
+    return heapq.merge(
+        ((row["vehicle_id"], row["date"][:10], FUEL, row) for row in fuel if row.get("date")),
+        ((row["vehicle_id"], row["date"][:10], MAINTENANCE, row) for row in maintenance
+         if row.get("date") and row.get("status") not in INACTIVE_STATUSES),
+        key=itemgetter(0, 1, 2)
+    )
+
+def compute_tco(company_id: str, window: Optional[DateRange] = None, granularity: Optional[str] = None) -> dict:
+    db = get_db()
+    rows = fetch_all(lambda: db.table("vehicles").select("id,unit_id,model").eq("company_id", company_id).order("id"))
+    vehicles = {vehicle["id"]: vehicle for vehicle in rows}
+
+    merged = merge_costs(
+        stream_rows("fuel_records", "id,vehicle_id,date,total_cost,miles_driven", company_id, window),
+        stream_rows("maintenance", "id,vehicle_id,date,cost,status", company_id, window)
+    )
+
+    fleet = TCOAggregate()
+    models: Dict[str, TCOAggregate] = {}
+    model_vehicles: Dict[str, int] = {}
+    vehicle_rows = []
+    for vehicle_id, items in groupby(merged, key=itemgetter(0)):
+        total = TCOAggregate()
+        periods: Dict[str, TCOAggregate] = {}
+        for _, day, kind, row in items:
+            total.add(kind, row)
+            if granularity:
+                bucket = period_start(day, granularity)
+                if bucket not in periods:
+                    periods[bucket] = TCOAggregate()
+                periods[bucket].add(kind, row)
+
+        vehicle = vehicles.get(vehicle_id, {})
+        model = vehicle.get("model") or "unknown"
+        fleet.merge(total)
+        models.setdefault(model, TCOAggregate()).merge(total)
+        model_vehicles[model] = model_vehicles.get(model, 0) + 1
+
+        entry = {"vehicle_id": vehicle_id, "unit_id": vehicle.get("unit_id"), "model": model, **total.to_dict()}
+        if granularity:
+            # Buckets ya en orden: el stream de cada vehículo viene ordenado por fecha
+            entry["periods"] = [{"period_start": start, **aggregate.to_dict()} for start, aggregate in periods.items()]
+        vehicle_rows.append(entry)
+
+    # Más caros por milla primero; sin millas al final
+    vehicle_rows.sort(key=lambda entry: (entry["cost_per_mile"] is None, -(entry["cost_per_mile"] or 0)))
+    return {
+        "date_range": (window or DateRange()).to_dict(),
+        "granularity": granularity,
+        "fleet": fleet.to_dict(),
+        "models": sorted(
+            ({"model": model, "vehicles": model_vehicles[model], **aggregate.to_dict()} for model, aggregate in models.items()),
+            key=lambda entry: -entry["total_cost"]
+        ),
+        "vehicles": vehicle_rows
+    }
+
+class TCOEngine:
+    def __init__(self, ttl_seconds: float = TCO_CACHE_TTL_SECONDS, max_entries: int = TCO_CACHE_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # company_id -> {(desde, hasta, granularidad): (resultado, instante)} en orden LRU
+        self._cache: Dict[str, OrderedDict] = {}
+        # Sube con cada invalidación: descarta cálculos que empezaron antes de un cambio
+        self._generation: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.manager = None
+
+    def attach(self, manager):
+        self.manager = manager
+        manager.add_listener(self.on_event)
+
+    def get(self, company_id: str, window: Optional[DateRange] = None, granularity: Optional[str] = None) -> dict:
+        """TCO cacheado (síncrono: correr con asyncio.to_thread)"""
+        window = window or DateRange()
+        key = (window.start, window.end, granularity)
+        with self._lock:
+            entries = self._cache.get(company_id)
+            entry = entries.get(key) if entries else None
+            if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Suscrito antes de leer: un cambio de otro worker durante el cálculo sube la generación
+        if self.manager:
+            self.manager.watch_company(company_id)
+        with self._lock:
+            generation = self._generation.get(company_id, 0)
+        result = compute_tco(company_id, window, granularity)
+        with self._lock:
+            # Un cambio durante el cálculo deja el resultado sin cachear
+            if self._generation.get(company_id, 0) == generation:
+                entries = self._cache.setdefault(company_id, OrderedDict())
+                entries[key] = (result, time.monotonic())
+                while len(entries) > self.max_entries:
+                    entries.popitem(last=False)
+        return result
+
+    def invalidate(self, company_id: str):
+        with self._lock:
+            self._cache.pop(company_id, None)
+            self._generation[company_id] = self._generation.get(company_id, 0) + 1
+
+    def on_event(self, company_id: str, message: dict, local: bool):
+        events = message.get("events", []) if message.get("type") == BATCH_EVENT_TYPE else [message]
+        for event in events:
+            event_type = event.get("type") or ""
+            if event_type.startswith(TCO_EVENT_PREFIXES) and not event_type.startswith(PLAN_EVENT_PREFIX):
+                self.invalidate(company_id)
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cached_companies": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+tco_engine = TCOEngine()
+tco_engine.attach(manager)
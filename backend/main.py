@@ -3,11 +3,18 @@ from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Requ
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from datetime import datetime
+from typing import Optional
 from app.routes.invitations import router as invitations_router
 from app.routes.admin import router as admin_router
 from app.routes.users import router as users_router
-from typing import Dict, List
-from app.auth.jwt_handler import verify_token_simple  # ← FUNCIÓN OPTIMIZADA
+from app.auth.jwt_handler import verify_token_simple, verify_websocket_token  # ← FUNCIÓN OPTIMIZADA
+from app.auth.license_manager import company_manager
+from app.manager import manager, ConnectionLimitExceeded
+from app.live_metrics import live_metrics
+from app.maintenance_schedule import maintenance_schedule
+from app.maintenance_planner import maintenance_planner
+from app.tco import tco_engine
+from app.report_jobs import report_jobs
 from app.routes.setup import router as setup_router
 from app.routes import (
     auth_router, 
@@ -15,7 +22,10 @@ from app.routes import (
     fuel_router, 
     maintenance_router, 
     inventory_router, 
-    metrics_router
+    metrics_router,
+    events_router,
+    dashboard_router,
+    jobs_router
 )
 import json
 import os
@@ -47,57 +57,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
+    expose_headers=["ETag"],  # /dashboard/snapshot: el cliente revalida con If-None-Match
 )
 
-# Manager de conexiones WebSocket
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, company_id: str):
-        await websocket.accept()
-        if company_id not in self.active_connections:
-            self.active_connections[company_id] = []
-        self.active_connections[company_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, company_id: str):
-        if company_id in self.active_connections:
-            self.active_connections[company_id].remove(websocket)
-            if not self.active_connections[company_id]:
-                del self.active_connections[company_id]
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast_to_company(self, message: dict, company_id: str):
-        if company_id in self.active_connections:
-            disconnected = []
-            for connection in self.active_connections[company_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    disconnected.append(connection)
-            
-            for connection in disconnected:
-                self.disconnect(connection, company_id)
-
-manager = ConnectionManager()
-
-# WebSocket endpoint
+# Pub/sub entre workers para los broadcasts WebSocket
+@app.on_event("startup")
+async def start_realtime():
+    await manager.start()
+    await report_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_realtime():
+    live_metrics.stop()
+    await report_jobs.stop()
+    await manager.stop()
+
+# Códigos de cierre WebSocket
+WS_POLICY_VIOLATION = 1008
+WS_TRY_AGAIN_LATER = 1013
+
+# WebSocket endpoint (usa el manager compartido con los routers)
 @app.websocket("/ws/{company_id}")
-async def websocket_endpoint(websocket: WebSocket, company_id: str):
-    await manager.connect(websocket, company_id)
+async def websocket_endpoint(websocket: WebSocket, company_id: str, since: Optional[int] = None):
+    # 🔐 El middleware HTTP no cubre WebSockets: se verifica el JWT en el handshake
+    user_data = verify_websocket_token(websocket)
+    if not user_data:
+        await websocket.close(code=WS_POLICY_VIOLATION, reason="Token missing or invalid")
+        return
+
+    # El socket queda ligado a la empresa del token (super_admin puede observar cualquiera)
+    if user_data.get("role") != "super_admin" and user_data.get("company_id") != company_id:
+        await websocket.close(code=WS_POLICY_VIOLATION, reason="Company mismatch")
+        return
+
+    try:
+        await company_manager.check_user_company_async(user_data)
+    except HTTPException as e:
+        await websocket.close(code=WS_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    # ?since=<seq> reanuda desde el último evento recibido (o RESYNC_REQUIRED)
+    try:
+        connection = await manager.connect(websocket, company_id, since=since, user_id=user_data.get("user_id"))
+    except ConnectionLimitExceeded as e:
+        await websocket.close(code=WS_TRY_AGAIN_LATER, reason=str(e))
+        return
     try:
         while True:
             data = await websocket.receive_text()
+            connection.touch()
             try:
                 message = json.loads(data)
-                if message.get("type") == "ping":
-                    await websocket.send_json({"type": "pong", "timestamp": datetime.now().isoformat()})
-            except:
-                pass
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(message, dict):
+                continue
+
+            if message.get("type") == "ping":
+                manager.send_to_connection(connection, {"type": "pong", "timestamp": datetime.now().isoformat()})
+            elif message.get("type") == "subscribe":
+                # {"type": "subscribe", "event_types": [...], "vehicle_ids": [...]}
+                manager.update_subscription(
+                    connection,
+                    event_types=message.get("event_types"),
+                    vehicle_ids=message.get("vehicle_ids")
+                )
+            # "pong" al heartbeat del servidor es opcional: solo actualiza last_seen
     except WebSocketDisconnect:
-        manager.disconnect(websocket, company_id)
+        pass
+    finally:
+        manager.disconnect(connection)
 
 # MIDDLEWARE DE AUTENTICACIÓN PROFESIONAL
 @app.middleware("http")
@@ -109,12 +138,21 @@ async def authenticate_request(request: Request, call_next):
         "/admin/initialize-default-user", "/setup/initialize-system"
     ]
     
+    # Rutas de streaming que aceptan el token por query string
+    query_token_routes = ["/events/stream"]
+    
     # No autenticar rutas públicas Y requests OPTIONS
     if request.url.path in public_routes or request.method == "OPTIONS":
         return await call_next(request)
     
     # Verificar token para rutas protegidas
     auth_header = request.headers.get("Authorization")
+    if (not auth_header or not auth_header.startswith("Bearer ")) and request.url.path in query_token_routes:
+        # EventSource no permite headers: el stream SSE acepta ?token=
+        query_token = request.query_params.get("token")
+        if query_token:
+            auth_header = f"Bearer {query_token}"
+
     if not auth_header or not auth_header.startswith("Bearer "):
         return JSONResponse(
             status_code=401, 
@@ -134,6 +172,15 @@ async def authenticate_request(request: Request, call_next):
     # 🔍 DEBUG: Verificar datos decodificados del token
     print(f"🔍 [MIDDLEWARE DEBUG] User data from token: {user_data}")
     
+    # 🏢 Empresa activa (estado cacheado, sin round trip a la BD por request)
+    try:
+        await company_manager.check_user_company_async(user_data)
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": e.detail}
+        )
+    
     # Agregar user_data al request state para uso en endpoints
     request.state.user = user_data
     return await call_next(request)
@@ -149,6 +196,9 @@ app.include_router(admin_router)
 app.include_router(invitations_router)
 app.include_router(setup_router)
 app.include_router(users_router)
+app.include_router(events_router)
+app.include_router(dashboard_router)
+app.include_router(jobs_router)
 
 # Endpoints básicos
 @app.get("/")
@@ -157,22 +207,32 @@ async def root():
         "message": "Road Service API con WebSockets", 
         "version": "2.0.0",
         "docs": "/docs",
-        "websocket": "/ws/{company_id}",
+        "websocket": "/ws/{company_id}?token=<jwt>",
         "environment": "production"
     }
 
 @app.get("/health")
 async def health_check():
-    active_connections = sum(len(conns) for conns in manager.active_connections.values())
+    connection_counts = manager.connection_counts()
     return {
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(),
-        "active_websocket_connections": active_connections,
-        "companies_connected": list(manager.active_connections.keys())
+        "active_websocket_connections": sum(connection_counts.values()),
+        "companies_connected": list(connection_counts.keys()),
+        "connections_per_company": connection_counts,
+        "realtime": manager.stats(),
+        "live_metrics": live_metrics.stats(),
+        "maintenance_schedule": maintenance_schedule.stats(),
+        "maintenance_planner": maintenance_planner.stats(),
+        "tco": tco_engine.stats(),
+        "report_jobs": report_jobs.stats()
     }
 
 @app.post("/broadcast/{company_id}")
-async def broadcast_message(company_id: str, message: dict):
+async def broadcast_message(request: Request, company_id: str, message: dict):
+    user = request.state.user
+    if user.get("role") != "super_admin" and user.get("company_id") != company_id:
+        raise HTTPException(status_code=403, detail="Cannot broadcast to another company")
     await manager.broadcast_to_company(message, company_id)
     return {"status": "message_sent", "company_id": company_id}
 
@@ -195,9 +255,19 @@ async def force_cors_headers(request: Request, call_next):
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
     response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type, X-Requested-With, Accept, Origin"
     response.headers["Access-Control-Allow-Credentials"] = "true"
+    response.headers["Access-Control-Expose-Headers"] = "ETag"
     
     return response
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
\ No newline at end of file
+    # Ping/pong del protocolo WebSocket: uvicorn cierra los sockets medio abiertos
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        reload=False,
+        ws_per_message_deflate=True,
+        ws_ping_interval=float(os.getenv("WS_PING_INTERVAL_SECONDS", "20")),
+        ws_ping_timeout=float(os.getenv("WS_PING_TIMEOUT_SECONDS", "20"))
+    )
\ No newline at end of file
@@ -0,0 +1,52 @@
+# backend/scripts/backfill_fuel_rollups.py
+"""
+Reconstruye los rollups de combustible (totales y buckets día/semana/mes)
+desde fuel_records. Seguro de re-ejecutar: cada empresa se reescribe completa.
+
+    python scripts/backfill_fuel_rollups.py                 # todas las empresas
+    python scripts/backfill_fuel_rollups.py --company <id>  # una sola
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.database import get_db
+from app.fuel_rollups import fuel_rollups
+
+def backfill(company_ids):
+    failed = []
+    for company_id in company_ids:
+        start = time.perf_counter()
+        try:
+            totals, groups = fuel_rollups.rebuild(company_id)
+            print(f"✅ {company_id}: {totals.count} registros, {len(groups)} vehículos ({time.perf_counter() - start:.1f}s)")
+        except Exception as e:
+            failed.append(company_id)
+            print(f"❌ {company_id}: {e}")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--company", action="append", help="company_id a reconstruir (repetible)")
+    args = parser.parse_args()
+
+    company_ids = args.company
+    if not company_ids:
+        result = get_db().table("companies").select("id").execute()
+        if result.error:
+            print(f"❌ Error listando empresas: {result.error}")
+            sys.exit(1)
+        company_ids = [company["id"] for company in result.data]
+
+    print("🔄 BACKFILL DE ROLLUPS DE COMBUSTIBLE")
+    print("=" * 50)
+    failed = backfill(company_ids)
+    print("=" * 50)
+    print(f"Empresas: {len(company_ids)} | Errores: {len(failed)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# backend/scripts/bench_analytics.py
+"""
+Benchmark del motor columnar (app/analytics.py) frente a los loops en Python
+puro de app/fuel_stats.py: totales, group-by por vehículo, buckets
+diarios/semanales/mensuales (lo que calcula el backfill de rollups) y lo
+que sirve /fuel/analysis/trends: percentiles por vehículo y suma móvil de
+30 días.
+
+    python scripts/bench_analytics.py --vehicles 1000 --records 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import analytics
+from app.analytics import FuelAnalytics, FuelColumns
+from app.fuel_stats import GRANULARITIES
+
+def make_records(vehicles: int, records: int, seed: int = 42):
+    rng = random.Random(seed)
+    pool = []
+    for i in range(vehicles):
+        for _ in range(10):
+            fuel = rng.uniform(20, 80)
+            miles = fuel * rng.uniform(4, 12)
+            pool.append({
+                "vehicle_id": f"veh-{i}",
+                "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "fuel_amount": fuel,
+                "miles_driven": miles,
+                "total_cost": fuel * 1.1,
+                "consumption": round(miles / fuel, 2)
+            })
+    return [pool[rng.randrange(len(pool))] for _ in range(records)]
+
+def run_all(engine: FuelAnalytics):
+    engine.totals()
+    engine.by_vehicle()
+    for granularity in GRANULARITIES:
+        engine.by_period(granularity)
+    engine.percentiles([10, 50, 90], by_vehicle=True)
+    engine.rolling(30)
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--records", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if analytics.np is None:
+        print("❌ NumPy no está instalado: pip install -r requirements.txt")
+        sys.exit(1)
+
+    print("📊 BENCHMARK ANALÍTICA COLUMNAR")
+    print("=" * 60)
+    records = make_records(args.vehicles, args.records)
+    print(f"{args.records} registros, {args.vehicles} vehículos")
+
+    python_engine = FuelAnalytics(records)
+    python_engine.columns = None
+    python_time = timed(lambda: run_all(python_engine))
+
+    columns = []
+    load_time = timed(lambda: columns.append(FuelColumns(records)))
+    numpy_engine = FuelAnalytics([])
+    numpy_engine.records, numpy_engine.columns = records, columns[0]
+    compute_time = timed(lambda: run_all(numpy_engine))
+
+    print(f"Python puro:            {python_time:8.2f}s")
+    print(f"NumPy carga columnar:   {load_time:8.2f}s")
+    print(f"NumPy cálculo:          {compute_time:8.2f}s")
+    print(f"Speedup total:          {python_time / (load_time + compute_time):8.1f}x")
+    print(f"Speedup solo cálculo:   {python_time / compute_time:8.1f}x")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
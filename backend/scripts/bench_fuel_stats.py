@@ -0,0 +1,92 @@
+# backend/scripts/bench_fuel_stats.py
+"""
+Benchmark del group-by de combustible: compara el escaneo anidado anterior
+(O(vehículos × registros)) con la pasada única de app/fuel_stats.py.
+
+    python scripts/bench_fuel_stats.py --vehicles 1000 --records 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.fuel_stats import group_fuel_by_vehicle, low_performance_vehicles
+
+def make_fleet(vehicles: int, records: int, seed: int = 42):
+    """Flota sintética; los registros reutilizan un pool por vehículo para no agotar memoria"""
+    rng = random.Random(seed)
+    fleet = [{"id": f"veh-{i}", "unit_id": f"U{i:04d}"} for i in range(vehicles)]
+    pool = []
+    for vehicle in fleet:
+        for _ in range(10):
+            fuel = rng.uniform(20, 80)
+            miles = fuel * rng.uniform(4, 12)
+            pool.append({
+                "vehicle_id": vehicle["id"],
+                "fuel_amount": fuel,
+                "miles_driven": miles,
+                "total_cost": fuel * 1.1,
+                "consumption": round(miles / fuel, 2)
+            })
+    fuel_records = [pool[rng.randrange(len(pool))] for _ in range(records)]
+    return fleet, fuel_records
+
+def legacy_low_performance(vehicles, fuel_records):
+    """Implementación anterior de metrics.get_metrics"""
+    low_performance = []
+    for vehicle in vehicles:
+        vehicle_fuel = [r for r in fuel_records if r['vehicle_id'] == vehicle['id']]
+        if vehicle_fuel:
+            avg_consumption = sum(r['consumption'] for r in vehicle_fuel) / len(vehicle_fuel)
+            if avg_consumption < 7:
+                low_performance.append({
+                    'unit_id': vehicle['unit_id'],
+                    'consumption': round(avg_consumption, 1),
+                    'status': 'critical' if avg_consumption < 6 else 'low'
+                })
+    return low_performance
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--legacy-max", type=int, default=20_000,
+                        help="tamaño máximo en el que se ejecuta el escaneo anidado")
+    args = parser.parse_args()
+
+    print("📊 BENCHMARK GROUP-BY DE COMBUSTIBLE")
+    print("=" * 60)
+    print(f"{'registros':>10} {'group-by (s)':>14} {'ns/registro':>12} {'anidado (s)':>12}")
+
+    sizes = []
+    size = min(10_000, args.records)
+    while size < args.records:
+        sizes.append(size)
+        size *= 10
+    sizes.append(args.records)
+
+    for size in sizes:
+        fleet, fuel_records = make_fleet(args.vehicles, size)
+        fast, elapsed = timed(lambda: low_performance_vehicles(fleet, group_fuel_by_vehicle(fuel_records)))
+
+        legacy = "-"
+        if size <= args.legacy_max:
+            slow, legacy_elapsed = timed(legacy_low_performance, fleet, fuel_records)
+            assert slow == fast, "group-by y escaneo anidado no coinciden"
+            legacy = f"{legacy_elapsed:.3f}"
+
+        print(f"{size:>10} {elapsed:>14.3f} {elapsed / size * 1e9:>12.0f} {legacy:>12}")
+
+    print("=" * 60)
+    print("✅ ns/registro constante = escalado lineal en el número de registros")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# backend/scripts/scan_fuel_anomalies.py
+"""
+Escaneo batch de anomalías de combustible (ver app/fuel_anomalies.py) de una
+o todas las empresas. Escribe un hallazgo por línea (NDJSON, con company_id)
+a medida que se detectan, y el resumen por empresa a stderr.
+
+    python scripts/scan_fuel_anomalies.py --output anomalies.ndjson
+    python scripts/scan_fuel_anomalies.py --company <id> --from 2024-01-01
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.database import get_db
+from app.date_range import DateRange
+from app.fuel_anomalies import fetch_fuel_records, scan_fuel_records
+
+def scan_company(company_id, window, output):
+    records = fetch_fuel_records(company_id, window if window.active else None)
+    vehicles = get_db().table("vehicles").select("id,total_miles,tank_capacity").eq("company_id", company_id).execute()
+    if vehicles.error:
+        raise Exception(vehicles.error)
+
+    findings = 0
+    for finding in scan_fuel_records(records, vehicles.data or [], check_odometer=not window.active):
+        output.write(json.dumps({"company_id": company_id, **finding}) + "\n")
+        findings += 1
+    output.flush()
+    return len(records), findings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--company", action="append", help="company_id a escanear (repetible)")
+    parser.add_argument("--from", dest="date_from", help="fecha inicial ISO (sin ventana se escanea todo)")
+    parser.add_argument("--to", dest="date_to", help="fecha final ISO")
+    parser.add_argument("--output", help="archivo NDJSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    company_ids = args.company
+    if not company_ids:
+        result = get_db().table("companies").select("id").execute()
+        if result.error:
+            print(f"❌ Error listando empresas: {result.error}", file=sys.stderr)
+            sys.exit(1)
+        company_ids = [company["id"] for company in result.data]
+
+    window = DateRange(args.date_from, args.date_to)
+    output = open(args.output, "w") if args.output else sys.stdout
+    print("🔍 ESCANEO DE ANOMALÍAS DE COMBUSTIBLE", file=sys.stderr)
+    print("=" * 50, file=sys.stderr)
+
+    failed, total_records, total_findings = [], 0, 0
+    try:
+        for company_id in company_ids:
+            start = time.perf_counter()
+            try:
+                records, findings = scan_company(company_id, window, output)
+                total_records += records
+                total_findings += findings
+                print(f"✅ {company_id}: {records} registros, {findings} hallazgos ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+            except Exception as e:
+                failed.append(company_id)
+                print(f"❌ {company_id}: {e}", file=sys.stderr)
+    finally:
+        if args.output:
+            output.close()
+
+    print("=" * 50, file=sys.stderr)
+    print(f"Empresas: {len(company_ids)} | Registros: {total_records} | Hallazgos: {total_findings} | Errores: {len(failed)}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -14,5 +14,12 @@ init_default_user()
 " || echo "⚠️  Error en inicialización, continuando..."
 
 # Iniciar servidor FastAPI - PRODUCCIÓN (sin reload)
+# Con varios workers la cola de reportes (app/report_jobs.py) se comparte vía
+# REPORT_JOB_STORE_DIR: todos los workers deben ver el mismo directorio
+export REPORT_JOB_STORE_DIR="${REPORT_JOB_STORE_DIR:-/tmp/road-service-report-jobs}"
+# Ping/pong del protocolo WebSocket: uvicorn cierra los sockets medio abiertos
+export WS_PING_INTERVAL_SECONDS="${WS_PING_INTERVAL_SECONDS:-20}"
+export WS_PING_TIMEOUT_SECONDS="${WS_PING_TIMEOUT_SECONDS:-20}"
 echo "🌐 Iniciando servidor FastAPI..."
-uvicorn main:app --host 0.0.0.0 --port 8000 --workers 2
\ No newline at end of file
+uvicorn main:app --host 0.0.0.0 --port 8000 --workers 2 --ws websockets --ws-per-message-deflate true \
+    --ws-ping-interval "$WS_PING_INTERVAL_SECONDS" --ws-ping-timeout "$WS_PING_TIMEOUT_SECONDS"
\ No newline at end of file
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Los tests importan `app` igual que main.py: desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
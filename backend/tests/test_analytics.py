@@ -0,0 +1,97 @@
+import random
+import pytest
+from app import analytics as analytics_module
+from app.analytics import FuelAnalytics, FuelColumns, consumption_trends, maintenance_costs_by_vehicle, np
+from app.fuel_stats import GRANULARITIES, aggregate_fuel, group_fuel_by_period, group_fuel_by_vehicle
+
+pytestmark = pytest.mark.skipif(np is None, reason="NumPy no instalado")
+
+def make_records(count=500, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        fuel = rng.uniform(20, 80)
+        miles = fuel * rng.uniform(4, 12)
+        records.append({
+            "vehicle_id": f"veh-{rng.randrange(12)}",
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "fuel_amount": fuel,
+            "miles_driven": miles,
+            "total_cost": fuel * 1.1,
+            "consumption": round(miles / fuel, 2)
+        })
+    return records
+
+def assert_same(vectorized, python):
+    assert vectorized.count == python.count
+    for field in ("fuel", "miles", "cost", "consumption_sum", "min_consumption", "max_consumption"):
+        assert getattr(vectorized, field) == pytest.approx(getattr(python, field)), field
+
+def test_totals_match_python():
+    records = make_records()
+    assert_same(FuelColumns(records).totals(), aggregate_fuel(records))
+
+def test_by_vehicle_matches_python():
+    records = make_records()
+    vectorized = FuelColumns(records).by_vehicle()
+    python = group_fuel_by_vehicle(records)
+    assert vectorized.keys() == python.keys()
+    for vehicle_id in python:
+        assert_same(vectorized[vehicle_id], python[vehicle_id])
+
+@pytest.mark.parametrize("granularity", GRANULARITIES)
+def test_by_period_matches_python(granularity):
+    records = make_records()
+    vectorized = FuelColumns(records).by_period(granularity)
+    python = group_fuel_by_period(records, granularity)
+    assert vectorized.keys() == python.keys()
+    for key in python:
+        assert_same(vectorized[key], python[key])
+
+def test_weeks_start_on_monday():
+    # 2024-05-15 es miércoles
+    records = [{**make_records(1)[0], "date": "2024-05-15"}]
+    assert {start for _, start in FuelColumns(records).by_period("week")} == {"2024-05-13"}
+
+def python_engine(records):
+    engine = FuelAnalytics(records)
+    engine.columns = None
+    return engine
+
+def test_percentiles_match_python():
+    records = make_records()
+    columns, python = FuelColumns(records), python_engine(records)
+    assert columns.percentiles([10, 50, 90]) == pytest.approx(python.percentiles([10, 50, 90]))
+    vectorized = columns.percentiles([10, 50, 90], by_vehicle=True)
+    by_vehicle = python.percentiles([10, 50, 90], by_vehicle=True)
+    assert vectorized.keys() == by_vehicle.keys()
+    for vehicle_id in by_vehicle:
+        assert vectorized[vehicle_id] == pytest.approx(by_vehicle[vehicle_id])
+
+@pytest.mark.parametrize("field", ["cost", "fuel", "miles", "consumption"])
+def test_rolling_matches_python(field):
+    records = make_records()
+    vectorized = FuelColumns(records).rolling(30, field)
+    python = python_engine(records).rolling(30, field)
+    assert [day for day, _ in vectorized] == [day for day, _ in python]
+    assert [value for _, value in vectorized] == pytest.approx([value for _, value in python])
+
+def test_maintenance_costs_match_python(monkeypatch):
+    rng = random.Random(3)
+    records = [{"vehicle_id": f"veh-{rng.randrange(5)}", "cost": rng.uniform(50, 900)} for _ in range(200)]
+    python = maintenance_costs_by_vehicle(records)
+    monkeypatch.setattr(analytics_module, "VECTORIZE_MIN_ROWS", 1)
+    vectorized = maintenance_costs_by_vehicle(records)
+    assert vectorized.keys() == python.keys()
+    for vehicle_id in python:
+        assert vectorized[vehicle_id]["count"] == python[vehicle_id]["count"]
+        assert vectorized[vehicle_id]["cost"] == pytest.approx(python[vehicle_id]["cost"])
+
+def test_consumption_trends_is_the_same_with_and_without_numpy(monkeypatch):
+    records = make_records()
+    python = consumption_trends(records, "month", 7)
+    monkeypatch.setattr(analytics_module, "VECTORIZE_MIN_ROWS", 1)
+    vectorized = consumption_trends(records, "month", 7)
+    assert vectorized == python
+    assert [period["period"] for period in python["periods"]] == [f"2024-{month:02d}-01" for month in range(1, 13)]
+    assert sum(period["records"] for period in python["periods"]) == len(records)
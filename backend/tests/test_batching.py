@@ -0,0 +1,70 @@
+import asyncio
+from app.batching import BATCH_EVENT_TYPE, EventBatcher, entity_key, merge_events
+
+def event(event_type, entity_id="1", **data):
+    return {"type": event_type, "data": {"id": entity_id, **data}}
+
+def test_entity_key():
+    assert entity_key(event("INVENTORY_UPDATED", "a")) == ("INVENTORY", "a")
+    assert entity_key(event("FUEL_RECORD_DELETED", "b")) == ("FUEL_RECORD", "b")
+    assert entity_key({"type": "METRICS_UPDATED", "data": {"total": 1}}) is None
+    assert entity_key({"type": "ping"}) is None
+
+def test_merge_first_event_passes_through():
+    message = event("VEHICLE_UPDATED")
+    assert merge_events(None, message) is message
+
+def test_merge_created_then_deleted_cancels():
+    assert merge_events(event("VEHICLE_CREATED"), event("VEHICLE_DELETED")) is None
+
+def test_merge_updated_then_deleted_keeps_delete():
+    deleted = event("VEHICLE_DELETED")
+    assert merge_events(event("VEHICLE_UPDATED"), deleted) is deleted
+
+def test_merge_created_then_updated_stays_creation_with_latest_state():
+    merged = merge_events(event("VEHICLE_CREATED", status="active"), event("VEHICLE_UPDATED", status="maintenance"))
+    assert merged["type"] == "VEHICLE_CREATED"
+    assert merged["data"]["status"] == "maintenance"
+
+def test_merge_updates_keep_latest():
+    latest = event("VEHICLE_UPDATED", status="b")
+    assert merge_events(event("VEHICLE_UPDATED", status="a"), latest) is latest
+
+def test_batcher_collapses_window_into_one_frame():
+    published = []
+
+    async def publish(company_id, message):
+        published.append((company_id, message))
+
+    async def run():
+        batcher = EventBatcher(publish, window_ms=10)
+        await batcher.add("c", event("VEHICLE_UPDATED", "v1", status="a"))
+        await batcher.add("c", event("VEHICLE_CREATED", "v2"))
+        await batcher.add("c", event("VEHICLE_UPDATED", "v1", status="b"))
+        await batcher.add("c", event("VEHICLE_DELETED", "v2"))
+        await batcher.add("c", {"type": "ping"})
+        await asyncio.sleep(0.05)
+        return batcher
+
+    batcher = asyncio.run(run())
+    assert len(published) == 1
+    company_id, message = published[0]
+    assert company_id == "c" and message["type"] == BATCH_EVENT_TYPE
+    # v1 conserva su posición con el último estado; v2 se canceló
+    assert [e["type"] for e in message["events"]] == ["VEHICLE_UPDATED", "ping"]
+    assert message["events"][0]["data"]["status"] == "b"
+    assert batcher.stats()["events_in"] == 5
+
+def test_batcher_single_event_is_published_unwrapped():
+    published = []
+
+    async def publish(company_id, message):
+        published.append(message)
+
+    async def run():
+        batcher = EventBatcher(publish, window_ms=10)
+        await batcher.add("c", event("VEHICLE_UPDATED"))
+        await batcher.flush_all()
+
+    asyncio.run(run())
+    assert [message["type"] for message in published] == ["VEHICLE_UPDATED"]
@@ -0,0 +1,156 @@
+import pytest
+from app import consumption_sketches as sketches_module
+from app.consumption_sketches import FLEET_KEY, SKETCH_TABLE, ConsumptionSketches, sketch_id
+from app.models import database
+from app.sketches import TDigest
+
+class Result:
+    def __init__(self, data=None, error=None):
+        self.data = data
+        self.error = error
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters = []
+        self.method, self.payload = "GET", None
+        self.sort, self.page = None, None
+
+    def select(self, columns="*"):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column):
+        self.sort = column
+        return self
+
+    def range(self, start, end):
+        self.page = (start, end + 1)
+        return self
+
+    def insert(self, data):
+        self.method, self.payload = "INSERT", data
+        return self
+
+    def update(self, data):
+        self.method, self.payload = "UPDATE", data
+        return self
+
+    def execute(self):
+        rows = self.db.tables.setdefault(self.table, {})
+        if self.method == "INSERT":
+            if self.payload["id"] in rows:
+                return Result(error="HTTP 409: duplicate key")
+            rows[self.payload["id"]] = dict(self.payload)
+            return Result([dict(self.payload)])
+        matched = [row for row in rows.values() if all(check(row) for check in self.filters)]
+        if self.method == "UPDATE":
+            self.db.before_update(self.payload)
+            matched = [row for row in rows.values() if all(check(row) for check in self.filters)]
+            for row in matched:
+                row.update(self.payload)
+        if self.sort:
+            matched.sort(key=lambda row: row[self.sort])
+        if self.page:
+            self.db.pages.append((self.table, self.page[0]))
+            matched = matched[self.page[0]:self.page[1]]
+        return Result([dict(row) for row in matched])
+
+class FakeDB:
+    def __init__(self):
+        self.tables = {}
+        self.pages = []
+        self.before_update = lambda payload: None
+
+    def table(self, name):
+        return Query(self, name)
+
+def sketch_of(*values):
+    sketch = TDigest()
+    for value in values:
+        sketch.add(value)
+    return sketch.to_dict()
+
+def sketch_row(scope, key, values, model=None, version=1):
+    return {
+        "id": sketch_id("c", scope, key), "company_id": "c", "scope": scope, "key": key,
+        "model": model, "sample_count": len(values), "sketch": sketch_of(*values), "version": version
+    }
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB()
+    db.tables["vehicles"] = {"v1": {"id": "v1", "model": "A"}, "v2": {"id": "v2", "model": "B"}}
+    db.tables[SKETCH_TABLE] = {row["id"]: row for row in (
+        sketch_row("fleet", FLEET_KEY, [8, 9]),
+        sketch_row("model", "A", [8], model="A"),
+        sketch_row("model", "B", [9], model="B"),
+        sketch_row("vehicle", "v1", [8], model="A"),
+        sketch_row("vehicle", "v2", [9], model="B")
+    )}
+    monkeypatch.setattr(sketches_module, "get_db", lambda: db)
+    return db
+
+def stored(db, scope, key):
+    row = db.tables[SKETCH_TABLE][sketch_id("c", scope, key)]
+    return row, TDigest.from_dict(row["sketch"])
+
+def test_apply_add_updates_the_three_sketches_and_bumps_versions(db):
+    ConsumptionSketches().apply("c", "v1", added={"vehicle_id": "v1", "consumption": 10})
+    for scope, key, count in (("vehicle", "v1", 2), ("model", "A", 2), ("fleet", FLEET_KEY, 3)):
+        row, sketch = stored(db, scope, key)
+        assert sketch.count == count and row["version"] == 2
+
+def test_apply_retries_when_another_writer_got_there_first(db):
+    # Otro worker suma un valor a la flota entre la lectura y la escritura
+    def concurrent_add(payload):
+        row = db.tables[SKETCH_TABLE][sketch_id("c", "fleet", FLEET_KEY)]
+        if payload["scope"] == "fleet" and row["version"] == 1:
+            row.update(sketch=sketch_of(8, 9, 7), version=2)
+    db.before_update = concurrent_add
+
+    ConsumptionSketches().apply("c", "v1", added={"vehicle_id": "v1", "consumption": 10})
+    row, sketch = stored(db, "fleet", FLEET_KEY)
+    assert sketch.count == 4 and row["version"] == 3
+
+def test_apply_without_backfill_is_a_noop(db):
+    del db.tables[SKETCH_TABLE][sketch_id("c", "fleet", FLEET_KEY)]
+    ConsumptionSketches().apply("c", "v1", added={"vehicle_id": "v1", "consumption": 10})
+    assert stored(db, "vehicle", "v1")[1].count == 1
+
+def test_removal_only_diagnoses_and_repair_rebuilds(db):
+    engine = ConsumptionSketches()
+    engine.apply("c", "v1", removed={"vehicle_id": "v1", "consumption": 8})
+    assert stored(db, "vehicle", "v1")[1].count == 1
+
+    db.tables["fuel_records"] = {}
+    assert engine.schedule_repair("c", "v1")
+    assert not engine.schedule_repair("c", "v1")
+    engine.repair("c", "v1")
+    assert stored(db, "vehicle", "v1")[1].count == 0
+    assert stored(db, "model", "A")[1].count == 0
+    assert stored(db, "fleet", FLEET_KEY)[1].count == 1
+    assert engine.schedule_repair("c", "v1")
+
+def test_reassign_model_moves_the_vehicle_sketch(db):
+    ConsumptionSketches().reassign_model("c", "v1", "A", "B")
+    assert stored(db, "vehicle", "v1")[0]["model"] == "B"
+    assert stored(db, "model", "A")[1].count == 0
+    model_b = stored(db, "model", "B")[1]
+    assert model_b.count == 2 and model_b.min == 8
+
+def test_repair_reads_every_page_of_records(db, monkeypatch):
+    monkeypatch.setattr(database, "DB_PAGE_SIZE", 2)
+    db.tables["fuel_records"] = {
+        f"r{i}": {"id": f"r{i}", "company_id": "c", "vehicle_id": "v1", "consumption": 8 + i} for i in range(5)
+    }
+    ConsumptionSketches().repair("c", "v1")
+    assert stored(db, "vehicle", "v1")[1].count == 5
+    assert [start for table, start in db.pages if table == "fuel_records"] == [0, 2, 4]
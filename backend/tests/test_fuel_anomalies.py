@@ -0,0 +1,79 @@
+import random
+import pytest
+from app.analytics import np
+from app.fuel_anomalies import _scan_python, _scan_vectorized, fill_time
+
+VEHICLES = {
+    "v1": {"id": "v1", "tank_capacity": 100, "total_miles": 1000},
+    "v2": {"id": "v2", "tank_capacity": None, "total_miles": 0}
+}
+
+def fill(id, date, vehicle_id="v1", fuel=50.0, miles=100.0, price=3.0, created_at=None):
+    return {"id": id, "vehicle_id": vehicle_id, "date": date, "created_at": created_at,
+            "fuel_amount": fuel, "fuel_price": price, "miles_driven": miles}
+
+def scanners():
+    yield _scan_python
+    if np is not None:
+        yield _scan_vectorized
+
+def checks(scanner, records, check="duplicate_fill"):
+    return [(item["record_id"], item["detail"]) for item in scanner(records, VEHICLES, True) if item["check"] == check]
+
+def test_fill_time_ignores_created_at():
+    assert fill_time({"date": "2024-05-01T10:30:00Z", "created_at": "2024-05-02T08:00:00"}) == "2024-05-01T10:30:00"
+    assert fill_time({"date": "2024-05-01", "created_at": "2024-05-01T10:30:00"}) is None
+
+@pytest.mark.parametrize("scanner", list(scanners()))
+def test_duplicate_within_minutes_on_same_day(scanner):
+    records = [fill("a", "2024-05-01T10:00:00"), fill("b", "2024-05-01T10:05:00"), fill("c", "2024-05-01T12:00:00")]
+    assert checks(scanner, records) == [("b", {"previous_record_id": "a", "minutes_apart": 5.0})]
+
+@pytest.mark.parametrize("scanner", list(scanners()))
+def test_date_only_fills_are_not_timed_by_created_at(scanner):
+    # Cargadas el mismo día y registradas juntas, pero con litros distintos
+    records = [
+        fill("a", "2024-05-01", fuel=40, created_at="2024-05-03T09:00:00"),
+        fill("b", "2024-05-01", fuel=55, created_at="2024-05-03T09:01:00")
+    ]
+    assert checks(scanner, records) == []
+
+@pytest.mark.parametrize("scanner", list(scanners()))
+def test_date_only_same_day_same_amount_is_duplicate(scanner):
+    records = [
+        fill("b", "2024-05-01", created_at="2024-05-03T09:01:00"),
+        fill("a", "2024-05-01", created_at="2024-05-03T09:00:00"),
+        fill("c", "2024-05-02", created_at="2024-05-03T09:02:00")
+    ]
+    assert checks(scanner, records) == [("b", {"previous_record_id": "a", "minutes_apart": None})]
+
+@pytest.mark.parametrize("scanner", list(scanners()))
+def test_odometer_flags_the_fill_that_crosses(scanner):
+    records = [fill(str(i), f"2024-05-{i + 1:02d}", miles=300) for i in range(5)]
+    assert checks(scanner, records, "odometer_mismatch") == [("3", {"declared_miles": 1200.0, "odometer_miles": 1000})]
+
+@pytest.mark.parametrize("scanner", list(scanners()))
+def test_over_capacity_and_price_deviation(scanner):
+    records = [
+        fill("a", "2024-05-01", fuel=120, miles=1),
+        fill("b", "2024-05-01", vehicle_id="v2", fuel=500, miles=1, price=3.1),
+        fill("c", "2024-05-01", vehicle_id="v2", fuel=20, miles=1, price=9.0)
+    ]
+    assert [id for id, _ in checks(scanner, records, "over_capacity")] == ["a"]
+    assert [id for id, _ in checks(scanner, records, "price_deviation")] == ["c"]
+
+@pytest.mark.skipif(np is None, reason="NumPy no instalado")
+def test_vectorized_matches_python():
+    rng = random.Random(3)
+    records = []
+    for i in range(3000):
+        day = f"2024-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}"
+        date = day if rng.random() < 0.5 else f"{day}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+        records.append(fill(
+            str(i), date, vehicle_id=rng.choice(["v1", "v2", "v3"]), fuel=float(rng.choice([40, 60, 110])),
+            miles=rng.uniform(0, 5), price=rng.uniform(2.5, 4.5), created_at=f"2024-04-01T00:00:{i % 60:02d}"
+        ))
+    key = lambda item: (item["check"], item["record_id"] or "", str(item["detail"]))
+    python = sorted(_scan_python(records, VEHICLES, True), key=key)
+    vectorized = sorted(_scan_vectorized(records, VEHICLES, True), key=key)
+    assert python == vectorized
@@ -0,0 +1,83 @@
+import io
+from datetime import date
+import pytest
+from app import fuel_reconcile as reconcile_module
+from app.fuel_reconcile import RecordIndex, StatementError, parse_amount, parse_date, reconcile_statement, tied_candidates
+
+@pytest.mark.parametrize("value, expected", [
+    ("12.5", 12.5),
+    ("12,5", 12.5),
+    ("0,500", 0.5),
+    ("1,234", 1234),
+    ("12,345,678", 12345678),
+    ("1,234.56", 1234.56),
+    ("1.234,56", 1234.56),
+    ("1.234.567", 1234567),
+    (" 1 234,5 ", 1234.5),
+    ("1,23", 1.23)
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == pytest.approx(expected)
+
+def test_parse_date_formats():
+    assert parse_date("2024-05-01T10:00:00") == date(2024, 5, 1)
+    assert parse_date("01/05/2024") == date(2024, 5, 1)
+    with pytest.raises(ValueError):
+        parse_date("mayo")
+
+def record(id, day, amount, vehicle_id="v1"):
+    return {"id": id, "vehicle_id": vehicle_id, "date": day, "fuel_amount": amount}
+
+def test_candidates_closest_first_and_skip_claimed():
+    index = RecordIndex([
+        record("far", "2024-05-02", 50.0),
+        record("near", "2024-05-01", 50.3),
+        record("out", "2024-05-01", 51.0)
+    ], "fuel_amount", 0.5)
+    found = [candidate[2]["id"] for candidate in index.candidates("v1", date(2024, 5, 1), 50.0, 1)]
+    assert found == ["near", "far"]
+
+    index.claimed.add("near")
+    assert [candidate[2]["id"] for candidate in index.candidates("v1", date(2024, 5, 1), 50.0, 1)] == ["far"]
+
+def test_tied_candidates_tolerates_float_noise():
+    a, b, c = record("a", "2024-05-01", 0), record("b", "2024-05-01", 0), record("c", "2024-05-01", 0)
+    assert tied_candidates([(0, 0.1, a), (0, 0.1 + 1e-9, b), (0, 0.4, c)]) == [a, b]
+    assert tied_candidates([(0, 0.1, a), (1, 0.1, b)]) == [a]
+    assert tied_candidates([]) == []
+
+@pytest.fixture
+def company(monkeypatch):
+    records = [
+        record("r1", "2024-05-01", 40.0),
+        record("r2", "2024-05-03", 55.0),
+        record("r3", "2024-05-03", 55.0),
+        record("r4", "2024-05-04", 30.0)
+    ]
+    monkeypatch.setattr(reconcile_module, "fetch_fuel_records", lambda company_id, window, columns: records)
+    monkeypatch.setattr(reconcile_module, "_vehicle_lookup", lambda company_id: {"v1": "v1", "unit-1": "v1"})
+
+def statement(text):
+    return io.BytesIO(text.encode("utf-8"))
+
+def test_reconcile_statement(company):
+    result = reconcile_statement("c", statement(
+        "unidad;fecha;litros\n"
+        "UNIT-1;01/05/2024;40,2\n"
+        "unit-1;03/05/2024;55\n"
+        "unit-9;03/05/2024;10\n"
+        "unit-1;mayo;10\n"
+    ))
+    assert result["statement"]["matched_on"] == "fuel_amount"
+    assert result["summary"] == {
+        "matched": 1, "ambiguous": 1, "unmatched_statement": 1, "unmatched_records": 2, "invalid": 1
+    }
+    assert result["matched"][0]["record_id"] == "r1"
+    assert sorted(result["ambiguous"][0]["candidates"]) == ["r2", "r3"]
+    assert result["unmatched_statement"][0]["reason"] == "unknown_vehicle"
+    # r4 está en el margen de tolerancia, fuera del periodo del extracto
+    assert sorted(item["record_id"] for item in result["unmatched_records"]) == ["r2", "r3"]
+
+def test_reconcile_statement_missing_columns():
+    with pytest.raises(StatementError):
+        reconcile_statement("c", statement("vehicle,amount\nv1,10\n"))
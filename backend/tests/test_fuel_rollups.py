@@ -0,0 +1,152 @@
+import pytest
+from app import fuel_rollups as rollups_module
+from app.models import database
+from app.fuel_rollups import CHANGE_RPC, FuelRollups, period_deltas, record_delta
+
+RECORD = {"date": "2024-05-15", "fuel_amount": 10.0, "miles_driven": 80.0, "total_cost": 40.0, "consumption": 8.0}
+
+def test_record_delta_added():
+    assert record_delta(added=RECORD) == {
+        "d_count": 1, "d_fuel": 10.0, "d_miles": 80.0, "d_cost": 40.0,
+        "d_consumption_sum": 8.0, "p_consumption": 8.0
+    }
+
+def test_record_delta_removed_does_not_extend_extremes():
+    delta = record_delta(removed=RECORD)
+    assert delta["d_count"] == -1 and delta["d_miles"] == -80.0
+    assert delta["p_consumption"] is None
+
+def test_record_delta_edit_is_the_difference():
+    edited = {**RECORD, "miles_driven": 100.0, "consumption": 10.0}
+    delta = record_delta(added=edited, removed=RECORD)
+    assert delta["d_count"] == 0
+    assert delta["d_miles"] == pytest.approx(20.0)
+    assert delta["d_consumption_sum"] == pytest.approx(2.0)
+    assert delta["p_consumption"] == 10.0
+
+def test_record_delta_treats_missing_fields_as_zero():
+    delta = record_delta(added={"date": "2024-05-15"})
+    assert delta["d_count"] == 1 and delta["d_fuel"] == 0 and delta["p_consumption"] is None
+
+def test_period_deltas_same_day_edit_is_one_delta():
+    edited = {**RECORD, "miles_driven": 100.0}
+    [delta] = period_deltas(added=edited, removed=RECORD)
+    assert delta["p_day"] == "2024-05-15" and delta["d_count"] == 0
+    assert delta["d_miles"] == pytest.approx(20.0) and "p_consumption" not in delta
+
+def test_period_deltas_edit_changing_day_is_two_deltas():
+    deltas = period_deltas(added={**RECORD, "date": "2024-05-16"}, removed=RECORD)
+    assert [(d["p_day"], d["d_count"]) for d in deltas] == [("2024-05-15", -1), ("2024-05-16", 1)]
+
+class Result:
+    def __init__(self, data=None, error=None):
+        self.data = data
+        self.error = error
+
+class FakeDB:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        return type("Query", (), {"execute": lambda _: Result([], self.error)})()
+
+    def table(self, name):
+        db = self
+
+        class Query:
+            def delete(self):
+                db.calls.append(("delete", name))
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def execute(self):
+                return Result([])
+
+        return Query()
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(error=None):
+        db = FakeDB(error)
+        monkeypatch.setattr(rollups_module, "get_db", lambda: db)
+        return db
+    return install
+
+def test_apply_is_a_single_rpc(fake_db):
+    db = fake_db()
+    FuelRollups().apply("c", "v", added={**RECORD, "date": "2024-05-16"}, removed=RECORD)
+    [(name, params)] = db.calls
+    assert name == CHANGE_RPC
+    assert params["d_count"] == 0 and len(params["p_periods"]) == 2
+    assert params["p_removed_consumption"] == 8.0
+
+def test_apply_add_does_not_ask_for_extremes_refresh(fake_db):
+    db = fake_db()
+    FuelRollups().apply("c", "v", added=RECORD)
+    assert db.calls[0][1]["p_removed_consumption"] is None
+
+def test_apply_error_invalidates_the_company(fake_db):
+    db = fake_db(error="RPC HTTP 500")
+    FuelRollups().apply("c", "v", removed=RECORD)
+    assert [name for name, _ in db.calls] == [CHANGE_RPC, "delete"]
+
+class PagedDB:
+    """Tabla fuel_rollups en memoria que, como PostgREST, respeta offset/limit"""
+    def __init__(self, rows, after_rebuild=None):
+        self.rows = rows
+        self.after_rebuild = after_rebuild
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        if name == rollups_module.REBUILD_RPC and self.after_rebuild is not None:
+            self.rows = self.after_rebuild
+        return type("Query", (), {"execute": lambda _: Result([])})()
+
+    def table(self, name):
+        db = self
+
+        class Query:
+            def select(self, columns="*"):
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def order(self, column):
+                return self
+
+            def range(self, start, end):
+                db.calls.append(("range", start))
+                self.page = db.rows[start:end + 1]
+                return self
+
+            def execute(self):
+                return Result(list(self.page))
+
+        return Query()
+
+def rollup_row(vehicle_id=None, count=1):
+    return {"vehicle_id": vehicle_id, "record_count": count, "miles_driven": 10.0 * count}
+
+def test_get_company_reads_every_page(monkeypatch):
+    rows = [rollup_row()] + [rollup_row(f"v{i}") for i in range(5)]
+    db = PagedDB(rows)
+    monkeypatch.setattr(rollups_module, "get_db", lambda: db)
+    monkeypatch.setattr(database, "DB_PAGE_SIZE", 2)
+
+    totals, groups = FuelRollups().get_company("c")
+    assert totals.count == 1 and len(groups) == 5
+    assert [start for name, start in db.calls if name == "range"] == [0, 2, 4, 6]
+
+def test_missing_company_row_is_rebuilt_in_the_database(monkeypatch):
+    db = PagedDB([], after_rebuild=[rollup_row(count=3), rollup_row("v1", count=3)])
+    monkeypatch.setattr(rollups_module, "get_db", lambda: db)
+
+    totals, groups = FuelRollups().get_company("c")
+    assert totals.count == 3 and groups["v1"].miles == 30.0
+    assert (rollups_module.REBUILD_RPC, {"p_company_id": "c"}) in db.calls
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from app.auth import license_manager as license_module
+from app.auth.license_manager import CompanyManager, CompanyStatusCache
+
+class Result:
+    def __init__(self, data):
+        self.data, self.error = data, None
+
+class FakeDB:
+    def __init__(self, status):
+        self.status = status
+        self.reads = []
+        self.on_read = lambda: None
+
+    def table(self, name):
+        db = self
+
+        class Query:
+            def select(self, columns="*"):
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def execute(self):
+                db.reads.append(threading.current_thread())
+                db.on_read()
+                return Result([{"status": db.status}])
+
+        return Query()
+
+class FakeManager:
+    def __init__(self):
+        self.listeners = []
+        self.watched = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def watch_company(self, company_id):
+        self.watched.append(company_id)
+        return True
+
+@pytest.fixture
+def setup(monkeypatch):
+    db = FakeDB("active")
+    monkeypatch.setattr(license_module, "get_db", lambda: db)
+    manager = FakeManager()
+    cache = CompanyStatusCache()
+    cache.attach(manager)
+    return db, manager, CompanyManager(cache)
+
+USER = {"role": "company_admin", "company_id": "c"}
+
+def test_async_miss_reads_off_the_event_loop(setup):
+    db, manager, companies = setup
+
+    async def run():
+        await companies.check_user_company_async(USER)
+        await companies.check_user_company_async(USER)
+
+    asyncio.run(run())
+    assert len(db.reads) == 1 and db.reads[0] is not threading.main_thread()
+    assert manager.watched == ["c"]
+
+def test_event_from_another_worker_invalidates(setup):
+    db, manager, companies = setup
+    assert companies.check_user_company(USER)
+
+    db.status = "suspended"
+    for listener in manager.listeners:
+        listener("c", {"type": "BATCH", "events": [{"type": "COMPANY_UPDATED", "data": {"id": "c"}}]}, False)
+    with pytest.raises(HTTPException) as error:
+        companies.check_user_company(USER)
+    assert error.value.status_code == 403
+
+def test_invalidation_during_read_is_not_cached(setup):
+    db, manager, companies = setup
+    # El estado cambia mientras se lee la versión vieja
+    db.on_read = lambda: companies.cache.invalidate("c")
+    companies.get_company_status("c")
+    db.on_read = lambda: None
+    assert len(db.reads) == 1
+    companies.get_company_status("c")
+    assert len(db.reads) == 2
@@ -0,0 +1,114 @@
+import asyncio
+from app import live_metrics as live_metrics_module
+from app.fuel_stats import FuelAggregate
+from app.live_metrics import METRICS_EVENT_TYPE, LiveMetrics
+
+class FakeManager:
+    def __init__(self, connected=()):
+        self.active_connections = {company_id: {"socket": object()} for company_id in connected}
+        self.pushed = []
+
+    def add_listener(self, callback):
+        pass
+
+    async def broadcast_to_company(self, message, company_id):
+        self.pushed.append((company_id, message["type"]))
+
+def live(manager, interval=0.05):
+    calls = []
+
+    def compute(company_id):
+        calls.append(company_id)
+        return {"computation": len(calls)}
+
+    metrics = LiveMetrics(compute=compute, interval_seconds=interval, ttl_seconds=60)
+    metrics.attach(manager)
+    return metrics, calls
+
+FUEL_EVENT = {"type": "FUEL_RECORD_CREATED", "data": {"id": "f1"}}
+
+def test_no_listeners_skips_recompute_and_invalidates():
+    async def run():
+        metrics, calls = live(FakeManager())
+        metrics._cache["c"] = ({"stale": True}, 0)
+        metrics.on_event("c", FUEL_EVENT, True)
+        await asyncio.sleep(0.1)
+        assert calls == [] and "c" not in metrics._cache
+        assert metrics.stats()["skipped_recomputes"] == 1
+        # GET /metrics/ calcula al leer
+        assert await metrics.get("c") == {"computation": 1}
+
+    asyncio.run(run())
+
+def test_local_event_with_listeners_recomputes_and_pushes_once():
+    async def run():
+        manager = FakeManager(["c"])
+        metrics, calls = live(manager)
+        for _ in range(3):
+            metrics.on_event("c", FUEL_EVENT, True)
+        await asyncio.sleep(0.1)
+        assert calls == ["c"]
+        assert manager.pushed == [("c", METRICS_EVENT_TYPE)]
+
+    asyncio.run(run())
+
+def test_remote_event_without_push_falls_back_after_interval():
+    async def run():
+        manager = FakeManager(["c"])
+        metrics, calls = live(manager)
+        metrics.on_event("c", FUEL_EVENT, False)
+        await asyncio.sleep(0.02)
+        assert calls == []
+        await asyncio.sleep(0.1)
+        assert calls == ["c"] and manager.pushed == [("c", METRICS_EVENT_TYPE)]
+
+    asyncio.run(run())
+
+def test_remote_push_cancels_fallback():
+    async def run():
+        manager = FakeManager(["c"])
+        metrics, calls = live(manager)
+        metrics.on_event("c", {"type": "BATCH", "events": [
+            FUEL_EVENT,
+            {"type": METRICS_EVENT_TYPE, "data": {"computation": "remote"}}
+        ]}, False)
+        await asyncio.sleep(0.1)
+        assert calls == [] and manager.pushed == []
+        assert await metrics.get("c") == {"computation": "remote"}
+
+    asyncio.run(run())
+
+def test_get_passes_prefetched_data_on_a_miss():
+    async def run():
+        received = []
+        metrics = LiveMetrics(compute=lambda company_id, **prefetched: received.append(prefetched) or {"ok": True})
+        assert await metrics.get("c", vehicles=[], upcoming=[]) == {"ok": True}
+        assert received == [{"vehicles": [], "upcoming": []}]
+        # Con cache vigente no se calcula de nuevo
+        await metrics.get("c", vehicles=[])
+        assert len(received) == 1
+
+    asyncio.run(run())
+
+def test_compute_reuses_prefetched_queries(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("query repeated")
+
+    class DB:
+        def table(self, name):
+            fail()
+
+    monkeypatch.setattr(live_metrics_module, "get_db", lambda: DB())
+    monkeypatch.setattr(live_metrics_module.fuel_rollups, "get_company", fail)
+    monkeypatch.setattr(live_metrics_module.fuel_rollups, "periods", lambda *args: [])
+    monkeypatch.setattr(live_metrics_module.maintenance_schedule, "upcoming", fail)
+    monkeypatch.setattr(live_metrics_module, "performance_thresholds", lambda company_id: (6.0, 5.0))
+
+    aggregate = FuelAggregate()
+    aggregate.add({"fuel_amount": 10, "miles_driven": 40, "total_cost": 30, "consumption": 4.0})
+    groups = {"v1": aggregate}
+    metrics = live_metrics_module.compute_company_metrics(
+        "c", vehicles=[{"id": "v1", "unit_id": "U1"}], rollups=(groups["v1"], groups), upcoming=[{"id": "m1"}]
+    )
+    assert metrics["upcoming_maintenance"] == [{"id": "m1"}]
+    assert metrics["low_performance_vehicles"] == [{"unit_id": "U1", "consumption": 4.0, "status": "critical"}]
@@ -0,0 +1,76 @@
+from datetime import date
+from app import maintenance_planner as planner_module
+from app.maintenance_planner import PLAN_TABLE, MaintenancePlanner, project
+
+TODAY = date(2024, 6, 1)
+PLAN = {"id": "p1", "maintenance_type": "oil", "interval_miles": 5000, "interval_days": 180}
+VEHICLE = {"id": "v1", "unit_id": "U1", "model": "A", "total_miles": 12000, "created_at": "2024-01-01"}
+
+def test_project_by_miles_when_the_pace_comes_first():
+    entry = project(PLAN, VEHICLE, "2024-05-01", 4000, 100, TODAY)
+    assert entry["due_date"] == "2024-06-11" and entry["trigger"] == "miles"
+    assert entry["miles_remaining"] == 1000
+
+def test_project_by_days_and_odometer_without_service():
+    entry = project(PLAN, VEHICLE, None, 0, 0, TODAY)
+    # Sin servicio: 12000 % 5000 = 2000 usadas, sin ritmo no hay fecha por millas
+    assert entry["miles_since_service"] == 2000
+    assert entry["due_date"] == "2024-06-29" and entry["trigger"] == "days"
+
+class Result:
+    def __init__(self, data):
+        self.data, self.error = data, None
+
+class FakeDB:
+    TABLES = {PLAN_TABLE: [PLAN], "vehicles": [VEHICLE], "maintenance": []}
+
+    def table(self, name):
+        rows = self.TABLES[name]
+
+        class Query:
+            def select(self, columns="*"):
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def execute(self):
+                return Result(list(rows))
+
+        return Query()
+
+class FakeManager:
+    def __init__(self, watched):
+        self.watched = watched
+        self.calls = []
+
+    def add_listener(self, callback):
+        pass
+
+    def watch_company(self, company_id):
+        self.calls.append(company_id)
+        return self.watched
+
+def load(monkeypatch, watched):
+    monkeypatch.setattr(planner_module, "get_db", lambda: FakeDB())
+    monkeypatch.setattr(planner_module.fuel_rollups, "daily_miles", lambda *args: {})
+    planner = MaintenancePlanner()
+    manager = FakeManager(watched)
+    planner.attach(manager)
+    planner.due("c", 30)
+    assert manager.calls == ["c"]
+    return planner
+
+FUEL = {"type": "FUEL_RECORD_CREATED", "data": {"vehicle_id": "v1", "date": date.today().isoformat(), "miles_driven": 300}}
+
+def test_watched_planner_counts_own_event_once(monkeypatch):
+    planner = load(monkeypatch, watched=True)
+    # El evento propio llega local y luego como eco del pub/sub
+    planner.on_event("c", FUEL, True)
+    planner.on_event("c", FUEL, False)
+    assert planner._companies["c"].daily["v1"] == {FUEL["data"]["date"]: 300}
+
+def test_unwatched_planner_applies_local_events(monkeypatch):
+    planner = load(monkeypatch, watched=False)
+    planner.on_event("c", FUEL, True)
+    assert planner._companies["c"].daily["v1"] == {FUEL["data"]["date"]: 300}
@@ -0,0 +1,97 @@
+import asyncio
+from app import maintenance_schedule as schedule_module
+from app.maintenance_schedule import CompanySchedule, MaintenanceSchedule
+from app.manager import ConnectionManager
+from app.pubsub import PubSubBackend, company_channel
+
+def maintenance(id, due, status="scheduled", vehicle_id="v1"):
+    return {"id": id, "vehicle_id": vehicle_id, "next_maintenance_date": due, "status": status}
+
+def ids(records):
+    return [record["id"] for record in records]
+
+def test_between_is_inclusive_and_ordered_by_date():
+    schedule = CompanySchedule([
+        maintenance("b", "2024-05-10"),
+        maintenance("a", "2024-05-01T08:00:00"),
+        maintenance("c", "2024-05-20"),
+        maintenance("old", "2024-04-01")
+    ])
+    assert ids(schedule.between("2024-05-01", "2024-05-10")) == ["a", "b"]
+    # Sin inicio también entran los atrasados
+    assert ids(schedule.between(None, "2024-05-01")) == ["old", "a"]
+    assert schedule.between("2024-06-01", "2024-06-30") == []
+
+def test_put_moves_and_remove_drops():
+    schedule = CompanySchedule([maintenance("a", "2024-05-01"), maintenance("b", "2024-05-02")])
+    schedule.put(maintenance("a", "2024-05-03"))
+    assert ids(schedule.between(None, "2024-12-31")) == ["b", "a"]
+    schedule.remove("b")
+    schedule.remove("missing")
+    assert ids(schedule.between(None, "2024-12-31")) == ["a"]
+
+def test_inactive_and_undated_records_are_not_indexed():
+    schedule = CompanySchedule([
+        maintenance("a", "2024-05-01", status="cancelled"),
+        maintenance("b", None),
+        maintenance("c", "2024-05-01")
+    ])
+    assert ids(schedule.between(None, "2024-12-31")) == ["c"]
+    # Cancelar un registro indexado lo saca del índice
+    schedule.put(maintenance("c", "2024-05-01", status="cancelled"))
+    assert schedule.between(None, "2024-12-31") == []
+
+def test_custom_due_function():
+    schedule = CompanySchedule([{"id": "p", "due": "2024-05-05"}], due=lambda record: record.get("due"))
+    assert ids(schedule.between("2024-05-05", "2024-05-05")) == ["p"]
+
+class Result:
+    def __init__(self, data):
+        self.data, self.error = data, None
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        rows = self.rows
+
+        class Query:
+            def select(self, columns="*"):
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def execute(self):
+                return Result(list(rows))
+
+        return Query()
+
+def test_worker_without_sockets_receives_other_workers_changes(monkeypatch):
+    monkeypatch.setattr(schedule_module, "get_db", lambda: FakeDB([maintenance("a", "2099-01-01")]))
+
+    async def run():
+        manager = ConnectionManager(pubsub=PubSubBackend())
+        schedule = MaintenanceSchedule()
+        schedule.attach(manager)
+        await manager.start()
+        try:
+            # Sin WebSockets de la empresa: la carga suscribe el worker al canal
+            loaded = await asyncio.to_thread(schedule._schedule, "c")
+            assert company_channel("c") in manager.pubsub._channels
+            assert ids(loaded.between(None, "2099-12-31")) == ["a"]
+
+            # Cambio publicado por otro worker
+            await manager.pubsub._on_remote(company_channel("c"), {
+                "type": "MAINTENANCE_UPDATED",
+                "data": maintenance("a", "2099-02-01")
+            })
+            assert ids(loaded.between("2099-02-01", "2099-02-01")) == ["a"]
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
+
+def test_watch_company_without_loop_is_not_guaranteed():
+    assert ConnectionManager(pubsub=PubSubBackend()).watch_company("c") is False
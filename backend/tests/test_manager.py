@@ -0,0 +1,42 @@
+import asyncio
+from app import manager as manager_module
+from app.manager import ConnectionManager
+from app.pubsub import PubSubBackend
+
+class FakeWebSocket:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+        self.scope = {}
+        self.query_params = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise ConnectionError("gone")
+        self.sent.append(text)
+
+    async def close(self):
+        pass
+
+def test_listen_only_client_survives_heartbeat(monkeypatch):
+    monkeypatch.setattr(manager_module, "WS_HEARTBEAT_INTERVAL_SECONDS", 0.02)
+    monkeypatch.setattr(manager_module, "WS_IDLE_TIMEOUT_SECONDS", 0.15)
+
+    async def run():
+        manager = ConnectionManager(pubsub=PubSubBackend())
+        await manager.start()
+        try:
+            # Nunca envía mensajes ni responde al ping: los envíos completados bastan
+            listener = await manager.connect(FakeWebSocket(), "c")
+            broken = await manager.connect(FakeWebSocket(fail=True), "c")
+            await asyncio.sleep(0.5)
+            assert listener.id in manager.active_connections["c"]
+            assert broken.id not in manager.active_connections["c"]
+            assert any('"ping"' in text for text in listener.websocket.sent)
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
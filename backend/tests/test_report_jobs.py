@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import pytest
+from app import report_jobs as jobs_module
+from app.report_jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobQueueFull, ReportJob, ReportJobQueue
+
+class FakeManager:
+    def __init__(self):
+        self.events = []
+
+    async def broadcast_to_company(self, message, company_id):
+        self.events.append((company_id, message["data"]["status"]))
+
+@pytest.fixture
+def report(monkeypatch):
+    """Reporte que corre hasta que el test lo libera"""
+    release = threading.Event()
+
+    def slow(company_id, params):
+        release.wait(5)
+        return {"company_id": company_id, **params}
+
+    monkeypatch.setitem(jobs_module.REPORTS, "slow", slow)
+    return release
+
+def queue(store_dir, **limits):
+    jobs = ReportJobQueue(workers=1, store_dir=store_dir, **limits)
+    jobs.attach(FakeManager())
+    return jobs
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+def test_other_worker_sees_dedupes_and_reads_result(tmp_path, report):
+    async def run():
+        worker_a, worker_b = queue(str(tmp_path)), queue(str(tmp_path))
+        await worker_a.start()
+        await worker_b.start()
+        try:
+            # Las rutas llaman a la cola desde un thread (asyncio.to_thread)
+            job, created = await asyncio.to_thread(worker_a.submit, "c", "u", "slow", {"month": "2024-05"})
+            assert created
+            # Persistido al encolar: el otro worker lo ve y lo reutiliza
+            assert worker_b.get(job.id, "c").status in (QUEUED, RUNNING)
+            assert worker_b.get(job.id, "other") is None
+            same, created = worker_b.submit("c", "u", "slow", {"month": "2024-05"})
+            assert same.id == job.id and not created
+            assert [listed.id for listed in worker_b.list("c")] == [job.id]
+
+            report.set()
+            await wait_for(lambda: worker_b.get(job.id, "c").status == DONE)
+            # Estado y listado sin el resultado; el resultado solo si se pide
+            assert worker_b.get(job.id, "c").result is None
+            assert worker_b.list("c")[0].result is None
+            assert worker_b.get(job.id, "c", include_result=True).result == {"company_id": "c", "month": "2024-05"}
+            assert worker_a.manager.events == [("c", DONE)]
+        finally:
+            report.set()
+            await worker_a.stop()
+            await worker_b.stop()
+
+    asyncio.run(run())
+
+def test_cancel_from_other_worker_discards_result(tmp_path, report):
+    async def run():
+        worker_a, worker_b = queue(str(tmp_path)), queue(str(tmp_path))
+        await worker_a.start()
+        try:
+            job, _ = worker_a.submit("c", "u", "slow", {})
+            await wait_for(lambda: worker_b.get(job.id, "c").status == RUNNING)
+            assert worker_b.cancel(job.id, "c").status == CANCELLED
+
+            report.set()
+            await wait_for(lambda: not worker_a._admitted)
+            assert job.status == CANCELLED and job.result is None
+            assert worker_b.get(job.id, "c").status == CANCELLED
+            assert worker_a.manager.events == []
+            # Cancelado: un pedido igual crea otro job
+            assert worker_b._existing(job.key) is None
+        finally:
+            report.set()
+            await worker_a.stop()
+
+    asyncio.run(run())
+
+def test_queued_job_cancelled_elsewhere_never_runs(tmp_path, report, monkeypatch):
+    runs = []
+    monkeypatch.setitem(jobs_module.REPORTS, "fast", lambda company_id, params: runs.append(params) or {})
+
+    async def run():
+        worker_a, worker_b = queue(str(tmp_path)), queue(str(tmp_path))
+        await worker_a.start()
+        try:
+            # Con un cupo por empresa, el segundo espera detrás del primero
+            first, _ = worker_a.submit("c", "u", "slow", {})
+            second, _ = worker_a.submit("c", "u", "fast", {})
+            assert worker_b.cancel(second.id, "c").status == CANCELLED
+
+            report.set()
+            await wait_for(lambda: not worker_a._admitted)
+            assert runs == []
+            assert worker_b.get(first.id, "c").status == DONE
+        finally:
+            report.set()
+            await worker_a.stop()
+
+    asyncio.run(run())
+
+def test_company_limits_count_every_worker(tmp_path, report, monkeypatch):
+    monkeypatch.setattr(jobs_module, "REPORT_JOB_BUSY_RETRY_SECONDS", 0.02)
+    runs = []
+    monkeypatch.setitem(jobs_module.REPORTS, "fast", lambda company_id, params: runs.append(params) or {})
+
+    async def run():
+        worker_a, worker_b = queue(str(tmp_path), max_pending_per_company=2), queue(str(tmp_path), max_pending_per_company=2)
+        await worker_a.start()
+        await worker_b.start()
+        try:
+            slow, _ = worker_a.submit("c", "u", "slow", {})
+            await wait_for(lambda: worker_b.get(slow.id, "c").status == RUNNING)
+            # Un solo job corriendo por empresa entre los dos workers
+            fast, _ = worker_b.submit("c", "u", "fast", {})
+            with pytest.raises(JobQueueFull):
+                worker_a.submit("c", "u", "fast", {"other": True})
+            await asyncio.sleep(0.1)
+            assert runs == [] and worker_b.get(fast.id, "c").status == QUEUED
+
+            report.set()
+            await wait_for(lambda: worker_a.get(fast.id, "c").status == DONE)
+            assert runs == [{}]
+        finally:
+            report.set()
+            await worker_a.stop()
+            await worker_b.stop()
+
+    asyncio.run(run())
+
+def test_load_fails_jobs_of_dead_workers(tmp_path):
+    jobs = queue(str(tmp_path))
+    orphan = ReportJob("c", "u", "slow", {})
+    orphan.owner = None
+    jobs._save(orphan)
+    jobs._save_key(orphan)
+
+    jobs._load()
+    stored = jobs.get(orphan.id, "c")
+    assert stored.status == FAILED and stored.error
+    assert jobs._read_key(orphan.key) is None
+
+def test_without_store_single_worker(monkeypatch):
+    monkeypatch.setitem(jobs_module.REPORTS, "fast", lambda company_id, params: {"ok": True})
+
+    async def run():
+        jobs = queue(None)
+        await jobs.start()
+        try:
+            job, _ = jobs.submit("c", "u", "fast", {})
+            await wait_for(lambda: jobs.get(job.id, "c").status == DONE)
+            assert jobs.get(job.id, "c", include_result=True).result == {"ok": True}
+        finally:
+            await jobs.stop()
+
+    asyncio.run(run())
+
+def test_job_ids_are_validated():
+    assert queue("/tmp").get("../../etc/passwd", "c") is None
@@ -0,0 +1,105 @@
+import pytest
+from app import tco as tco_module
+from app.tco import FUEL, MAINTENANCE, TCOEngine, compute_tco, merge_costs
+
+def fuel(id, vehicle_id, day, cost, miles):
+    return {"id": id, "vehicle_id": vehicle_id, "date": day, "total_cost": cost, "miles_driven": miles}
+
+def service(id, vehicle_id, day, cost, status="completed"):
+    return {"id": id, "vehicle_id": vehicle_id, "date": day, "cost": cost, "status": status}
+
+FUEL_ROWS = [
+    fuel("f1", "v1", "2024-01-05", 100, 400),
+    fuel("f2", "v1", "2024-02-01T10:00:00", 50, 200),
+    fuel("f3", "v2", "2024-01-10", 80, 100),
+    fuel("f4", "v2", None, 999, 999)
+]
+MAINTENANCE_ROWS = [
+    service("m1", "v1", "2024-01-05", 300),
+    service("m2", "v1", "2024-01-20", 1000, status="cancelled"),
+    service("m3", "v3", "2024-03-01", 200)
+]
+
+def test_merge_costs_orders_by_vehicle_day_and_kind():
+    merged = [(vehicle_id, day, kind, row["id"]) for vehicle_id, day, kind, row in merge_costs(iter(FUEL_ROWS), iter(MAINTENANCE_ROWS))]
+    assert merged == [
+        ("v1", "2024-01-05", FUEL, "f1"),
+        ("v1", "2024-01-05", MAINTENANCE, "m1"),
+        ("v1", "2024-02-01", FUEL, "f2"),
+        ("v2", "2024-01-10", FUEL, "f3"),
+        ("v3", "2024-03-01", MAINTENANCE, "m3")
+    ]
+
+@pytest.fixture
+def company(monkeypatch):
+    class Result:
+        data = [{"id": "v1", "unit_id": "U1", "model": "A"}, {"id": "v2", "unit_id": "U2", "model": "A"}]
+        error = None
+
+    class DB:
+        def table(self, name):
+            query = type("Query", (), {})()
+            query.select = query.eq = query.order = query.range = lambda *args: query
+            query.execute = lambda: Result()
+            return query
+
+    def stream_rows(table, columns, company_id, window):
+        return iter(FUEL_ROWS if table == "fuel_records" else MAINTENANCE_ROWS)
+
+    monkeypatch.setattr(tco_module, "get_db", lambda: DB())
+    monkeypatch.setattr(tco_module, "stream_rows", stream_rows)
+
+def test_compute_tco_aggregates_vehicles_models_and_periods(company):
+    result = compute_tco("c", granularity="month")
+    assert result["fleet"]["total_cost"] == 730
+    assert result["fleet"]["miles"] == 700
+
+    v1 = next(entry for entry in result["vehicles"] if entry["vehicle_id"] == "v1")
+    assert v1["fuel_cost"] == 150 and v1["maintenance_cost"] == 300 and v1["maintenance_count"] == 1
+    assert v1["cost_per_mile"] == 0.75
+    assert [period["period_start"] for period in v1["periods"]] == ["2024-01-01", "2024-02-01"]
+    # Más caro por milla primero; sin millas al final
+    assert [entry["vehicle_id"] for entry in result["vehicles"]] == ["v2", "v1", "v3"]
+
+    models = {entry["model"]: entry for entry in result["models"]}
+    assert models["A"]["vehicles"] == 2 and models["A"]["total_cost"] == 530
+    assert models["unknown"]["total_cost"] == 200
+
+class FakeManager:
+    def __init__(self):
+        self.watched = []
+
+    def add_listener(self, callback):
+        pass
+
+    def watch_company(self, company_id):
+        self.watched.append(company_id)
+        return True
+
+def test_engine_caches_until_an_event_invalidates(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tco_module, "compute_tco", lambda *args: calls.append(args) or {"n": len(calls)})
+    manager = FakeManager()
+    engine = TCOEngine()
+    engine.attach(manager)
+
+    assert engine.get("c") == {"n": 1}
+    assert engine.get("c") == {"n": 1}
+    assert manager.watched == ["c"]
+
+    # Eventos de planes no cambian el TCO; los de combustible (de cualquier worker) sí
+    engine.on_event("c", {"type": "MAINTENANCE_PLAN_CREATED"}, False)
+    assert engine.get("c") == {"n": 1}
+    engine.on_event("c", {"type": "FUEL_RECORD_CREATED"}, False)
+    assert engine.get("c") == {"n": 2}
+
+def test_change_during_compute_is_not_cached(monkeypatch):
+    engine = TCOEngine()
+
+    def compute(*args):
+        engine.on_event("c", {"type": "VEHICLE_UPDATED"}, False)
+        return {}
+
+    monkeypatch.setattr(tco_module, "compute_tco", compute)
+    engine.get("c")
+    assert engine.stats()["cached_companies"] == 0
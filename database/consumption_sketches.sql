@@ -0,0 +1,20 @@
+-- Sketches t-digest del consumo por vehículo, modelo y flota (app/consumption_sketches.py)
+-- id = company_id:scope:key; sketch = {"c": [[media, peso], ...], "n", "min", "max", "k"} (~1 KB)
+create table if not exists consumption_sketches (
+    id text primary key,
+    company_id uuid not null,
+    scope text not null check (scope in ('fleet', 'model', 'vehicle')),
+    key text not null,
+    model text,
+    sample_count integer not null default 0,
+    sketch jsonb not null,
+    -- Control optimista: cada escritura exige la versión leída y la incrementa
+    version integer not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+alter table consumption_sketches add column if not exists version integer not null default 0;
+
+-- Merge de los sketches de vehículo de un modelo tras una edición/baja
+create index if not exists consumption_sketches_company_scope_model_idx
+    on consumption_sketches (company_id, scope, model);
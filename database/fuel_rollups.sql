@@ -0,0 +1,300 @@
+-- Agregados incrementales de combustible por empresa y por vehículo
+-- id = company_id (fila de empresa) o company_id:vehicle_id (fila de vehículo)
+create table if not exists fuel_rollups (
+    id text primary key,
+    company_id uuid not null,
+    vehicle_id uuid,
+    record_count integer not null default 0,
+    fuel_amount double precision not null default 0,
+    miles_driven double precision not null default 0,
+    total_cost double precision not null default 0,
+    consumption_sum double precision not null default 0,
+    min_consumption double precision,
+    max_consumption double precision,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists fuel_rollups_company_idx on fuel_rollups (company_id);
+
+-- Lock por empresa que serializa deltas, refrescos de extremos y el backfill.
+-- Es un advisory lock de transacción (y no un lock de fila) porque antes del
+-- backfill la fila de empresa no existe. Devuelve si la empresa ya tiene rollup.
+create or replace function lock_fuel_rollups(p_company_id uuid) returns boolean
+language plpgsql
+as $$
+begin
+    perform pg_advisory_xact_lock(hashtextextended('fuel_rollups:' || p_company_id::text, 0));
+    return exists (select 1 from fuel_rollups where id = p_company_id::text);
+end;
+$$;
+
+-- Aplica el delta de un registro a las filas de empresa y vehículo en una transacción.
+-- Si la empresa aún no tiene fila (sin backfill) no hace nada: la primera lectura
+-- reconstruye el rollup completo e incluye este registro.
+create or replace function apply_fuel_rollup_delta(
+    p_company_id uuid,
+    p_vehicle_id uuid,
+    d_count integer,
+    d_fuel double precision,
+    d_miles double precision,
+    d_cost double precision,
+    d_consumption_sum double precision,
+    p_consumption double precision default null
+) returns setof fuel_rollups
+language plpgsql
+as $$
+begin
+    if not lock_fuel_rollups(p_company_id) then
+        return;
+    end if;
+
+    return query
+    insert into fuel_rollups as r (
+        id, company_id, vehicle_id, record_count, fuel_amount, miles_driven,
+        total_cost, consumption_sum, min_consumption, max_consumption, updated_at
+    )
+    values
+        (p_company_id::text, p_company_id, null, d_count, d_fuel, d_miles,
+         d_cost, d_consumption_sum, p_consumption, p_consumption, now()),
+        (p_company_id::text || ':' || p_vehicle_id::text, p_company_id, p_vehicle_id, d_count, d_fuel, d_miles,
+         d_cost, d_consumption_sum, p_consumption, p_consumption, now())
+    on conflict (id) do update set
+        record_count = r.record_count + excluded.record_count,
+        fuel_amount = r.fuel_amount + excluded.fuel_amount,
+        miles_driven = r.miles_driven + excluded.miles_driven,
+        total_cost = r.total_cost + excluded.total_cost,
+        consumption_sum = r.consumption_sum + excluded.consumption_sum,
+        -- least/greatest ignoran null: un delta sin alta no toca los extremos
+        min_consumption = least(r.min_consumption, excluded.min_consumption),
+        max_consumption = greatest(r.max_consumption, excluded.max_consumption),
+        updated_at = now()
+    returning r.*;
+end;
+$$;
+
+-- Recalcula min/max de consumo de la fila de empresa (p_vehicle_id null) o de
+-- vehículo tras quitar un registro extremo: un min()/max() sobre fuel_records en
+-- lugar de reconstruir el rollup. Toma el mismo lock que apply_fuel_rollup_delta,
+-- así ningún delta concurrente queda entre la lectura y la escritura de los extremos.
+-- Una fila de vehículo que se quedó sin registros se elimina.
+create or replace function refresh_fuel_rollup_extremes(
+    p_company_id uuid,
+    p_vehicle_id uuid default null
+) returns void
+language plpgsql
+as $$
+declare
+    v_id text := p_company_id::text || coalesce(':' || p_vehicle_id::text, '');
+begin
+    if not lock_fuel_rollups(p_company_id) then
+        return;
+    end if;
+
+    if p_vehicle_id is not null then
+        delete from fuel_rollups where id = v_id and record_count <= 0;
+        if found then
+            return;
+        end if;
+    end if;
+
+    update fuel_rollups as r set
+        min_consumption = e.min_consumption,
+        max_consumption = e.max_consumption,
+        updated_at = now()
+    from (
+        select min(consumption) as min_consumption, max(consumption) as max_consumption
+        from fuel_records
+        where company_id = p_company_id
+          and (p_vehicle_id is null or vehicle_id = p_vehicle_id)
+    ) as e
+    where r.id = v_id;
+end;
+$$;
+
+-- Buckets diarios/semanales (ISO, lunes)/mensuales por empresa (vehicle_id null) y vehículo
+-- id = company_id:vehicle_id:granularity:period_start (vehicle_id vacío en filas de empresa)
+create table if not exists fuel_period_rollups (
+    id text primary key,
+    company_id uuid not null,
+    vehicle_id uuid,
+    granularity text not null check (granularity in ('day', 'week', 'month')),
+    period_start date not null,
+    record_count integer not null default 0,
+    fuel_amount double precision not null default 0,
+    miles_driven double precision not null default 0,
+    total_cost double precision not null default 0,
+    consumption_sum double precision not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists fuel_period_rollups_lookup_idx
+    on fuel_period_rollups (company_id, granularity, vehicle_id, period_start);
+
+-- Aplica el delta de un registro a sus 6 buckets (3 granularidades x empresa/vehículo).
+-- Mismo guard que apply_fuel_rollup_delta: sin backfill de la empresa no hace nada.
+create or replace function apply_fuel_period_delta(
+    p_company_id uuid,
+    p_vehicle_id uuid,
+    p_day date,
+    d_count integer,
+    d_fuel double precision,
+    d_miles double precision,
+    d_cost double precision,
+    d_consumption_sum double precision
+) returns void
+language plpgsql
+as $$
+declare
+    g text;
+    s date;
+    v uuid;
+begin
+    if not lock_fuel_rollups(p_company_id) then
+        return;
+    end if;
+
+    foreach g in array array['day', 'week', 'month'] loop
+        s := date_trunc(g, p_day)::date;
+        foreach v in array array[null, p_vehicle_id]::uuid[] loop
+            insert into fuel_period_rollups as r (
+                id, company_id, vehicle_id, granularity, period_start, record_count,
+                fuel_amount, miles_driven, total_cost, consumption_sum, updated_at
+            )
+            values (
+                p_company_id::text || ':' || coalesce(v::text, '') || ':' || g || ':' || s::text,
+                p_company_id, v, g, s, d_count, d_fuel, d_miles, d_cost, d_consumption_sum, now()
+            )
+            on conflict (id) do update set
+                record_count = r.record_count + excluded.record_count,
+                fuel_amount = r.fuel_amount + excluded.fuel_amount,
+                miles_driven = r.miles_driven + excluded.miles_driven,
+                total_cost = r.total_cost + excluded.total_cost,
+                consumption_sum = r.consumption_sum + excluded.consumption_sum,
+                updated_at = now();
+        end loop;
+    end loop;
+end;
+$$;
+
+-- Backfill de una empresa: agrega fuel_records en la BD (sin traer filas a la app,
+-- así no hay límite de max-rows que recorte el historial) y reemplaza sus filas de
+-- fuel_rollups y fuel_period_rollups en una transacción, bajo el lock de la empresa.
+-- Los deltas concurrentes esperan al backfill y se aplican encima. Si otro worker
+-- lo completó mientras se esperaba el lock, no hace nada.
+create or replace function rebuild_fuel_rollups(p_company_id uuid) returns void
+language plpgsql
+as $$
+begin
+    if lock_fuel_rollups(p_company_id) then
+        return;
+    end if;
+
+    delete from fuel_rollups where company_id = p_company_id;
+    delete from fuel_period_rollups where company_id = p_company_id;
+
+    -- El grouping set () produce la fila de empresa aunque no haya registros:
+    -- su existencia marca el rollup como completo
+    insert into fuel_rollups (
+        id, company_id, vehicle_id, record_count, fuel_amount, miles_driven,
+        total_cost, consumption_sum, min_consumption, max_consumption, updated_at
+    )
+    select
+        p_company_id::text || case when grouping(f.vehicle_id) = 0 then ':' || f.vehicle_id::text else '' end,
+        p_company_id,
+        case when grouping(f.vehicle_id) = 0 then f.vehicle_id end,
+        count(f.id),
+        coalesce(sum(f.fuel_amount), 0),
+        coalesce(sum(f.miles_driven), 0),
+        coalesce(sum(f.total_cost), 0),
+        coalesce(sum(f.consumption), 0),
+        min(coalesce(f.consumption, 0)),
+        max(coalesce(f.consumption, 0)),
+        now()
+    from fuel_records f
+    where f.company_id = p_company_id
+    group by grouping sets ((), (f.vehicle_id));
+
+    insert into fuel_period_rollups (
+        id, company_id, vehicle_id, granularity, period_start, record_count,
+        fuel_amount, miles_driven, total_cost, consumption_sum, updated_at
+    )
+    select
+        p_company_id::text || ':' || case when grouping(b.vehicle_id) = 0 then b.vehicle_id::text else '' end
+            || ':' || b.granularity || ':' || b.period_start::text,
+        p_company_id,
+        case when grouping(b.vehicle_id) = 0 then b.vehicle_id end,
+        b.granularity,
+        b.period_start,
+        count(*),
+        coalesce(sum(b.fuel_amount), 0),
+        coalesce(sum(b.miles_driven), 0),
+        coalesce(sum(b.total_cost), 0),
+        coalesce(sum(b.consumption), 0),
+        now()
+    from (
+        -- Mismo bucket que apply_fuel_period_delta: date_trunc del día del registro
+        select f.*, g.granularity, date_trunc(g.granularity, left(f.date::text, 10)::date)::date as period_start
+        from fuel_records f
+        cross join unnest(array['day', 'week', 'month']) as g(granularity)
+        where f.company_id = p_company_id and f.date is not null
+    ) as b
+    group by b.granularity, b.period_start, grouping sets ((), (b.vehicle_id));
+end;
+$$;
+
+-- Cambio completo de un registro (alta, edición o baja) en un solo round trip y
+-- una sola transacción: delta de empresa/vehículo, deltas de sus buckets y, si se
+-- quitó un extremo de consumo (o la fila quedó sin registros), el refresco de
+-- min/max. Así una escritura no puede quedar aplicada a medias.
+-- p_periods: [{"p_day", "d_count", "d_fuel", "d_miles", "d_cost", "d_consumption_sum"}]
+-- p_removed_consumption: consumo del registro quitado (null si no se quitó ninguno)
+create or replace function apply_fuel_record_change(
+    p_company_id uuid,
+    p_vehicle_id uuid,
+    d_count integer,
+    d_fuel double precision,
+    d_miles double precision,
+    d_cost double precision,
+    d_consumption_sum double precision,
+    p_consumption double precision default null,
+    p_periods jsonb default '[]'::jsonb,
+    p_removed_consumption double precision default null
+) returns void
+language plpgsql
+as $$
+declare
+    v_row fuel_rollups;
+    v_period jsonb;
+begin
+    -- El advisory lock es reentrante: las funciones de abajo lo vuelven a tomar sin esperar
+    if not lock_fuel_rollups(p_company_id) then
+        return;
+    end if;
+
+    for v_row in
+        select * from apply_fuel_rollup_delta(
+            p_company_id, p_vehicle_id, d_count, d_fuel, d_miles, d_cost, d_consumption_sum, p_consumption
+        )
+    loop
+        if p_removed_consumption is not null and (
+            v_row.record_count <= 0
+            or p_removed_consumption in (v_row.min_consumption, v_row.max_consumption)
+        ) then
+            perform refresh_fuel_rollup_extremes(p_company_id, v_row.vehicle_id);
+        end if;
+    end loop;
+
+    for v_period in select * from jsonb_array_elements(p_periods) loop
+        perform apply_fuel_period_delta(
+            p_company_id,
+            p_vehicle_id,
+            (v_period ->> 'p_day')::date,
+            (v_period ->> 'd_count')::integer,
+            (v_period ->> 'd_fuel')::double precision,
+            (v_period ->> 'd_miles')::double precision,
+            (v_period ->> 'd_cost')::double precision,
+            (v_period ->> 'd_consumption_sum')::double precision
+        );
+    end loop;
+end;
+$$;
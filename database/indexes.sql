@@ -0,0 +1,32 @@
+-- Índices para las consultas analíticas con ventana de fechas (?from=&to= / ?last_n_days=)
+--
+-- Todas filtran por empresa y luego por rango de `date`: con (company_id, date)
+-- Postgres hace un range scan del periodo en lugar de leer todo el historial
+-- del tenant y descartar filas. `concurrently` evita bloquear escrituras en
+-- producción (no puede correr dentro de una transacción).
+
+-- /metrics/, /fuel/analysis/consumption, /metrics/company/overview
+create index concurrently if not exists fuel_records_company_date_idx
+    on fuel_records (company_id, date);
+
+-- /metrics/vehicle/{id}: ventana + últimos registros ordenados por fecha
+create index concurrently if not exists fuel_records_company_vehicle_date_idx
+    on fuel_records (company_id, vehicle_id, date desc);
+
+-- /metrics/company/overview (conteo de mantenimientos del periodo)
+create index concurrently if not exists maintenance_company_date_idx
+    on maintenance (company_id, date);
+
+-- /metrics/tco: ambos streams ordenados por (vehicle_id, date, id) para el merge
+create index concurrently if not exists fuel_records_company_vehicle_date_id_idx
+    on fuel_records (company_id, vehicle_id, date, id);
+
+create index concurrently if not exists maintenance_company_vehicle_date_id_idx
+    on maintenance (company_id, vehicle_id, date, id);
+
+-- refresh_fuel_rollup_extremes: min()/max() de consumo por empresa y por vehículo
+create index concurrently if not exists fuel_records_company_consumption_idx
+    on fuel_records (company_id, consumption);
+
+create index concurrently if not exists fuel_records_company_vehicle_consumption_idx
+    on fuel_records (company_id, vehicle_id, consumption);
@@ -0,0 +1,20 @@
+-- Planes de mantenimiento preventivo: cada N millas y/o cada M días por tipo de
+-- mantenimiento, para un modelo o para toda la flota (model null).
+-- app/maintenance_planner.py proyecta el próximo vencimiento de cada vehículo.
+create table if not exists maintenance_plans (
+    id uuid primary key,
+    company_id uuid not null,
+    maintenance_type text not null,
+    model text,
+    interval_miles double precision check (interval_miles > 0),
+    interval_days integer check (interval_days > 0),
+    description text,
+    created_at timestamptz not null default now(),
+    check (interval_miles is not null or interval_days is not null)
+);
+
+create index if not exists maintenance_plans_company_idx on maintenance_plans (company_id);
+
+-- Último servicio de cada tipo por vehículo al cargar el planner
+create index if not exists maintenance_company_vehicle_type_date_idx
+    on maintenance (company_id, vehicle_id, maintenance_type, date desc);
@@ -0,0 +1,9 @@
+-- Capacidad del tanque por vehículo (litros) para el escáner de anomalías
+-- (app/fuel_anomalies.py): una carga por encima de la capacidad se marca como
+-- over_capacity. Nullable: sin dato el chequeo se omite para ese vehículo
+-- (o usa FUEL_DEFAULT_TANK_CAPACITY si está configurado).
+alter table vehicles add column if not exists tank_capacity numeric;
+
+-- Duplicados por vehículo ordenados por hora de carga (GET /fuel/anomalies)
+create index concurrently if not exists fuel_records_company_vehicle_created_idx
+    on fuel_records (company_id, vehicle_id, created_at);